@@ -0,0 +1,294 @@
+import asyncio
+import base64
+import re
+import smtplib
+import socket
+import ssl
+
+from mailer import SendResult, _breaks_session, _is_recipient_rejection, build_message, smtp_error_code
+from metrics import metrics
+from retry import TRANSIENT, RetryPolicy, classify_smtp_error
+
+# Only imported by the asyncio delivery path. Errors are raised as smtplib's
+# exception classes, so retry classification and dead-lettering work the same
+# as for the blocking SMTPPool.
+
+# A "." at the start of a line would end the DATA section early
+_LEADING_DOT = re.compile(rb"(?m)^\.")
+
+
+class AsyncSMTPConnection:
+    """One SMTP session over asyncio streams: EHLO, optional STARTTLS and AUTH, then any number of messages.
+
+    When the server advertises PIPELINING (RFC 2920), MAIL FROM, RCPT TO and
+    DATA go out in a single write and their replies are read together, so a
+    message costs two round trips instead of four.
+    """
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.extensions = {}
+        self.messages_sent = 0
+        self._reader = None
+        self._writer = None
+
+    async def _read_reply(self):
+        """Read one (possibly multi-line) reply; returns ``(code, text)``."""
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b"-":
+                return int(line[:3]), b"\n".join(lines)
+
+    async def _command(self, line, *expected):
+        self._writer.write(line + b"\r\n")
+        await self._writer.drain()
+        code, text = await self._read_reply()
+        if expected and code not in expected:
+            raise smtplib.SMTPResponseException(code, text)
+        return code, text
+
+    async def _ehlo(self):
+        _, text = await self._command(b"EHLO " + socket.getfqdn().encode("ascii", "replace"), 250)
+        self.extensions = {}
+        for line in text.decode("ascii", "replace").splitlines()[1:]:
+            keyword, _, params = line.partition(" ")
+            self.extensions[keyword.lower()] = params
+
+    async def connect(self):
+        with metrics.time("smtp.connect"):
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+        try:
+            code, text = await self._read_reply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, text)
+            with metrics.time("smtp.auth"):
+                await self._ehlo()
+                if self.starttls:
+                    if "starttls" not in self.extensions:
+                        raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+                    await self._command(b"STARTTLS", 220)
+                    await self._writer.start_tls(ssl.create_default_context(), server_hostname=self.host)
+                    await self._ehlo()
+                if self.username:
+                    await self._login()
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    async def _login(self):
+        mechanisms = self.extensions.get("auth", "").upper().split()
+        user, password = self.username.encode("utf-8"), (self.password or "").encode("utf-8")
+        if "PLAIN" in mechanisms or not mechanisms:
+            token = base64.b64encode(b"\0" + user + b"\0" + password)
+            code, text = await self._command(b"AUTH PLAIN " + token)
+        else:
+            await self._command(b"AUTH LOGIN", 334)
+            await self._command(base64.b64encode(user), 334)
+            code, text = await self._command(base64.b64encode(password))
+        if code != 235:
+            raise smtplib.SMTPAuthenticationError(code, text)
+
+    async def send(self, from_addr, to_addr, message):
+        """Send one message to one recipient, raising smtplib's exceptions on refusal."""
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        commands = [f"MAIL FROM:<{from_addr}>".encode("utf-8"), f"RCPT TO:<{to_addr}>".encode("utf-8"), b"DATA"]
+        if "pipelining" in self.extensions:
+            self._writer.write(b"".join(command + b"\r\n" for command in commands))
+            await self._writer.drain()
+            replies = [await self._read_reply() for _ in commands]
+        else:
+            # Without pipelining each command waits for the previous reply, and stops at the first refusal
+            replies = []
+            for command in commands:
+                replies.append(await self._command(command))
+                if replies[-1][0] not in (250, 251, 354):
+                    break
+        (mail_code, mail_text), *rest = replies
+        rcpt_code, rcpt_text = rest[0] if rest else (None, None)
+        data_code, data_text = rest[1] if len(rest) > 1 else (None, None)
+
+        if mail_code != 250 or rcpt_code not in (250, 251) or data_code != 354:
+            if data_code == 354:
+                # The server is waiting for a message we are not going to send; end it empty
+                self._writer.write(b".\r\n")
+                await self._writer.drain()
+                await self._read_reply()
+            await self._reset()
+            if mail_code != 250:
+                raise smtplib.SMTPSenderRefused(mail_code, mail_text, from_addr)
+            if rcpt_code not in (250, 251):
+                raise smtplib.SMTPRecipientsRefused({to_addr: (rcpt_code, rcpt_text)})
+            raise smtplib.SMTPDataError(data_code, data_text)
+
+        if not message.endswith(b"\r\n"):
+            message += b"\r\n"
+        if message.startswith(b".") or b"\n." in message:
+            message = _LEADING_DOT.sub(b"..", message)
+        self._writer.write(message + b".\r\n")
+        await self._writer.drain()
+        code, text = await self._read_reply()
+        if code != 250:
+            await self._reset()
+            raise smtplib.SMTPDataError(code, text)
+        self.messages_sent += 1
+
+    async def _reset(self):
+        try:
+            await self._command(b"RSET")
+        except (OSError, smtplib.SMTPException):
+            pass
+
+    async def noop(self):
+        return (await self._command(b"NOOP"))[0]
+
+    async def quit(self):
+        try:
+            await self._command(b"QUIT")
+        except (OSError, smtplib.SMTPException):
+            pass
+        self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class AsyncSMTPPool:
+    """Up to ``size`` concurrent SMTP sessions, opened lazily and reused, for one event loop.
+
+    The asyncio counterpart of :class:`~mailer.SMTPPool`: a semaphore bounds
+    the sends in flight, a session is recycled after
+    ``max_messages_per_connection`` messages, and a send that finds its
+    session closed by the server reconnects once.
+    """
+
+    def __init__(self, host, port, username=None, password=None, size=8,
+                 max_messages_per_connection=100, timeout=30, starttls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages_per_connection = max_messages_per_connection
+        self.timeout = timeout
+        self.starttls = starttls
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.stats = {"connections_opened": 0, "reconnects": 0, "messages_sent": 0}
+
+    async def _connect(self):
+        conn = AsyncSMTPConnection(self.host, self.port, self.username, self.password, self.starttls, self.timeout)
+        await conn.connect()
+        self.stats["connections_opened"] += 1
+        return conn
+
+    async def send(self, from_addr, to_addr, message):
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await self._connect()
+            try:
+                try:
+                    with metrics.time("smtp.send"):
+                        await conn.send(from_addr, to_addr, message)
+                except smtplib.SMTPServerDisconnected:
+                    conn.close()
+                    conn = None
+                    conn = await self._connect()
+                    self.stats["reconnects"] += 1
+                    metrics.increment("smtp.reconnects")
+                    with metrics.time("smtp.send"):
+                        await conn.send(from_addr, to_addr, message)
+            except Exception as e:
+                if conn is not None:
+                    if _breaks_session(e):
+                        conn.close()
+                    else:
+                        # Refused recipients and the like leave the session usable
+                        self._idle.append(conn)
+                raise
+            self.stats["messages_sent"] += 1
+            if conn.messages_sent >= self.max_messages_per_connection:
+                await conn.quit()
+            else:
+                self._idle.append(conn)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.quit()
+
+
+async def deliver_async(pool, from_addr, to_addr, message, scheduler=None, retry_policy=None):
+    """Async counterpart of :func:`mailer.deliver`: same retries, scheduling and :class:`~mailer.SendResult`."""
+    policy = retry_policy or RetryPolicy(attempts=1)
+    domain = to_addr.rpartition("@")[2].lower()
+    attempt = 1
+    while True:
+        if scheduler:
+            delay = scheduler.reserve(domain)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            await pool.send(from_addr, to_addr, message)
+        except Exception as e:
+            code = smtp_error_code(e)
+            if scheduler:
+                scheduler.record_failure(code)
+            transient = classify_smtp_error(e) == TRANSIENT
+            if transient and attempt < policy.attempts:
+                metrics.increment("smtp.retries")
+                await asyncio.sleep(policy.delay(attempt))
+                attempt += 1
+                continue
+            return SendResult(to_addr, False, attempt, str(e) or type(e).__name__, code,
+                              permanent=not transient, rejected=_is_recipient_rejection(e, code))
+        if scheduler:
+            scheduler.record_success()
+        return SendResult(to_addr, True, attempt)
+
+
+async def deliver_all(pool, from_addr, messages, attachment_path=None, scheduler=None, retry_policy=None,
+                      concurrency=8):
+    """Send ``(company, to_email, subject, body)`` items from an async iterable, ``concurrency`` at a time.
+
+    Yields ``(item, result)`` in completion order, like
+    :meth:`engine.SendEngine.run`. New items are only pulled while fewer than
+    ``concurrency`` sends are in flight, so a slow relay holds back the
+    generation stage feeding ``messages`` instead of piling up drafts.
+    """
+
+    async def send(item):
+        _, to_email, subject, body = item
+        try:
+            message = build_message(from_addr, to_email, subject, body, attachment_path)
+        except Exception as e:
+            return SendResult(to_email, False, 0, str(e) or type(e).__name__, permanent=True)
+        return await deliver_async(pool, from_addr, to_email, message, scheduler, retry_policy)
+
+    in_flight = {}
+    try:
+        async for item in messages:
+            in_flight[asyncio.ensure_future(send(item))] = item
+            if len(in_flight) >= concurrency:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield in_flight.pop(task), task.result()
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield in_flight.pop(task), task.result()
+    finally:
+        for task in in_flight:
+            task.cancel()
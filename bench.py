@@ -0,0 +1,939 @@
+"""Offline micro-benchmarks for the hot paths of internship.py.
+
+Nothing here talks to Gemini or a real SMTP relay, so the numbers are
+reproducible on any machine:
+
+    python bench.py mime --size-mb 2 --messages 500
+    python bench.py gemini --companies 200 --latency 0.3 --concurrency 8
+    python bench.py companies --counts 10000 100000 1000000
+    python bench.py startup --runs 5
+    python bench.py templates --renders 100000
+    python bench.py postprocess --rounds 2000
+    python bench.py engine --workers 1 2 4 8 --accounts 2 --latency 0.02
+    python bench.py async --concurrency 1 8 32 --latency 0.02 --gemini-latency 0.2
+    python bench.py e2e --companies 500 --gemini-error-rate 0.02 --output before.json
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import resource
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from companies import Company, iter_companies
+from gemini import build_email_prompts, generate_ai_email, generate_ai_emails_batch
+from mailer import build_message
+from pipeline import TokenBucket, generate_email_batches, generate_emails, generate_emails_async
+
+SAMPLE_BODY = """Dear HR Manager,
+
+I hope this email finds you well. I am currently seeking an internship
+opportunity in Web Development and have attached my CV for your review.
+
+Best regards,
+Jane Doe
+"""
+
+SAMPLE_BODY_FR = """Madame, Monsieur,
+
+Je suis actuellement à la recherche d'un stage en développement Web et je serais
+heureuse de rejoindre votre équipe. Vous trouverez mon CV en pièce jointe pour votre examen.
+
+Cordialement,
+Jane Doe
+"""
+
+
+def _legacy_build_message(from_addr, to_addr, subject, body, attachment_path):
+    """The per-message work send_email did before the attachment part was cached."""
+    msg = MIMEMultipart()
+    msg["From"] = from_addr
+    msg["To"] = to_addr
+    msg["Subject"] = subject
+    msg.attach(MIMEText(body, "plain"))
+    with open(attachment_path, "rb") as attachment:
+        part = MIMEBase("application", "octet-stream")
+        part.set_payload(attachment.read())
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", f"attachment; filename= {attachment_path}")
+        msg.attach(part)
+    return msg.as_string()
+
+
+def _legacy_clean_body(email_body):
+    """Body clean-up as gemini.py did it before the quality checks: it also deleted every "markdown"."""
+    email_body = email_body.replace('```', '').replace('markdown', '')
+    lines = email_body.split('\n')
+    clean_lines = []
+    for line in lines:
+        if not line.startswith(('Here is', 'Voici', 'Note:', 'Here\'s', 'I hope', 'This email')):
+            clean_lines.append(line)
+    return '\n'.join(clean_lines).strip()
+
+
+def _legacy_clean_subject(email_subject):
+    """Subject clean-up as gemini.py did it before the quality checks."""
+    email_subject = email_subject.replace('"', '').replace("'", '').strip()
+    if email_subject.lower().startswith('subject:'):
+        email_subject = email_subject[8:].strip()
+    if email_subject.lower().startswith('objet:'):
+        email_subject = email_subject[6:].strip()
+    return email_subject
+
+
+POSTPROCESS_SENDER = "Jane Doe"
+
+_ENGLISH_BODY = """Dear HR Manager,
+
+I am writing to apply for a Web Development internship at Acme. I have followed your work on
+developer tools for a while and would love to contribute to the team that builds them. During my
+studies I built several web applications with React and Django, and I enjoy turning designs into
+fast, accessible interfaces. My CV is attached for your review.
+
+Looking forward to your response. Best regards, Jane Doe"""
+
+_FRENCH_BODY = """Madame, Monsieur,
+
+Je vous écris pour vous présenter ma candidature à un stage en développement Web au sein de votre
+entreprise. Je suis très intéressée par vos projets et je serais heureuse de mettre mes compétences
+au service de votre équipe. Vous trouverez mon CV en pièce jointe pour votre considération.
+
+Dans l'attente de votre réponse. Cordialement, Jane Doe"""
+
+# Canned Gemini answers: (case, language, subject, body)
+POSTPROCESS_CORPUS = [
+    ("clean", "English", "Web Development Internship Application - Jane Doe", _ENGLISH_BODY),
+    ("fenced", "English", "**Subject: Internship Application - Jane Doe**",
+     "```markdown\n" + _ENGLISH_BODY + "\n```"),
+    ("commentary", "English", '"Internship Application from Jane Doe"',
+     "Here's a professional email for your application:\n\n" + _ENGLISH_BODY
+     + "\n\nI hope this helps with your application!"),
+    ("placeholders", "English", "Internship Application - [Your Name]",
+     _ENGLISH_BODY.replace("Dear HR Manager", "Dear [Hiring Manager]").replace("Jane Doe", "[Your Name]")),
+    ("wrong language", "English", "Candidature de stage - Jane Doe", _FRENCH_BODY),
+    ("no sign-off", "English", "Internship Application - Jane Doe",
+     _ENGLISH_BODY.rsplit("\n\n", 1)[0]),
+    ("long subject", "English",
+     "Application for a Web Development Internship Position at Acme Corporation from Jane Doe", _ENGLISH_BODY),
+    ("mentions markdown", "English", "Internship Application - Jane Doe",
+     _ENGLISH_BODY.replace("React and Django", "React, Django and markdown-based static sites")),
+    ("hope greeting", "English", "Jane Doe's Internship Application",
+     _ENGLISH_BODY.replace("Dear HR Manager,\n", "Dear HR Manager,\n\nI hope you are doing well.")),
+    ("french", "French", "Candidature de stage en développement Web - Jane Doe", _FRENCH_BODY),
+    ("french quotes", "French", "« Candidature de stage – l'équipe Web »",
+     "Voici l'email demandé :\n" + _FRENCH_BODY),
+]
+
+
+def bench_postprocess(args):
+    """Clean-up throughput and problems found over a corpus of canned Gemini answers."""
+    from quality import check_email
+
+    def legacy(_):
+        for _, _, subject, body in POSTPROCESS_CORPUS:
+            _legacy_clean_subject(subject.strip())
+            _legacy_clean_body(body.strip())
+
+    def checked(_):
+        for _, language, subject, body in POSTPROCESS_CORPUS:
+            check_email(subject, body, POSTPROCESS_SENDER, language)
+
+    legacy_cost = _time_per_call(legacy, args.rounds) / len(POSTPROCESS_CORPUS)
+    checked_cost = _time_per_call(checked, args.rounds) / len(POSTPROCESS_CORPUS)
+
+    print(f"Post-processing, {len(POSTPROCESS_CORPUS)} canned answers x {args.rounds} rounds")
+    print(f"  legacy clean-up (no checks):  {legacy_cost * 1e6:8.1f} µs/email")
+    print(f"  clean-up + quality checks:    {checked_cost * 1e6:8.1f} µs/email")
+    print(f"  {'case':<18} {'legacy subject':<15} {'legacy body':<12} problems found")
+    for case, language, subject, body in POSTPROCESS_CORPUS:
+        verdict = check_email(subject, body, POSTPROCESS_SENDER, language)
+        subject_same = "same" if _legacy_clean_subject(subject.strip()) == verdict.subject else "differs"
+        body_same = "same" if _legacy_clean_body(body.strip()) == verdict.body else "differs"
+        problems = ", ".join(f"{part}.{code}" for part, code, _ in verdict.problems) or "-"
+        print(f"  {case:<18} {subject_same:<15} {body_same:<12} {problems}")
+
+
+class FakeGeminiError(Exception):
+    """An API error as google-genai raises it, with an HTTP status ``code``."""
+
+    def __init__(self, code):
+        super().__init__(f"{code} fake Gemini error")
+        self.code = code
+
+
+class FakeGeminiClient:
+    """Stands in for ``genai.Client``: each request sleeps ``latency`` seconds and returns canned text.
+
+    With ``jitter``, latencies are log-normal around a median of ``latency``
+    (``jitter`` is the sigma), so some requests are much slower than most.
+    A fraction ``error_rate`` of requests fail with ``FakeGeminiError(error_code)``;
+    503 is retried like a real outage, 400 is not.
+    """
+
+    class _Response:
+        def __init__(self, text):
+            self.text = text
+
+    class _AsyncModels:
+        def __init__(self, client):
+            self.client = client
+            self.models = self
+
+        async def generate_content(self, model, contents, config=None):
+            import asyncio
+
+            await asyncio.sleep(self.client._delay())
+            return self.client._respond(contents, config)
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_code=503, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.random = random.Random(seed)
+        self.models = self
+        self.aio = self._AsyncModels(self)
+        self.requests = 0
+        self.errors = 0
+
+    def _delay(self):
+        if self.jitter and self.latency:
+            return self.random.lognormvariate(math.log(self.latency), self.jitter)
+        return self.latency
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(self._delay())
+        return self._respond(contents, config)
+
+    def _respond(self, contents, config):
+        self.requests += 1
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            raise FakeGeminiError(self.error_code)
+        if config is not None and config.response_mime_type == "application/json":
+            # Batch request: answer for every company listed on the prompt's last line
+            companies = json.loads(contents.strip().splitlines()[-1])
+            body = SAMPLE_BODY_FR if "email in French" in contents else SAMPLE_BODY
+            return self._Response(json.dumps([
+                {"id": c["id"], "name": c["name"],
+                 "subject": "Web Development Internship Application - Jane Doe", "body": body}
+                for c in companies
+            ], ensure_ascii=False))
+        if contents.lstrip().startswith(("Create a concise", "Crée un objet")):
+            return self._Response("Web Development Internship Application - Jane Doe")
+        return self._Response(SAMPLE_BODY_FR if contents.lstrip().startswith("Écris") else SAMPLE_BODY)
+
+
+def synthetic_company(i):
+    """The i-th company of a synthetic list; every third one is French."""
+    return Company(
+        f"Company {i}",
+        f"contact@company{i}.example",
+        "HR Manager",
+        language="French" if i % 3 == 0 else "English",
+        city="Tangier",
+        extra={"position": "Full Stack Web Developer"},
+    )
+
+
+def synthetic_companies(count):
+    return [synthetic_company(i) for i in range(count)]
+
+
+def _time_per_call(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count
+
+
+def bench_mime(args):
+    """Per-message cost of building the email, before and after caching the resume part."""
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as resume:
+        resume.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+    try:
+        def legacy(i):
+            _legacy_build_message("me@example.com", f"hr{i}@example.com",
+                                  "Internship Application", SAMPLE_BODY, resume.name)
+
+        def cached(i):
+            build_message("me@example.com", f"hr{i}@example.com",
+                          "Internship Application", SAMPLE_BODY, resume.name)
+
+        legacy_cost = _time_per_call(legacy, args.messages)
+        cached_cost = _time_per_call(cached, args.messages)
+    finally:
+        os.remove(resume.name)
+
+    print(f"MIME build, {args.size_mb} MB attachment, {args.messages} messages")
+    print(f"  legacy (read + encode + as_string): {legacy_cost * 1000:8.3f} ms/message")
+    print(f"  cached part + bytes splice:         {cached_cost * 1000:8.3f} ms/message")
+    print(f"  speedup: {legacy_cost / cached_cost:.1f}x")
+
+
+def bench_gemini(args):
+    """Wall-clock time to generate emails for a company list against a fake client with injected latency."""
+    companies = synthetic_companies(args.companies)
+
+    client = FakeGeminiClient(args.latency)
+    start = time.perf_counter()
+    for company in companies:
+        # Before: body request, then subject request, one company at a time
+        body_prompt, subject_prompt = build_email_prompts(
+            "Jane Doe", company.name, company.contact_person, company.city, company.language
+        )
+        client.generate_content(model=None, contents=body_prompt)
+        client.generate_content(model=None, contents=subject_prompt)
+    sequential = time.perf_counter() - start
+
+    client = FakeGeminiClient(args.latency)
+    rate_limiter = TokenBucket.per_minute(args.rpm, capacity=args.concurrency) if args.rpm else None
+
+    def generate(company):
+        return generate_ai_email(
+            None, "Jane Doe", company.name, company.contact_person, company.city,
+            company.language, client=client, rate_limiter=rate_limiter
+        )
+
+    def generate_batch(language, batch):
+        return generate_ai_emails_batch(
+            None, "Jane Doe", batch, language, client=client, rate_limiter=rate_limiter
+        )
+
+    start = time.perf_counter()
+    if args.batch_size > 1:
+        drafts = generate_email_batches(companies, generate_batch, args.batch_size, args.concurrency)
+    else:
+        drafts = generate_emails(companies, generate, args.concurrency)
+    for _ in drafts:
+        pass
+    pipelined = time.perf_counter() - start
+
+    print(f"Gemini generation, {args.companies} companies, {args.latency * 1000:.0f} ms per request"
+          + (f", {args.rpm:g} requests/min" if args.rpm else "")
+          + (f", batches of {args.batch_size}" if args.batch_size > 1 else ""))
+    print(f"  sequential (no sleeps):      {sequential:8.2f} s")
+    print(f"  pipelined, concurrency {args.concurrency:<3}: {pipelined:8.2f} s ({client.requests} requests)")
+    print(f"  speedup: {sequential / pipelined:.1f}x")
+
+
+def write_companies_file(path, count):
+    """Write ``count`` synthetic companies as a JSON array, or one per line for .jsonl paths."""
+    with open(path, "w", encoding="utf-8") as file:
+        json_lines = path.endswith(".jsonl")
+        file.write("" if json_lines else "[")
+        for i in range(count):
+            company = synthetic_company(i).to_dict()
+            if json_lines:
+                file.write(json.dumps(company) + "\n")
+            else:
+                file.write(("," if i else "") + "\n    " + json.dumps(company, indent=4).replace("\n", "\n    "))
+        file.write("" if json_lines else "\n]")
+
+
+def _load_companies(args):
+    """Child process for bench_companies: load one file and report timings and peak RSS as JSON."""
+    start = time.perf_counter()
+    first = None
+    count = 0
+    if args.mode == "json.load":
+        with open(args.path, "r", encoding="utf-8") as file:
+            records = json.load(file)
+        for _ in records:
+            count += 1
+            if first is None:
+                first = time.perf_counter() - start
+    else:
+        for _ in iter_companies(args.path):
+            count += 1
+            if first is None:
+                first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"count": count, "first": first, "total": total, "peak_kb": peak_kb}))
+
+
+def bench_companies(args):
+    """Time-to-first-record and peak RSS of json.load vs the streaming loader."""
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'companies':>10} {'loader':<16} {'first record':>13} {'total':>9} {'peak RSS':>10}")
+        for count in args.counts:
+            array_path = os.path.join(directory, f"companies-{count}.json")
+            lines_path = os.path.join(directory, f"companies-{count}.jsonl")
+            write_companies_file(array_path, count)
+            write_companies_file(lines_path, count)
+            for mode, path in (("json.load", array_path), ("stream array", array_path), ("stream jsonl", lines_path)):
+                # Each loader runs in a fresh process so peak RSS isn't shared between them
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "_load", mode, path],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                result = json.loads(output)
+                print(f"{count:>10} {mode:<16} {result['first'] * 1000:>10.1f} ms {result['total']:>7.2f} s "
+                      f"{result['peak_kb'] / 1024:>7.1f} MB")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """A local stand-in for an SMTP relay: accepts every message and throws it away.
+
+    Each DATA command takes ``latency`` seconds to acknowledge, like a real
+    relay's queueing delay. ``messages`` counts the accepted messages.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    # The default backlog of 5 drops connections opened together, adding a 1 s SYN retry to smtp.connect
+    request_queue_size = 128
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(line.encode("ascii") + b"\r\n")
+
+        def handle(self):
+            self.reply("220 sink ESMTP")
+            for line in self.rfile:
+                command = line[:4].upper()
+                if command in (b"EHLO", b"HELO"):
+                    # One write: a reply split over two segments waits out the client's delayed ACK
+                    self.reply("250-sink\r\n250 AUTH PLAIN")
+                elif command == b"AUTH":
+                    self.reply("235 Authentication successful")
+                elif command == b"DATA":
+                    self.reply("354 End data with <CR><LF>.<CR><LF>")
+                    # Read in large chunks; scanning line by line would make the sink the bottleneck
+                    tail = b""
+                    while not tail.endswith(b"\r\n.\r\n"):
+                        chunk = self.rfile.read1(65536)
+                        if not chunk:
+                            return
+                        tail = (tail + chunk)[-5:]
+                    time.sleep(self.server.latency)
+                    with self.server.lock:
+                        self.server.messages += 1
+                    self.reply("250 OK")
+                elif command == b"QUIT":
+                    self.reply("221 Bye")
+                    return
+                else:
+                    self.reply("250 OK")
+
+    def __init__(self, latency=0.0):
+        super().__init__(("127.0.0.1", 0), self.Handler)
+        self.latency = latency
+        self.messages = 0
+        self.lock = threading.Lock()
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def bench_engine(args):
+    """Delivery throughput to local SMTP sinks with 1..N sender worker processes."""
+    from engine import SendEngine
+
+    sinks = [SMTPSink(args.latency) for _ in range(args.accounts)]
+    accounts = [{"server": "127.0.0.1", "port": sink.port, "username": None, "from": "jane@example.com",
+                 "starttls": False} for sink in sinks]
+    # Recipients spread over many domains, so every worker gets a share
+    messages = [
+        (company, f"hr@domain{i % 97}.example", "Internship Application", SAMPLE_BODY)
+        for i, company in enumerate(synthetic_companies(args.messages))
+    ]
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as resume:
+        resume.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+    try:
+        print(f"Sending engine, {args.messages} messages, {args.size_mb} MB attachment, "
+              f"{args.accounts} sink(s) with {args.latency * 1000:.0f} ms per message")
+        baseline = None
+        for workers in args.workers:
+            engine = SendEngine(accounts, workers, resume.name, scheduler_settings={"min_interval": 0})
+            start = time.perf_counter()
+            failures = [result for _, result in engine.run(messages) if not result]
+            elapsed = time.perf_counter() - start
+            rate = args.messages / elapsed
+            baseline = baseline or rate
+            print(f"  {workers:>3} worker(s): {elapsed:7.2f} s {rate:8.1f} messages/s "
+                  f"({rate / baseline:.1f}x, {len(failures)} failed)")
+    finally:
+        os.remove(resume.name)
+        for sink in sinks:
+            sink.shutdown()
+
+
+class AsyncSMTPSink:
+    """Like :class:`SMTPSink`, but served by asyncio on its own thread, so thousands of sessions cost no threads.
+
+    Advertises PIPELINING, so the async client sends MAIL/RCPT/DATA in one write.
+    """
+
+    def __init__(self, latency=0.0):
+        import asyncio
+
+        self.latency = latency
+        self.messages = 0
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+            self.port = self.server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait()
+
+    async def _handle(self, reader, writer):
+        import asyncio
+
+        def reply(line):
+            writer.write(line.encode("ascii") + b"\r\n")
+
+        reply("220 sink ESMTP")
+        while line := await reader.readline():
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                reply("250-sink")
+                reply("250-AUTH PLAIN")
+                reply("250 PIPELINING")
+            elif command == b"AUTH":
+                reply("235 Authentication successful")
+            elif command == b"DATA":
+                reply("354 End data with <CR><LF>.<CR><LF>")
+                await writer.drain()
+                # Read in large chunks; readuntil() would need the whole message in one buffer
+                tail = b""
+                while not tail.endswith(b"\r\n.\r\n"):
+                    chunk = await reader.read(65536)
+                    if not chunk:
+                        return
+                    tail = (tail + chunk)[-5:]
+                await asyncio.sleep(self.latency)
+                self.messages += 1
+                reply("250 OK")
+            elif command == b"QUIT":
+                reply("221 Bye")
+                break
+            else:
+                reply("250 OK")
+            await writer.drain()
+        await writer.drain()
+        writer.close()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def bench_async(args):
+    """Asyncio delivery throughput against a local async SMTP sink, at several concurrency levels.
+
+    With ``--gemini-latency``, each message is first generated by a fake async
+    Gemini client on the same event loop, as ``send --ai --concurrency N`` does.
+    """
+    import asyncio
+
+    from async_mailer import AsyncSMTPPool, deliver_all
+    from gemini import generate_ai_email_async
+
+    sink = AsyncSMTPSink(args.latency)
+    companies = synthetic_companies(args.messages)
+    client = FakeGeminiClient(args.gemini_latency)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as resume:
+        resume.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+
+    async def run(concurrency):
+        pool = AsyncSMTPPool("127.0.0.1", sink.port, size=concurrency, starttls=False)
+
+        async def generate(company):
+            if not args.gemini_latency:
+                return "Internship Application", SAMPLE_BODY
+            return await generate_ai_email_async(None, "Jane Doe", company.name, company.contact_person,
+                                                 company.city, company.language, client=client)
+
+        async def outgoing():
+            async for company, (subject, body) in generate_emails_async(companies, generate, concurrency):
+                # Recipients spread over many domains, as in a real list
+                yield company, f"hr@domain{company.name.split()[-1]}.example", subject, body
+
+        failures = 0
+        try:
+            async for _, result in deliver_all(pool, "jane@example.com", outgoing(), resume.name,
+                                               concurrency=concurrency):
+                failures += not result
+        finally:
+            await pool.close()
+        return failures, pool.stats["connections_opened"]
+
+    try:
+        print(f"Async delivery, {args.messages} messages, {args.size_mb} MB attachment, sink taking "
+              f"{args.latency * 1000:.0f} ms per message" +
+              (f", Gemini {args.gemini_latency * 1000:.0f} ms per request" if args.gemini_latency else ""))
+        baseline = None
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            failures, connections = asyncio.run(run(concurrency))
+            elapsed = time.perf_counter() - start
+            rate = args.messages / elapsed
+            baseline = baseline or rate
+            print(f"  concurrency {concurrency:>3}: {elapsed:7.2f} s {rate:8.1f} messages/s "
+                  f"({rate / baseline:.1f}x, {connections} session(s), {failures} failed)")
+    finally:
+        os.remove(resume.name)
+        sink.shutdown()
+
+
+# internship.py commands run by bench_e2e, per flow
+E2E_FLOWS = {
+    "template": ["send", "--template", "--actual"],
+    "ai": ["send", "--ai", "--actual"],
+    "preview": ["preview", "--then", "send", "--actual"],
+}
+
+
+def _run_flow(args):
+    """Child process for bench_e2e: run one internship.py flow with a fake Gemini client and report as JSON."""
+    config = json.loads(args.config)
+    os.environ.update(config["env"])
+
+    import gemini
+    client = FakeGeminiClient(config["gemini_latency"], config["gemini_jitter"], config["gemini_error_rate"],
+                              config["gemini_error_code"], config["seed"])
+    gemini.get_client = lambda api_key: client
+
+    import internship
+    from metrics import metrics
+
+    start = time.perf_counter()
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        internship.main(config["argv"])
+    elapsed = time.perf_counter() - start
+
+    sent = metrics.counters.get("emails.sent", 0)
+    result = {
+        "elapsed": elapsed,
+        "sent": sent,
+        "failed": metrics.counters.get("emails.failed", 0),
+        "messages_per_sec": sent / elapsed if elapsed else 0.0,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "gemini_requests": client.requests,
+        "gemini_injected_errors": client.errors,
+        "stages": {
+            stage: {"count": h.count, "total_s": h.sum, "p50_ms": h.quantile(0.5) * 1000,
+                    "p99_ms": h.quantile(0.99) * 1000, "max_ms": h.max * 1000}
+            for stage, h in sorted(metrics.histograms.items())
+        },
+        "counters": dict(sorted(metrics.counters.items())),
+    }
+    with open(args.result, "w", encoding="utf-8") as file:
+        json.dump(result, file)
+
+
+def _version():
+    """The checked-out commit, so results from different versions can be told apart."""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_e2e(args):
+    """Whole internship.py runs against a local SMTP sink and a fake Gemini backend, reported as JSON.
+
+    Each flow runs in a fresh interpreter (so peak RSS is its own) on a fresh
+    synthetic companies file, with every pacing sleep configured away.
+    """
+    sink = SMTPSink(args.sink_latency)
+    report = {
+        "version": _version(),
+        "python": sys.version.split()[0],
+        "started": time.time(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("func", "output", "compare")},
+        "flows": {},
+    }
+    print(f"End-to-end, {args.companies} companies, sink {args.sink_latency * 1000:.0f} ms per message, "
+          f"Gemini {args.gemini_latency * 1000:.0f} ms (jitter {args.gemini_jitter}, "
+          f"{args.gemini_error_rate:.0%} errors with {args.gemini_error_code})")
+    print(f"  {'flow':<10} {'sent':>6} {'failed':>6} {'time s':>8} {'msg/s':>8} {'peak RSS':>9}  slowest stages (p50/p99 ms)")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            resume = os.path.join(directory, "resume.pdf")
+            with open(resume, "wb") as file:
+                file.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+            for flow in args.flows:
+                companies = os.path.join(directory, f"{flow}.jsonl")
+                write_companies_file(companies, args.companies)
+                argv = ["--no-cache", "--companies", companies]
+                if args.batch_size:
+                    argv += ["--batch-size", str(args.batch_size)]
+                argv += E2E_FLOWS[flow]
+                if flow != "preview":
+                    argv += ["--workers", str(args.workers), "--concurrency", str(args.concurrency)]
+                config = {
+                    "argv": argv,
+                    "env": {
+                        "MY_NAME": "Jane Doe", "MY_EMAIL": "jane@example.com", "MY_PHONE": "+212 600 000 000",
+                        "MY_RESUME_PATH": resume, "SMTP_SERVER": "127.0.0.1", "SMTP_PORT": str(sink.port),
+                        "EMAIL_USERNAME": "jane@example.com", "EMAIL_PASSWORD": "bench", "SMTP_STARTTLS": "false",
+                        "TEST_EMAIL": "inbox@example.com", "GEMINI_API_KEY": "fake",
+                        "GEMINI_CONCURRENCY": str(args.gemini_concurrency), "GEMINI_REQUESTS_PER_MINUTE": "1000000",
+                        # No pacing: measure the code, not the configured sleeps
+                        "SEND_PER_MINUTE": "0", "SEND_PER_HOUR": "", "SEND_PER_DAY": "", "SEND_DOMAIN_SPACING": "0",
+                        "SEND_MIN_INTERVAL": "0", "SEND_GLOBAL_PER_MINUTE": "",
+                        # Keep settings from a local .env out of the measurement
+                        "SMTP_ACCOUNTS_FILE": "", "SEND_WORKERS": "", "SEND_CONCURRENCY": "", "GEMINI_BATCH_SIZE": "",
+                        "USE_RESEARCH": "", "METRICS_LOG": "", "METRICS_PROMETHEUS_FILE": "", "TEMPLATES_DIR": "",
+                        "OUTBOX_DIR": os.path.join(directory, "outbox"),
+                        # Each flow emails the same synthetic inboxes, so each needs its own contact index
+                        "CONTACTS_INDEX": companies + ".contacts.jsonl", "MAX_PER_DOMAIN": "",
+                        "RESEARCH_REPORT": os.path.join(directory, "research.md"),
+                    },
+                    "gemini_latency": args.gemini_latency,
+                    "gemini_jitter": args.gemini_jitter,
+                    "gemini_error_rate": args.gemini_error_rate,
+                    "gemini_error_code": args.gemini_error_code,
+                    "seed": args.seed,
+                }
+                result_path = os.path.join(directory, f"{flow}.result.json")
+                sink_before = sink.messages
+                subprocess.run([sys.executable, os.path.abspath(__file__), "_e2e", json.dumps(config), result_path],
+                               check=True)
+                with open(result_path, encoding="utf-8") as file:
+                    result = json.load(file)
+                result["argv"] = argv
+                result["sink_messages"] = sink.messages - sink_before
+                report["flows"][flow] = result
+
+                slowest = sorted(result["stages"].items(), key=lambda item: -item[1]["total_s"])[:3]
+                print(f"  {flow:<10} {result['sent']:>6} {result['failed']:>6} {result['elapsed']:>8.2f} "
+                      f"{result['messages_per_sec']:>8.1f} {result['peak_rss_mb']:>6.1f} MB  " +
+                      ", ".join(f"{stage} {s['p50_ms']:.1f}/{s['p99_ms']:.1f}" for stage, s in slowest))
+    finally:
+        sink.shutdown()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = json.load(file)
+        print(f"  compared with {args.compare} ({previous.get('version')}):")
+        for flow, result in report["flows"].items():
+            before = previous.get("flows", {}).get(flow)
+            if before and before["messages_per_sec"]:
+                print(f"    {flow:<10} {result['messages_per_sec'] / before['messages_per_sec']:.2f}x messages/s, "
+                      f"peak RSS {result['peak_rss_mb'] - before['peak_rss_mb']:+.1f} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"  results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+SENDER_CONTEXT = {"sender_name": "Jane Doe", "sender_phone": "+212 600 000 000", "sender_email": "jane@example.com"}
+
+
+def bench_templates(args):
+    """Template rendering throughput: a Template built per message vs the precompiled registry."""
+    from jinja2 import Template
+    from template_registry import TemplateRegistry
+
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+    companies = synthetic_companies(args.renders)
+    sources = {}
+    for code in ("en", "fr"):
+        with open(os.path.join(directory, code + ".txt"), encoding="utf-8") as file:
+            sources[code] = file.read()
+
+    # Before: a new Template for every company (timed on a prefix; compiling is the whole cost)
+    legacy_count = min(args.renders, args.legacy_renders)
+    start = time.perf_counter()
+    for company in companies[:legacy_count]:
+        Template(sources["fr" if company.language == "French" else "en"]).render(
+            name=company.name, contact_person=company.contact_person, **SENDER_CONTEXT
+        )
+    legacy_rate = legacy_count / (time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # First render per process: compile from source, then load the cached bytecode in a fresh registry
+        first_render = []
+        for _ in range(2):
+            registry = TemplateRegistry(directory, cache_dir=cache_dir)
+            start = time.perf_counter()
+            registry.get("English")
+            registry.get("French")
+            first_render.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in registry.render_many(companies, **SENDER_CONTEXT):
+            pass
+        batch_rate = args.renders / (time.perf_counter() - start)
+
+    print(f"Template rendering, {args.renders} companies ({len(registry.languages())} languages)")
+    print(f"  Template() per message:   {legacy_rate:>10,.0f} messages/s ({legacy_count} renders)")
+    print(f"  registry render_many:     {batch_rate:>10,.0f} messages/s")
+    print(f"  speedup: {batch_rate / legacy_rate:.1f}x")
+    print(f"  loading en + fr: {first_render[0] * 1000:.1f} ms compiled, {first_render[1] * 1000:.1f} ms from bytecode cache")
+
+
+# Heavy modules that importing internship.py must not pull in; they load on first use
+DEFERRED_MODULES = ("google.genai", "jinja2", "email.mime", "smtplib", "requests", "bs4", "lxml")
+
+
+def _import_profile(module):
+    """Import ``module`` in a fresh interpreter under ``-X importtime``.
+
+    Returns ``(name, depth, self_us, cumulative_us)`` rows in the order Python printed them.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def bench_startup(args):
+    """Import time of a module and what it pulls in, plus wall-clock start of ``internship.py --help``."""
+    # Keep the fastest run: import times only get noisier upwards
+    rows = min((_import_profile(args.module) for _ in range(args.runs)), key=lambda rows: rows[-1][3])
+    # The module is printed last, after everything it imported; anything earlier was loaded by site
+    _, depth, _, total_us = rows[-1]
+    first = len(rows) - 1
+    while first > 0 and rows[first - 1][1] > depth:
+        first -= 1
+    rows = rows[first:]
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "internship.py")
+    wall = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, "--help"], check=True, capture_output=True)
+        wall.append(time.perf_counter() - start)
+    wall.sort()
+
+    print(f"Startup, best of {args.runs} runs")
+    print(f"  import {args.module}: {total_us / 1000:8.1f} ms")
+    print(f"  internship.py --help (process wall time, median): {wall[len(wall) // 2] * 1000:8.1f} ms")
+    print(f"  slowest imports under {args.module}:")
+    children = [row for row in rows if row[1] == depth + 1]
+    for name, _, _, cumulative_us in sorted(children, key=lambda row: -row[3])[:args.top]:
+        print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+    print("  deferred modules:")
+    for module in DEFERRED_MODULES:
+        loaded = [row for row in rows if row[0] == module or row[0].startswith(module + ".")]
+        if loaded:
+            print(f"    ⚠️ {module} imported at startup ({max(row[3] for row in loaded) / 1000:.1f} ms)")
+        else:
+            print(f"    ✅ {module} not imported")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for internship.py")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    mime = subparsers.add_parser("mime", help="MIME message build cost per recipient")
+    mime.add_argument("--size-mb", type=float, default=2.0, help="Size of the synthetic resume")
+    mime.add_argument("--messages", type=int, default=200, help="Messages to build per variant")
+    mime.set_defaults(func=bench_mime)
+
+    gemini = subparsers.add_parser("gemini", help="AI email generation throughput with a fake Gemini client")
+    gemini.add_argument("--companies", type=int, default=100, help="Number of synthetic companies")
+    gemini.add_argument("--latency", type=float, default=0.2, help="Injected seconds per Gemini request")
+    gemini.add_argument("--concurrency", type=int, default=8, help="Companies generated in parallel")
+    gemini.add_argument("--rpm", type=float, default=0, help="Requests-per-minute limit (0 = unlimited)")
+    gemini.add_argument("--batch-size", type=int, default=1, help="Companies per batched request (1 = no batching)")
+    gemini.set_defaults(func=bench_gemini)
+
+    companies = subparsers.add_parser("companies", help="Streaming vs json.load for large companies files")
+    companies.add_argument("--counts", type=int, nargs="+", default=[10000, 100000],
+                           help="Synthetic list sizes to generate")
+    companies.set_defaults(func=bench_companies)
+
+    startup = subparsers.add_parser("startup", help="Import-time report for internship.py startup")
+    startup.add_argument("--module", default="internship", help="Module to import")
+    startup.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start")
+    startup.add_argument("--top", type=int, default=10, help="Slowest direct imports to list")
+    startup.set_defaults(func=bench_startup)
+
+    engine = subparsers.add_parser("engine", help="Multi-process delivery throughput against local SMTP sinks")
+    engine.add_argument("--messages", type=int, default=400, help="Messages to deliver per run")
+    engine.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to compare")
+    engine.add_argument("--accounts", type=int, default=2, help="Local SMTP sinks standing in for relay accounts")
+    engine.add_argument("--latency", type=float, default=0.02, help="Seconds each sink takes to accept a message")
+    engine.add_argument("--size-mb", type=float, default=0.5, help="Size of the synthetic resume")
+    engine.set_defaults(func=bench_engine)
+
+    asynchronous = subparsers.add_parser("async", help="Asyncio delivery throughput against a local async SMTP sink")
+    asynchronous.add_argument("--messages", type=int, default=400, help="Messages to deliver per run")
+    asynchronous.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32],
+                              help="Sends in flight to compare")
+    asynchronous.add_argument("--latency", type=float, default=0.02, help="Seconds the sink takes to accept a message")
+    asynchronous.add_argument("--gemini-latency", type=float, default=0.0,
+                              help="Also generate each email with a fake async Gemini client taking this long")
+    asynchronous.add_argument("--size-mb", type=float, default=0.5, help="Size of the synthetic resume")
+    asynchronous.set_defaults(func=bench_async)
+
+    templates = subparsers.add_parser("templates", help="Template rendering throughput")
+    templates.add_argument("--renders", type=int, default=100000, help="Emails to render with the registry")
+    templates.add_argument("--legacy-renders", type=int, default=2000,
+                           help="Emails to render with a Template per message (it is much slower)")
+    templates.set_defaults(func=bench_templates)
+
+    postprocess = subparsers.add_parser("postprocess", help="AI email clean-up and quality checks on canned answers")
+    postprocess.add_argument("--rounds", type=int, default=2000, help="Passes over the canned corpus")
+    postprocess.set_defaults(func=bench_postprocess)
+
+    e2e = subparsers.add_parser("e2e", help="Whole template/AI/preview runs against a local SMTP sink and fake Gemini")
+    e2e.add_argument("--flows", nargs="+", choices=list(E2E_FLOWS), default=list(E2E_FLOWS), help="Flows to run")
+    e2e.add_argument("--companies", type=int, default=200, help="Synthetic companies per flow")
+    e2e.add_argument("--sink-latency", type=float, default=0.005, help="Seconds the sink takes to accept a message")
+    e2e.add_argument("--size-mb", type=float, default=0.5, help="Size of the synthetic resume")
+    e2e.add_argument("--gemini-latency", type=float, default=0.2, help="Median seconds per fake Gemini request")
+    e2e.add_argument("--gemini-jitter", type=float, default=0.3,
+                     help="Sigma of the log-normal latency distribution (0 = constant latency)")
+    e2e.add_argument("--gemini-error-rate", type=float, default=0.0, help="Fraction of Gemini requests that fail")
+    e2e.add_argument("--gemini-error-code", type=int, default=503,
+                     help="HTTP status of the injected errors (503 is retried, 400 is not)")
+    e2e.add_argument("--gemini-concurrency", type=int, default=4, help="GEMINI_CONCURRENCY for the runs")
+    e2e.add_argument("--batch-size", type=int, default=0, help="Companies per batched Gemini request")
+    e2e.add_argument("--workers", type=int, default=1, help="Send worker processes (send flows)")
+    e2e.add_argument("--concurrency", type=int, default=1, help="Concurrent asyncio sends (send flows)")
+    e2e.add_argument("--seed", type=int, default=0, help="Seed for the fake Gemini latencies and errors")
+    e2e.add_argument("--output", help="Write the JSON results here instead of printing them")
+    e2e.add_argument("--compare", help="Earlier --output file to compare messages/s and peak RSS with")
+    e2e.set_defaults(func=bench_e2e)
+
+    run_flow = subparsers.add_parser("_e2e")
+    run_flow.add_argument("config")
+    run_flow.add_argument("result")
+    run_flow.set_defaults(func=_run_flow)
+
+    load = subparsers.add_parser("_load")
+    load.add_argument("mode")
+    load.add_argument("path")
+    load.set_defaults(func=_load_companies)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+from recipients import inbox_key, normalize_address
+
+# Records are parsed out of the file this many characters at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def is_json_lines(path):
+    return path.endswith((".jsonl", ".ndjson"))
+
+
+def _iter_json_lines(path):
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {line_number}: {e}") from None
+
+
+def _iter_json_array(path):
+    """Yield the elements of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as file:
+        buffer = file.read(READ_CHUNK_SIZE).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError("expected a JSON array of company objects")
+        position = 1
+        eof = False
+        expect_separator = after_comma = False
+        while True:
+            # Skip whitespace and the comma between elements
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer, position = file.read(READ_CHUNK_SIZE), 0
+                eof = not buffer
+
+            if position >= len(buffer):
+                raise ValueError("unexpected end of file inside the array")
+            if buffer[position] == "]":
+                if after_comma:
+                    raise ValueError("trailing comma before ']'")
+                # Like json.load, only whitespace may follow the array
+                rest = buffer[position + 1:]
+                while rest:
+                    if not rest.isspace():
+                        raise ValueError(f"extra data after the array: {rest.strip()[:20]!r}")
+                    rest = file.read(READ_CHUNK_SIZE)
+                return
+            if expect_separator:
+                if buffer[position] != ",":
+                    raise ValueError(f"expected ',' or ']' but found {buffer[position]!r}")
+                position += 1
+                expect_separator = False
+                after_comma = True
+                continue
+            after_comma = False
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The element continues past the buffered text: read more and retry
+                chunk = file.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            if end == len(buffer) and not eof:
+                # A number could continue in the next chunk; make sure the element is complete
+                chunk = file.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                if chunk:
+                    buffer, position = buffer[position:] + chunk, 0
+                    continue
+            yield item
+            buffer, position = buffer[end:], 0
+            expect_separator = True
+
+
+def iter_companies(path):
+    """Lazily yield company records from a JSON array or a JSON Lines (.jsonl) file."""
+    if is_json_lines(path):
+        return _iter_json_lines(path)
+    return _iter_json_array(path)
+
+
+class CompanyFile:
+    """A companies file that can be iterated any number of times, one :class:`Company` at a time."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        return map(Company.from_dict, iter_companies(self.path))
+
+
+def write_companies(path, records):
+    """Atomically replace ``path`` with the company dicts in ``records``, streamed one at a time.
+
+    JSON arrays are written with the same layout as ``json.dump(..., indent=4)``.
+    """
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as file:
+            if is_json_lines(path):
+                for company in records:
+                    file.write(json.dumps(company) + "\n")
+            else:
+                file.write("[")
+                for index, company in enumerate(records):
+                    item = json.dumps(company, indent=4).replace("\n", "\n    ")
+                    file.write(("," if index else "") + "\n    " + item)
+                file.write("\n]")
+            file.flush()
+            os.fsync(file.fileno())
+    except BaseException:
+        # The records failed part way (e.g. an invalid one): leave the file as it was
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+
+
+def rewrite_companies(path, update):
+    """Stream every record through ``update(company)`` and atomically replace the file."""
+    write_companies(path, map(update, iter_companies(path)))
+
+
+def company_key(company):
+    """Stable identifier for a company record: its normalized email address, or its name if it has none."""
+    email = normalize_address(company.get("email")) or (company.get("email") or "").strip()
+    return email.lower() or company["name"].strip().lower()
+
+
+class Company:
+    """One company record. Uses ``__slots__`` so 100k records stay compact in memory."""
+
+    __slots__ = ("id", "name", "email", "contact_person", "language", "city", "is_sent", "extra")
+
+    REQUIRED_FIELDS = ("name", "email", "contact_person")
+    # The fields an email is written from; a change to any of them makes prepared content stale
+    CONTENT_FIELDS = ("name", "contact_person", "city", "language", "email")
+
+    def __init__(self, name, email, contact_person, language="English", city=None, is_sent=False, extra=None):
+        self.name = name
+        # "Name <hr@example.com>", stray spaces and the like are cleaned up; invalid addresses are kept as listed
+        self.email = normalize_address(email) or email
+        self.contact_person = contact_person
+        self.language = language
+        self.city = city
+        self.is_sent = is_sent
+        # Fields this script doesn't use (position, phone, ...) are kept for round-tripping
+        self.extra = extra
+        self.id = company_key({"name": name, "email": email})
+
+    @classmethod
+    def from_dict(cls, data):
+        missing = [field for field in cls.REQUIRED_FIELDS if field not in data]
+        if missing:
+            raise ValueError(f"company record {data.get('name', data)!r} is missing {', '.join(missing)}")
+        known = {"name", "email", "contact_person", "language", "city", "is_sent"}
+        extra = {key: value for key, value in data.items() if key not in known}
+        return cls(
+            data["name"],
+            data["email"],
+            data["contact_person"],
+            data.get("language", "English"),
+            data.get("city", None),
+            data.get("is_sent", False),
+            extra or None,
+        )
+
+    def content_value(self, field):
+        """``field`` as far as generated content is concerned: the email compares by the inbox it delivers to."""
+        if field == "email":
+            address = normalize_address(self.email)
+            return inbox_key(address) if address else (self.email or "").strip().lower()
+        return getattr(self, field)
+
+    def content_hash(self, fields=CONTENT_FIELDS):
+        """Short SHA-256 of ``fields``, to tell whether content generated for this record is still current."""
+        values = json.dumps([self.content_value(field) for field in fields], ensure_ascii=False)
+        return hashlib.sha256(values.encode("utf-8")).hexdigest()[:16]
+
+    def to_dict(self):
+        data = {"name": self.name, "email": self.email, "contact_person": self.contact_person,
+                "language": self.language, "city": self.city, "is_sent": self.is_sent}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self):
+        return f"Company({self.name!r}, {self.email!r})"
+
+
+def diff_companies(current, incoming):
+    """Compare an incoming company list with the current one, record by record.
+
+    Yields ``(status, company, fields)`` in incoming order, then the current
+    companies missing from it. ``status`` is "new", "changed", "unchanged",
+    "duplicate" (an id already seen earlier in the same list; those of
+    ``current`` come first) or "removed"; for "changed", ``fields`` names the
+    :attr:`Company.CONTENT_FIELDS` that differ. As in :class:`CompanyRegistry`
+    the first record for an id wins, but it counts as sent if any of the
+    current records for that id was. Changed and unchanged companies keep
+    their current ``is_sent``. Only the current list is held in memory;
+    ``incoming`` is streamed.
+    """
+    known = {}
+    for company in current:
+        first = known.setdefault(company.id, company)
+        if first is not company:
+            first.is_sent = first.is_sent or company.is_sent
+            yield "duplicate", company, ()
+    seen = set()
+    for company in incoming:
+        if company.id in seen:
+            yield "duplicate", company, ()
+            continue
+        seen.add(company.id)
+        previous = known.get(company.id)
+        if previous is None:
+            yield "new", company, ()
+            continue
+        company.is_sent = previous.is_sent
+        if company.content_hash() == previous.content_hash():
+            yield "unchanged", company, ()
+        else:
+            fields = tuple(field for field in Company.CONTENT_FIELDS
+                           if company.content_value(field) != previous.content_value(field))
+            yield "changed", company, fields
+    for company_id, company in known.items():
+        if company_id not in seen:
+            yield "removed", company, ()
+
+
+class CompanyRegistry:
+    """In-memory company store keyed by :attr:`Company.id`, with indexes by language, city and sent status.
+
+    A record whose id is already registered (the same inbox listed twice) is
+    not added again; it is kept in :attr:`duplicates` instead.
+    """
+
+    def __init__(self, companies=()):
+        self._by_id = {}
+        self._by_language = defaultdict(dict)
+        self._by_city = defaultdict(dict)
+        self._unsent = {}
+        self.duplicates = []
+        for company in companies:
+            self.add(company)
+
+    def add(self, company):
+        """Register ``company``; returns False if its id was already present."""
+        if company.id in self._by_id:
+            self.duplicates.append(company)
+            return False
+        self._by_id[company.id] = company
+        self._by_language[company.language][company.id] = company
+        self._by_city[company.city][company.id] = company
+        if not company.is_sent:
+            self._unsent[company.id] = company
+        return True
+
+    def get(self, company_id):
+        return self._by_id.get(company_id)
+
+    def __contains__(self, company_id):
+        return company_id in self._by_id
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def by_language(self, language):
+        return list(self._by_language.get(language, {}).values())
+
+    def by_city(self, city):
+        return list(self._by_city.get(city, {}).values())
+
+    def unsent(self):
+        """Companies not yet marked as sent, in registration order."""
+        return list(self._unsent.values())
+
+    def mark_sent(self, company_id):
+        company = self._by_id[company_id]
+        company.is_sent = True
+        self._unsent.pop(company_id, None)
@@ -0,0 +1,204 @@
+import json
+import multiprocessing
+import queue
+import time
+import zlib
+
+from mailer import SMTPPool, SendResult, build_message, deliver
+from metrics import metrics
+from scheduler import SendScheduler
+
+
+def load_accounts(path):
+    """Read relay accounts from a JSON file: a list of {"server", "port", "username", "password"} objects.
+
+    Optional keys per account: "from" (sender address, defaults to the
+    username), "starttls" (default true) and "max_messages_per_connection".
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        accounts = json.load(file)
+    if not isinstance(accounts, list) or not accounts:
+        raise ValueError(f"{path} should contain a non-empty list of SMTP accounts")
+    for account in accounts:
+        missing = [key for key in ("server", "port") if key not in account]
+        if missing:
+            raise ValueError(f"SMTP account {account.get('username', account)!r} is missing {', '.join(missing)}")
+    return accounts
+
+
+def shard_for(domain, workers):
+    """Worker index for a recipient domain; every email to one domain goes through the same worker."""
+    return zlib.crc32(domain.encode("utf-8")) % workers
+
+
+class SharedRateLimiter:
+    """A send rate shared by every worker process, at most ``per_minute`` sends a minute in total.
+
+    The next free slot lives in shared memory; each send reserves one under
+    an inter-process lock and sleeps until it outside the lock.
+    """
+
+    def __init__(self, per_minute, context=multiprocessing):
+        self.interval = 60.0 / per_minute
+        self._next_slot = context.Value("d", 0.0, lock=False)
+        self._lock = context.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _worker(account, scheduler_settings, retry_policy, attachment_path, jobs, results, rate_limiter):
+    """Worker process: deliver jobs from ``jobs`` over one SMTP account and report each outcome.
+
+    When the jobs run out, the worker's metrics are reported as a final ``(None, snapshot)`` result.
+    """
+    pool = SMTPPool(
+        account["server"],
+        int(account["port"]),
+        account.get("username"),
+        account.get("password"),
+        max_messages_per_connection=int(account.get("max_messages_per_connection") or 100),
+        starttls=account.get("starttls", True),
+    )
+    scheduler = SendScheduler(**scheduler_settings)
+    from_addr = account.get("from") or account.get("username")
+    try:
+        for job_id, to_email, subject, body in iter(jobs.get, None):
+            try:
+                message = build_message(from_addr, to_email, subject, body, attachment_path)
+            except Exception as e:
+                results.put((job_id, SendResult(to_email, False, 0, str(e) or type(e).__name__, permanent=True)))
+                continue
+            if rate_limiter:
+                rate_limiter.acquire()
+            results.put((job_id, deliver(pool, from_addr, to_email, message, scheduler, retry_policy)))
+    finally:
+        pool.close()
+        results.put((None, metrics.snapshot()))
+
+
+class SendEngine:
+    """Delivers emails from a pool of worker processes, one SMTP connection each.
+
+    Messages are sharded by recipient domain, so each domain is paced by a
+    single worker's :class:`~scheduler.SendScheduler` and per-domain spacing
+    still holds. Workers are spread round-robin over the relay ``accounts``;
+    an account's quotas (``per_minute``/``per_hour``/``per_day`` in
+    ``scheduler_settings``) are split between the workers sharing it.
+    ``global_per_minute`` caps the total rate across all workers.
+
+    Outcomes come back to the calling process, which stays the only writer
+    of the send journal.
+    """
+
+    def __init__(self, accounts, workers, attachment_path=None, scheduler_settings=None,
+                 global_per_minute=None, queue_size=100, retry_policy=None):
+        self.accounts = accounts
+        self.workers = workers
+        self.attachment_path = attachment_path
+        self.scheduler_settings = scheduler_settings or {}
+        self.retry_policy = retry_policy
+        self.global_per_minute = global_per_minute
+        self.queue_size = queue_size
+        self.stats = {"submitted": 0, "sent": 0, "failed": 0, "per_worker": [0] * workers}
+
+    def _settings_for(self, index):
+        sharing = len(range(index % len(self.accounts), self.workers, len(self.accounts)))
+        settings = dict(self.scheduler_settings)
+        for quota in ("per_minute", "per_hour", "per_day"):
+            if settings.get(quota):
+                settings[quota] = settings[quota] / sharing
+        return settings
+
+    def run(self, messages):
+        """Send ``(company, to_email, subject, body)`` items; yield ``(item, result)`` as each one completes.
+
+        ``result`` is the worker's :class:`~mailer.SendResult`. Results arrive
+        in completion order, not submission order.
+        """
+        # Workers are spawned rather than forked: the caller may have Gemini threads running
+        context = multiprocessing.get_context("spawn")
+        rate_limiter = SharedRateLimiter(self.global_per_minute, context) if self.global_per_minute else None
+        results = context.Queue()
+        shards = []
+        for index in range(self.workers):
+            jobs = context.Queue(self.queue_size)
+            process = context.Process(
+                target=_worker,
+                args=(self.accounts[index % len(self.accounts)], self._settings_for(index), self.retry_policy,
+                      self.attachment_path, jobs, results, rate_limiter),
+                daemon=True,
+            )
+            process.start()
+            shards.append((jobs, process))
+
+        in_flight = {}
+        reports = 0
+        finished = False
+
+        def collect(timeout=None):
+            """Pop one finished job, or None if nothing arrived within ``timeout``."""
+            nonlocal reports
+            while True:
+                try:
+                    job_id, result = results.get(timeout=timeout) if timeout else results.get_nowait()
+                except queue.Empty:
+                    return None
+                if job_id is not None:
+                    break
+                # A worker's metrics, sent as it exits
+                metrics.merge(result)
+                reports += 1
+            item = in_flight.pop(job_id)
+            self.stats["sent" if result else "failed"] += 1
+            return item, result
+
+        try:
+            for job_id, item in enumerate(messages):
+                _, to_email, subject, body = item
+                index = shard_for(to_email.rpartition("@")[2].lower(), self.workers)
+                jobs, process = shards[index]
+                in_flight[job_id] = item
+                self.stats["submitted"] += 1
+                self.stats["per_worker"][index] += 1
+                while True:
+                    try:
+                        jobs.put((job_id, to_email, subject, body), timeout=1)
+                        break
+                    except queue.Full:
+                        if not process.is_alive():
+                            raise RuntimeError(f"send worker {index} exited unexpectedly")
+                        # The shard is backed up; hand back what has finished meanwhile
+                        while (result := collect()) is not None:
+                            yield result
+                while (result := collect()) is not None:
+                    yield result
+
+            for jobs, _ in shards:
+                jobs.put(None)
+            while in_flight:
+                result = collect(timeout=1)
+                if result is not None:
+                    yield result
+                elif not any(process.is_alive() for _, process in shards):
+                    # Workers are gone; whatever they didn't report was not sent
+                    for item in list(in_flight.values()):
+                        self.stats["failed"] += 1
+                        yield item, SendResult(item[1], False, 0, "send worker exited before delivering this message")
+                    in_flight.clear()
+            # Wait for every worker's metrics; each sends them once its queue is done
+            while reports < self.workers and (collect(timeout=0.1) is not None or
+                                                any(process.is_alive() for _, process in shards)):
+                pass
+            finished = True
+        finally:
+            for _, process in shards:
+                # Stopped early (an error, or the caller stopped reading): don't wait for the backlog
+                if not finished and process.is_alive():
+                    process.terminate()
+                process.join()
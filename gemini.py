@@ -0,0 +1,539 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from metrics import metrics
+from quality import check_email
+from retry import RetryPolicy, call_with_retry, call_with_retry_async, classify_gemini_error
+
+GEMINI_MODEL = "gemini-2.0-flash"
+
+# Rate limits (429), server errors and timeouts are retried with backoff; other errors fail at once
+RETRY_POLICY = RetryPolicy(attempts=4, base_delay=2.0, max_delay=60.0)
+
+# How many more times a subject or body failing the quality checks is asked for
+QUALITY_RETRIES = 1
+
+# One client per process: it owns the HTTP connection pool, so creating a new
+# one per call would throw away open connections and TLS sessions every time.
+_client = None
+_client_lock = threading.Lock()
+client_stats = {"created": 0, "reused": 0}
+
+
+def get_client(api_key):
+    """Return the process-wide Gemini client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Imported on first use: the SDK is slow to import and template-only runs never need it
+            from google import genai
+
+            _client = genai.Client(api_key=api_key)
+            client_stats["created"] += 1
+        else:
+            client_stats["reused"] += 1
+        return _client
+
+
+async def close_async_client():
+    """Close the shared client's asyncio connections, before the event loop that opened them ends."""
+    with _client_lock:
+        client = _client
+    if client is not None:
+        await client.aio.aclose()
+
+
+def close_client():
+    """Close the shared client's connections; the next get_client() call creates a new one."""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+def generate_content(client, prompt, rate_limiter=None, cache=None, cache_fields=(), config=None,
+                     stage="gemini.request"):
+    """Run a single Gemini request, waiting for the rate limiter first if one is given.
+
+    With a ``cache``, the response is looked up by model, prompt and
+    ``cache_fields`` (company, city, language) before any request is made.
+    ``config`` is passed through as the request's GenerateContentConfig.
+    The request's latency is recorded under ``stage``. Transient errors are
+    retried per :data:`RETRY_POLICY`; the last error is raised.
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(GEMINI_MODEL, prompt, *cache_fields)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    def request():
+        # Every attempt, including retries, waits for its own rate limiter token
+        if rate_limiter:
+            with metrics.time("gemini.rate_limit_wait"):
+                rate_limiter.acquire()
+        try:
+            with metrics.time(stage):
+                return client.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=prompt,
+                    config=config
+                )
+        except Exception:
+            metrics.increment("gemini.errors")
+            raise
+
+    response = call_with_retry(request, classify_gemini_error, RETRY_POLICY, stage="gemini")
+    metrics.increment("gemini.requests")
+    if cache_key and response.text:
+        cache.put(cache_key, response.text)
+    return response.text
+
+
+async def generate_content_async(client, prompt, rate_limiter=None, cache=None, cache_fields=(), config=None,
+                                 stage="gemini.request"):
+    """Async counterpart of :func:`generate_content`, using the client's ``aio`` interface."""
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(GEMINI_MODEL, prompt, *cache_fields)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    async def request():
+        if rate_limiter:
+            with metrics.time("gemini.rate_limit_wait"):
+                await rate_limiter.acquire_async()
+        try:
+            with metrics.time(stage):
+                return await client.aio.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=prompt,
+                    config=config
+                )
+        except Exception:
+            metrics.increment("gemini.errors")
+            raise
+
+    response = await call_with_retry_async(request, classify_gemini_error, RETRY_POLICY, stage="gemini")
+    metrics.increment("gemini.requests")
+    if cache_key and response.text:
+        cache.put(cache_key, response.text)
+    return response.text
+
+
+def get_company_info_from_gemini(api_key, company_name, city=None, client=None, rate_limiter=None, cache=None):
+    """Fetch company details using Google Gemini AI."""
+    if client is None:
+        client = get_client(api_key)
+    
+    try:
+        # Build a more specific prompt using company name and city
+        location_info = f" in {city}" if city else ""
+        prompt = f"""
+        Provide factual information about {company_name}{location_info} company. 
+        Include details about:
+        - Their main business activities
+        - Size of the company (if available)
+        - Notable achievements or projects
+        - Technology stack they use (if it's a tech company)
+        
+        Focus only on providing factual information. Do not recommend any actions, 
+        investments, or personal opinions. Do not suggest contacting the company 
+        or visiting their locations.
+        
+        Format your response in Markdown with appropriate headings, bullet points, 
+        and sections for easy readability. Use ## for main sections and * for bullet points.
+        """
+        
+        # Query Gemini AI for information about the company
+        return generate_content(client, prompt, rate_limiter, cache, (company_name, city), stage="gemini.research")
+    except Exception as e:
+        print(f"❌ Failed to get information from Gemini AI: {e}")
+        return None
+
+
+def build_email_prompts(sender_name, company_name, contact_person, city=None, language="English", research=None):
+    """Return the (body_prompt, subject_prompt) pair for one company.
+
+    ``research`` is a short summary of what is known about the company; it is
+    appended to the body prompt as the only facts the email may draw on.
+    """
+    location_info = f" in {city}" if city else ""
+
+    if language == "French":
+        # Generate email body
+        body_prompt = f"""
+        Écris un email professionnel en français pour une candidature de stage en développement Web à {company_name}{location_info}.
+        L'email doit:
+        - Être adressé à {contact_person}
+        - Mentionner mon intérêt spécifique pour {company_name} et pourquoi je voudrais y travailler
+        - Mentionner que mon CV est joint
+        - Être concis (maximum 5-6 phrases)
+        - Avoir un ton formel mais chaleureux
+        - Se terminer par "Dans l'attente de votre réponse. Cordialement, {sender_name}"
+        - Ne pas inclure d'informations inventées sur l'entreprise
+        - S'assurer que je suis clairement identifié comme {sender_name} (pas de placeholder comme [Votre Nom])
+        
+        IMPORTANT: 
+        - N'inclus pas d'objet d'email ou de pièce jointe dans ton texte
+        - N'inclus pas de commentaires, notes, ou explications
+        - N'utilise pas de balises de formatage (markdown, html, etc.)
+        - Le texte doit être prêt à l'envoi exactement comme tu le fournis
+        - Ne commence pas par "Voici un email..." ou des phrases similaires
+        """
+        
+        # Generate email subject
+        subject_prompt = f"""
+        Crée un objet d'email concis et professionnel en français pour une candidature de stage en développement Web à {company_name}.
+        L'objet doit:
+        - Être court (maximum 60 caractères)
+        - Être direct et clair
+        - Mentionner qu'il s'agit d'une candidature de stage de {sender_name}
+        - Ne pas contenir de point à la fin
+        - Ne pas contenir de placeholders comme [Votre Nom]
+        - Ne pas contenir de guillemets, de préfixes ou d'autres symboles non nécessaires
+        
+        IMPORTANT:
+        - Réponds uniquement avec l'objet de l'email, rien d'autre
+        - Ne commence pas par "Objet:" ou "Sujet:"
+        - N'utilise pas de formatage spécial
+        """
+
+        if research:
+            body_prompt += f"""
+        Informations vérifiées sur {company_name}, à utiliser pour personnaliser l'email
+        (mentionne au plus un ou deux éléments pertinents et n'invente rien d'autre):
+        {research}
+        """
+    else:
+        # Generate email body
+        body_prompt = f"""
+        Write a professional email in English for an internship application in Web Development to {company_name}{location_info}.
+        The email should:
+        - Be addressed to {contact_person}
+        - Mention my specific interest in {company_name} and why I would like to work there
+        - Mention that my CV is attached
+        - Be concise (maximum 5-6 sentences)
+        - Have a formal but warm tone
+        - End with "Looking forward to your response. Best regards, {sender_name}"
+        - Not include made-up information about the company
+        - Make sure I'm clearly identified as {sender_name} (no placeholders like [Your Name])
+        
+        IMPORTANT:
+        - Do not include email subject or attachment notes in your text
+        - Do not include any comments, notes, or explanations
+        - Do not use any formatting tags (markdown, html, etc.)
+        - The text should be ready to send exactly as you provide it
+        - Do not start with "Here's an email..." or similar phrases
+        """
+        
+        # Generate email subject
+        subject_prompt = f"""
+        Create a concise and professional email subject line in English for a Web Development internship application to {company_name}.
+        The subject should:
+        - Be short (maximum 60 characters)
+        - Be direct and clear
+        - Mention it's an internship application from {sender_name}
+        - Not end with a period
+        - Not contain placeholders like [Your Name]
+        - Not contain quotes, prefixes or other unnecessary symbols
+        
+        IMPORTANT:
+        - Only respond with the email subject line, nothing else
+        - Do not start with "Subject:" or similar prefixes
+        - Do not use any special formatting
+        """
+
+        if research:
+            body_prompt += f"""
+        Verified background about {company_name}, to use for personalizing the email
+        (mention at most one or two relevant details and do not invent anything beyond them):
+        {research}
+        """
+
+    return body_prompt, subject_prompt
+
+
+def _check_email(subject_text, body_text, sender_name, language):
+    """Clean and check a generated email, counting each problem found under ``quality.<code>``."""
+    with metrics.time("gemini.postprocess"):
+        verdict = check_email(subject_text, body_text, sender_name, language)
+    for _, code, _ in verdict.problems:
+        metrics.increment(f"quality.{code}")
+    return verdict
+
+
+def _corrected_prompt(prompt, verdict, part, language):
+    """``prompt`` with a note on why the previous answer for ``part`` was rejected."""
+    problems = verdict.describe(part)
+    if language == "French":
+        return prompt + f"""
+        Ta réponse précédente a été refusée ({problems}). Réécris-la en corrigeant ces problèmes.
+        """
+    return prompt + f"""
+        Your previous answer was rejected ({problems}). Write it again, fixing these problems.
+        """
+
+
+def _forget_failing(cache, verdict, prompts, cache_fields):
+    """Drop the cached responses for the parts that failed their checks, so a later run asks for them again."""
+    if cache is None:
+        return
+    for part in verdict.failing:
+        cache.delete(cache.make_key(GEMINI_MODEL, prompts[part], *cache_fields))
+
+
+def _accepted(verdict, company_name):
+    """``(subject, body)`` from a verdict, with None for a part that still fails its checks."""
+    failing = verdict.failing
+    for part in sorted(failing):
+        metrics.increment("quality.rejected")
+        print(f"⚠️ Generated {part} for {company_name} rejected: {verdict.describe(part)}")
+    return (None if "subject" in failing else verdict.subject,
+            None if "body" in failing else verdict.body)
+
+
+def generate_ai_email(api_key, sender_name, company_name, contact_person, city=None, language="English",
+                      client=None, rate_limiter=None, cache=None, research=None):
+    """Generate personalized email content and subject using Google Gemini AI based on company details.
+
+    The body and subject requests are independent, so they run concurrently.
+    Pass ``client`` to use a specific (e.g. fake) client instead of the shared one,
+    and ``research`` to ground the body in a summary of the company's research.
+
+    The result is checked with :func:`quality.check_email`; a subject or body
+    with problems is asked for again up to :data:`QUALITY_RETRIES` times, and
+    is returned as None if it still fails.
+    """
+    if client is None:
+        client = get_client(api_key)
+
+    try:
+        body_prompt, subject_prompt = build_email_prompts(
+            sender_name, company_name, contact_person, city, language, research
+        )
+
+        cache_fields = (company_name, city, language)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            subject_future = executor.submit(
+                generate_content, client, subject_prompt, rate_limiter, cache, cache_fields, stage="gemini.subject"
+            )
+            body_text = generate_content(client, body_prompt, rate_limiter, cache, cache_fields, stage="gemini.body")
+            subject_text = subject_future.result()
+
+        # Only the part that fails its checks is asked for again, with the reason
+        prompts = {"subject": subject_prompt, "body": body_prompt}
+        verdict = _check_email(subject_text, body_text, sender_name, language)
+        _forget_failing(cache, verdict, prompts, cache_fields)
+        for _ in range(QUALITY_RETRIES):
+            if verdict.ok:
+                break
+            if "subject" in verdict.failing:
+                metrics.increment("quality.regenerated.subject")
+                prompts["subject"] = _corrected_prompt(subject_prompt, verdict, "subject", language)
+                subject_text = generate_content(
+                    client, prompts["subject"], rate_limiter, cache, cache_fields, stage="gemini.subject"
+                )
+            if "body" in verdict.failing:
+                metrics.increment("quality.regenerated.body")
+                prompts["body"] = _corrected_prompt(body_prompt, verdict, "body", language)
+                body_text = generate_content(
+                    client, prompts["body"], rate_limiter, cache, cache_fields, stage="gemini.body"
+                )
+            verdict = _check_email(subject_text, body_text, sender_name, language)
+            _forget_failing(cache, verdict, prompts, cache_fields)
+
+        return _accepted(verdict, company_name)
+
+    except Exception as e:
+        print(f"❌ Failed to generate personalized email: {e}")
+        return None, None
+
+
+async def generate_ai_email_async(api_key, sender_name, company_name, contact_person, city=None, language="English",
+                                  client=None, rate_limiter=None, cache=None, research=None):
+    """Async counterpart of :func:`generate_ai_email`; the body and subject requests run concurrently."""
+    import asyncio
+
+    if client is None:
+        client = get_client(api_key)
+
+    try:
+        body_prompt, subject_prompt = build_email_prompts(
+            sender_name, company_name, contact_person, city, language, research
+        )
+
+        cache_fields = (company_name, city, language)
+        body_text, subject_text = await asyncio.gather(
+            generate_content_async(client, body_prompt, rate_limiter, cache, cache_fields, stage="gemini.body"),
+            generate_content_async(client, subject_prompt, rate_limiter, cache, cache_fields, stage="gemini.subject"),
+        )
+
+        prompts = {"subject": subject_prompt, "body": body_prompt}
+        verdict = _check_email(subject_text, body_text, sender_name, language)
+        _forget_failing(cache, verdict, prompts, cache_fields)
+        for _ in range(QUALITY_RETRIES):
+            if verdict.ok:
+                break
+            parts = sorted(verdict.failing)
+            originals = {"subject": subject_prompt, "body": body_prompt}
+            for part in parts:
+                prompts[part] = _corrected_prompt(originals[part], verdict, part, language)
+            texts = await asyncio.gather(*(
+                generate_content_async(client, prompts[part], rate_limiter, cache, cache_fields, stage=f"gemini.{part}")
+                for part in parts
+            ))
+            for part, text in zip(parts, texts):
+                metrics.increment(f"quality.regenerated.{part}")
+                if part == "subject":
+                    subject_text = text
+                else:
+                    body_text = text
+            verdict = _check_email(subject_text, body_text, sender_name, language)
+            _forget_failing(cache, verdict, prompts, cache_fields)
+
+        return _accepted(verdict, company_name)
+
+    except Exception as e:
+        print(f"❌ Failed to generate personalized email: {e}")
+        return None, None
+
+
+@lru_cache(maxsize=None)
+def batch_response_config():
+    """Structured output for batch requests: one {id, name, subject, body} object per company."""
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=types.Schema(
+            type="ARRAY",
+            items=types.Schema(
+                type="OBJECT",
+                properties={
+                    "id": types.Schema(type="INTEGER"),
+                    "name": types.Schema(type="STRING"),
+                    "subject": types.Schema(type="STRING"),
+                    "body": types.Schema(type="STRING"),
+                },
+                required=["id", "name", "subject", "body"],
+            ),
+        ),
+    )
+
+
+def build_batch_prompt(sender_name, companies, language="English", research=None):
+    """One prompt asking for the subject and body of every company in ``companies``.
+
+    ``research`` optionally lists a background summary per company (None where there is none).
+    """
+    if language == "French":
+        sign_off = f"Dans l'attente de votre réponse. Cordialement, {sender_name}"
+    else:
+        sign_off = f"Looking forward to your response. Best regards, {sender_name}"
+    company_list = [
+        {"id": i, "name": company.name, "contact_person": company.contact_person, "city": company.city}
+        for i, company in enumerate(companies)
+    ]
+    background_rule = ""
+    if research and any(research):
+        for item, summary in zip(company_list, research):
+            if summary:
+                item["background"] = summary
+        background_rule = (
+            "Where a company has a \"background\" field, it is verified research about that company: mention\n"
+            "    at most one or two relevant details from it and invent nothing beyond them.\n\n    "
+        )
+    return f"""
+    Write one professional internship application email in {language} for a Web Development internship
+    for each company listed below. The applicant is {sender_name}.
+
+    Each email body should:
+    - Be addressed to the company's contact_person
+    - Mention a specific interest in that company and why the applicant would like to work there
+    - Mention that the CV is attached
+    - Be concise (maximum 5-6 sentences) with a formal but warm tone
+    - End with "{sign_off}"
+    - Not include made-up information about the company or placeholders like [Your Name]
+    - Not include a subject line, comments, notes or formatting (markdown, html, etc.)
+
+    Each subject should be at most 60 characters, mention it's an internship application from
+    {sender_name}, not end with a period and not contain quotes, prefixes or placeholders.
+
+    Respond with a JSON array containing exactly one object per company with the fields
+    "id" and "name" copied from the input, plus "subject" and "body".
+
+    {background_rule}Companies (JSON):
+    {json.dumps(company_list, ensure_ascii=False)}
+    """
+
+
+def _parse_batch_response(text, companies, sender_name=None, language="English"):
+    """Map batch index -> (subject, body) for every item in a batch response that passes the quality checks."""
+    try:
+        items = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    drafts = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index, subject, body = item.get("id"), item.get("subject"), item.get("body")
+        if not isinstance(index, int) or not 0 <= index < len(companies) or index in drafts:
+            continue
+        if item.get("name") != companies[index].name:
+            continue
+        if not isinstance(subject, str) or not isinstance(body, str):
+            continue
+        verdict = _check_email(subject, body, sender_name, language)
+        if verdict.ok:
+            drafts[index] = (verdict.subject, verdict.body)
+    return drafts
+
+
+def generate_ai_emails_batch(api_key, sender_name, companies, language="English",
+                             client=None, rate_limiter=None, cache=None, research=None):
+    """Generate emails for several same-language companies with a single Gemini request.
+
+    Returns a list of ``(subject, body)`` aligned with ``companies``. Items
+    missing from the response or failing the quality checks are regenerated one by
+    one with :func:`generate_ai_email`. ``research`` is an optional list of
+    background summaries aligned with ``companies``.
+    """
+    if client is None:
+        client = get_client(api_key)
+
+    drafts = {}
+    try:
+        prompt = build_batch_prompt(sender_name, companies, language, research)
+        cache_fields = ("|".join(company.name for company in companies), None, language)
+        text = generate_content(client, prompt, rate_limiter, cache, cache_fields, batch_response_config(),
+                                stage="gemini.batch")
+        drafts = _parse_batch_response(text, companies, sender_name, language)
+        if cache is not None and len(drafts) < len(companies):
+            # Not kept if any item failed: a later run asks for the whole batch again
+            cache.delete(cache.make_key(GEMINI_MODEL, prompt, *cache_fields))
+    except Exception as e:
+        print(f"❌ Failed to generate batch of {len(companies)} emails: {e}")
+
+    results = []
+    for index, company in enumerate(companies):
+        if index in drafts:
+            results.append(drafts[index])
+            continue
+        print(f"⚠️ Batch response had no valid email for {company.name}, generating it on its own...")
+        metrics.increment("gemini.batch_fallbacks")
+        results.append(generate_ai_email(
+            api_key, sender_name, company.name, company.contact_person,
+            company.city, language, client=client, rate_limiter=rate_limiter, cache=cache,
+            research=research[index] if research else None
+        ))
+    return results
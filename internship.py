@@ -1,58 +1,83 @@
-import json
-import smtplib
-import time
+import argparse
 import os
-from jinja2 import Template
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from google import genai
 from dotenv import load_dotenv
+from cache import ResponseCache
+from companies import CompanyFile, CompanyRegistry, diff_companies, iter_companies, write_companies
+from engine import SendEngine, load_accounts
+from journal import SendJournal
+from gemini import (
+    client_stats,
+    close_async_client,
+    close_client,
+    generate_ai_email,
+    generate_ai_email_async,
+    generate_ai_emails_batch,
+    get_company_info_from_gemini,
+)
+from mailer import SMTPPool, SendResult, add_attachment, build_message, deliver
+from metrics import metrics
+from outbox import Outbox
+from previews import TEST_OUTPUTS, PreviewDigest, PreviewIndex, PreviewMailbox
+from pipeline import TokenBucket, generate_email_batches, generate_emails, generate_emails_async
+from recipients import ContactIndex, RecipientFilter
+from research import ResearchReport, summarize
+from retry import DeadLetterQueue, RetryPolicy
+from scheduler import SendScheduler
 import sys
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Function to check if all required environment variables are set
-def check_environment_variables():
-    required_vars = {
-        "MY_NAME": os.getenv("MY_NAME"),
-        "MY_EMAIL": os.getenv("MY_EMAIL"),
-        "MY_PHONE": os.getenv("MY_PHONE"),
-        "MY_RESUME_PATH": os.getenv("MY_RESUME_PATH"),
-        "SMTP_SERVER": os.getenv("SMTP_SERVER"),
-        "SMTP_PORT": os.getenv("SMTP_PORT"),
-        "EMAIL_USERNAME": os.getenv("EMAIL_USERNAME"),
-        "EMAIL_PASSWORD": os.getenv("EMAIL_PASSWORD"),
-        "TEST_EMAIL": os.getenv("TEST_EMAIL"),
-        "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY")
-    }
-    
+# Environment variables each part of the script needs
+PROFILE_VARS = ["MY_NAME", "MY_EMAIL", "MY_PHONE", "MY_RESUME_PATH"]
+SMTP_VARS = ["SMTP_SERVER", "SMTP_PORT", "EMAIL_USERNAME", "EMAIL_PASSWORD", "TEST_EMAIL"]
+GEMINI_VARS = ["GEMINI_API_KEY"]
+
+# Settings and shared resources. They are filled in by the setup_* functions,
+# so each command only loads (and requires) what it actually uses.
+MY_NAME = MY_EMAIL = MY_PHONE = MY_RESUME_PATH = None
+SENDER_EMAIL = TEST_EMAIL = None
+smtp_pool = None
+send_scheduler = None
+send_scheduler_settings = None
+send_retry_policy = None
+smtp_accounts = None
+gemini_api_key = None
+gemini_rate_limiter = None
+gemini_cache = None
+GEMINI_CONCURRENCY = 4
+GEMINI_BATCH_SIZE = 1
+companies = None
+send_journal = None
+dead_letters = None
+research_context = None
+contact_index = None
+recipient_filter = None
+
+# Function to check if the given environment variables are set
+def check_environment_variables(names):
+    required_vars = {name: os.getenv(name) for name in names}
+
     missing_vars = [var for var, value in required_vars.items() if not value]
-    
+
     if missing_vars:
         print("❌ ERROR: The following required environment variables are missing:")
         for var in missing_vars:
             print(f"  - {var}")
         print("\nPlease add these variables to your .env file and try again.")
         sys.exit(1)
-    
+
     # Check if resume file exists
-    if not os.path.exists(required_vars["MY_RESUME_PATH"]):
+    if "MY_RESUME_PATH" in required_vars and not os.path.exists(required_vars["MY_RESUME_PATH"]):
         print(f"❌ ERROR: Resume file not found at {required_vars['MY_RESUME_PATH']}")
         print("Please check the MY_RESUME_PATH variable in your .env file.")
         sys.exit(1)
-    
+
     return required_vars
 
-# Check if companies.json file exists
-def check_companies_file():
-    companies_file = "companies.json"
+# Check that the companies file exists and starts with a valid company record
+def check_companies_file(companies_file):
     if not os.path.exists(companies_file):
         print(f"❌ ERROR: Required file '{companies_file}' not found.")
         print(f"Please create a '{companies_file}' file in the same directory as this script.")
-        print("The file should contain an array of company objects with the following structure:")
+        print("The file should contain an array of company objects (or one object per line in a .jsonl file) with the following structure:")
         print("""
 Example:
 [
@@ -67,288 +92,401 @@ Example:
 ]
         """)
         sys.exit(1)
-    
+
+    # Records are streamed from disk as they are used; only the first one is read here
     try:
-        with open(companies_file, "r", encoding="utf-8") as file:
-            companies_data = json.load(file)
-            
-        if not isinstance(companies_data, list) or not companies_data:
+        first_company = next(iter_companies(companies_file), None)
+
+        # An empty list is valid: there is just nothing to send
+        if first_company is not None and not isinstance(first_company, dict):
             print(f"❌ ERROR: '{companies_file}' has an invalid format. It should contain an array of company objects.")
             sys.exit(1)
-            
-        return companies_data
-    except json.JSONDecodeError:
-        print(f"❌ ERROR: '{companies_file}' contains invalid JSON.")
+
+        return CompanyFile(companies_file)
+    except ValueError as e:
+        print(f"❌ ERROR: '{companies_file}' contains invalid JSON: {e}")
         print("Please check the file format and fix any syntax errors.")
         sys.exit(1)
     except Exception as e:
         print(f"❌ ERROR: Failed to read '{companies_file}': {e}")
         sys.exit(1)
 
-# Check environment variables and get their values
-env_vars = check_environment_variables()
+def optional_float(name, default=None):
+    """Read an optional numeric setting from the environment."""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def setup_profile():
+    """Load the applicant's personal information from .env."""
+    global MY_NAME, MY_EMAIL, MY_PHONE, MY_RESUME_PATH
+    env_vars = check_environment_variables(PROFILE_VARS)
+    MY_NAME = env_vars["MY_NAME"]
+    MY_EMAIL = env_vars["MY_EMAIL"]
+    MY_PHONE = env_vars["MY_PHONE"]
+    MY_RESUME_PATH = env_vars["MY_RESUME_PATH"]
+
+def setup_sender():
+    """Load the sender address, enough to build messages without sending them."""
+    global SENDER_EMAIL
+    SENDER_EMAIL = check_environment_variables(["EMAIL_USERNAME"])["EMAIL_USERNAME"]
+
+def setup_sending():
+    """Load the SMTP configuration and create the shared SMTP session and send scheduler."""
+    global TEST_EMAIL, smtp_pool, send_scheduler, send_scheduler_settings, smtp_accounts, send_retry_policy
+    if smtp_pool:
+        return
+    env_vars = check_environment_variables(SMTP_VARS)
+    setup_sender()
+    TEST_EMAIL = env_vars["TEST_EMAIL"]
+
+    # One SMTP session is opened lazily and shared by every send in this run
+    starttls = os.getenv("SMTP_STARTTLS", "true").lower() not in ("0", "false", "no")
+    smtp_pool = SMTPPool(
+        env_vars["SMTP_SERVER"],
+        int(env_vars["SMTP_PORT"]),
+        SENDER_EMAIL,
+        env_vars["EMAIL_PASSWORD"],
+        max_messages_per_connection=int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION") or 100),
+        starttls=starttls,
+    )
 
-# Personal information from .env
-MY_NAME = env_vars["MY_NAME"]
-MY_EMAIL = env_vars["MY_EMAIL"]
-MY_PHONE = env_vars["MY_PHONE"]
-MY_RESUME_PATH = env_vars["MY_RESUME_PATH"]
+    # Sending pace: relay quotas, spacing per recipient domain and the adaptive interval between sends
+    send_scheduler_settings = {
+        "per_minute": optional_float("SEND_PER_MINUTE", 20),
+        "per_hour": optional_float("SEND_PER_HOUR"),
+        "per_day": optional_float("SEND_PER_DAY"),
+        "domain_spacing": optional_float("SEND_DOMAIN_SPACING", 0),
+        "min_interval": optional_float("SEND_MIN_INTERVAL", 1.0),
+    }
+    send_scheduler = SendScheduler(**send_scheduler_settings)
 
-# Email configuration from .env
-SMTP_SERVER = env_vars["SMTP_SERVER"]
-SMTP_PORT = int(env_vars["SMTP_PORT"])
-SENDER_EMAIL = env_vars["EMAIL_USERNAME"]
-SENDER_PASSWORD = env_vars["EMAIL_PASSWORD"]
-TEST_EMAIL = env_vars["TEST_EMAIL"]
+    # Temporary failures (4xx replies, dropped connections, timeouts) are retried with backoff
+    send_retry_policy = RetryPolicy(attempts=int(os.getenv("SEND_MAX_ATTEMPTS") or 3), base_delay=5.0, max_delay=120.0)
 
-# API keys from .env
-gemini_api_key = env_vars["GEMINI_API_KEY"]
+    # Relay accounts for multi-process sending: the ones listed in SMTP_ACCOUNTS_FILE, or the account above
+    accounts_file = os.getenv("SMTP_ACCOUNTS_FILE")
+    if accounts_file:
+        try:
+            smtp_accounts = load_accounts(accounts_file)
+        except (OSError, ValueError) as e:
+            print(f"❌ ERROR: Failed to read SMTP accounts from '{accounts_file}': {e}")
+            sys.exit(1)
+    else:
+        smtp_accounts = [{
+            "server": env_vars["SMTP_SERVER"],
+            "port": int(env_vars["SMTP_PORT"]),
+            "username": SENDER_EMAIL,
+            "password": env_vars["EMAIL_PASSWORD"],
+            "max_messages_per_connection": int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION") or 100),
+            "starttls": starttls,
+        }]
 
-# Load company details from JSON
-companies = check_companies_file()
+def setup_gemini(args):
+    """Load the Gemini API key and set up the shared rate limiter and response cache."""
+    global gemini_api_key, gemini_rate_limiter, gemini_cache, GEMINI_CONCURRENCY, GEMINI_BATCH_SIZE
+    gemini_api_key = check_environment_variables(GEMINI_VARS)["GEMINI_API_KEY"]
 
-# Email templates using Jinja2
-email_template_en = f"""
-Dear {{{{ contact_person }}}},
+    # Gemini retries for rate limits (429), server errors and timeouts
+    import gemini
+    gemini.RETRY_POLICY = RetryPolicy(attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS") or 4), base_delay=2.0, max_delay=60.0)
 
-I hope this email finds you well. My name is {MY_NAME}, and I am currently seeking an internship opportunity in Web Development. I am very interested in joining {{{{ name }}}} and believe my skills align with your company's vision.
-    
-I have attached my CV for your review. I would appreciate the opportunity to discuss further.
+    # Gemini throughput: companies generated in parallel and the request rate they share
+    GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY") or 4)
+    gemini_rate_limiter = TokenBucket.per_minute(float(os.getenv("GEMINI_REQUESTS_PER_MINUTE") or 15))
+    # Companies per batched Gemini request (1 = one body and one subject request per company)
+    GEMINI_BATCH_SIZE = args.batch_size or int(os.getenv("GEMINI_BATCH_SIZE") or 1)
 
-Looking forward to your response.
+    # Gemini responses are cached on disk so unchanged companies aren't regenerated on the next run
+    if not args.no_cache:
+        gemini_cache = ResponseCache(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gemini_cache.sqlite3"),
+            ttl=float(os.getenv("GEMINI_CACHE_TTL_DAYS") or 30) * 24 * 3600,
+            max_bytes=int(float(os.getenv("GEMINI_CACHE_MAX_MB") or 100) * 1024 * 1024),
+            refresh=args.refresh,
+        )
 
-Best regards,  
-{MY_NAME}
-phone: {MY_PHONE},
-email: {MY_EMAIL}
-"""
+def setup_research(args):
+    """Open the research report as context for AI emails, if --use-research is on."""
+    global research_context
+    if args.use_research:
+        research_context = ResearchReport(args.report, os.path.splitext(args.report)[0] + ".jsonl")
+        print(f"ℹ️ Using company research from {args.report} ({len(research_context)} companies so far)")
 
-email_template_fr = f"""
-Cher {{{{ contact_person }}}},
+def setup_companies(args):
+    """Open the companies file, its send journal and dead-letter file, recovering sends from an interrupted run."""
+    global companies, send_journal, dead_letters
+    # Load company details from JSON (streamed lazily, so sending starts with the first record)
+    companies = check_companies_file(args.companies)
 
-J'espère que cet email vous trouve bien. Je m'appelle {MY_NAME} et je suis actuellement à la recherche d'un stage en développement Web. Je suis très intéressé par rejoindre {{{{ name }}}} et je crois que mes compétences sont en adéquation avec la vision de votre entreprise.
-    
-Vous trouverez ci-joint mon CV pour votre examen. Je serais ravi de pouvoir en discuter davantage.
+    # Every successful send is journaled immediately, so an interrupted run never re-emails anyone
+    send_journal = SendJournal(companies.path + ".sent.jsonl")
+    if len(send_journal):
+        print(f"ℹ️ Recovering {len(send_journal)} sends recorded by a previous run...")
+        update_companies_sent_status()
 
-Dans l'attente de votre réponse.
+    # Recipients the relay rejected permanently (e.g. no such mailbox) aren't emailed again
+    dead_letters = DeadLetterQueue(companies.path + ".dead.jsonl")
 
-Cordialement,  
-{MY_NAME}
-téléphone: {MY_PHONE},
-email: {MY_EMAIL}
-"""
+def setup_recipients(args, test_mode=False):
+    """Open the contact index and the filter that screens out duplicate, invalid and capped recipients.
 
-def send_email(to_email, subject, body, attachment_path):
-    """Sends an email with an attachment using SMTP."""
-    try:
-        msg = MIMEMultipart()
-        msg["From"] = SENDER_EMAIL
-        msg["To"] = to_email
-        msg["Subject"] = subject
-        msg.attach(MIMEText(body, "plain"))
-
-        # Attach the PDF file
-        with open(attachment_path, "rb") as attachment:
-            part = MIMEBase("application", "octet-stream")
-            part.set_payload(attachment.read())
-            encoders.encode_base64(part)
-            part.add_header(
-                "Content-Disposition",
-                f"attachment; filename= {attachment_path}",
-            )
-            msg.attach(part)
+    In test mode the contact index isn't consulted: inboxes emailed before are previewed like any other.
+    """
+    global contact_index, recipient_filter
+    per_domain = args.max_per_domain or int(os.getenv("MAX_PER_DOMAIN") or 0)
+    contact_index = ContactIndex(args.contacts)
+    recipient_filter = RecipientFilter(None if test_mode else contact_index, per_domain or None)
 
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SENDER_EMAIL, SENDER_PASSWORD)
-            server.sendmail(SENDER_EMAIL, to_email, msg.as_string())
+def screen_recipients(companies):
+    """Stream the companies that pass the recipient filter, announcing and counting the others."""
+    for company in companies:
+        suppressed = recipient_filter.check(company)
+        if suppressed is None:
+            yield company
+            continue
+        reason, detail = suppressed
+        metrics.increment(f"recipients.{reason}")
+        print(f"⏭️ Skipping {company.name} - {RecipientFilter.REASONS[reason]} ({detail})")
 
-        print(f"✅ Email sent to {to_email}")
+def already_sent(company):
+    """Whether ``company`` was emailed in this campaign; if so its inbox is also noted in the contact index."""
+    if not (company.is_sent or company in send_journal):
+        return False
+    if contact_index is not None:
+        contact_index.record(company.email, os.path.basename(companies.path))
+    return True
 
-    except Exception as e:
-        print(f"❌ Failed to send email to {to_email}: {e}")
+def record_sent(company):
+    """Journal a successful send and add the inbox to the contact index."""
+    send_journal.record(company)
+    if contact_index is not None:
+        contact_index.record(company.email, os.path.basename(companies.path))
 
-def get_company_info_from_gemini(api_key, company_name, city=None):
-    """Fetch company details using Google Gemini AI."""
-    client = genai.Client(api_key=api_key)
-    
+def report_suppressed():
+    """Summarize the recipients screened out this run and list them next to the companies file."""
+    if not recipient_filter or not recipient_filter.suppressed:
+        return
+    path = companies.path + ".suppressed.jsonl"
+    counts = ", ".join(f"{count} {reason}" for reason, count in recipient_filter.counts().most_common())
     try:
-        # Build a more specific prompt using company name and city
-        location_info = f" in {city}" if city else ""
-        prompt = f"""
-        Provide factual information about {company_name}{location_info} company. 
-        Include details about:
-        - Their main business activities
-        - Size of the company (if available)
-        - Notable achievements or projects
-        - Technology stack they use (if it's a tech company)
-        
-        Focus only on providing factual information. Do not recommend any actions, 
-        investments, or personal opinions. Do not suggest contacting the company 
-        or visiting their locations.
-        
-        Format your response in Markdown with appropriate headings, bullet points, 
-        and sections for easy readability. Use ## for main sections and * for bullet points.
-        """
-        
-        # Query Gemini AI for information about the company
-        response = client.models.generate_content(
-            model="gemini-2.0-flash", 
-            contents=prompt
-        )
-        return response.text
-    except Exception as e:
-        print(f"❌ Failed to get information from Gemini AI: {e}")
-        return None
+        recipient_filter.write_report(path)
+        print(f"ℹ️ Suppressed {len(recipient_filter.suppressed)} recipients ({counts}); listed in {path}")
+    except OSError as e:
+        print(f"❌ Failed to write the suppressed recipients report: {e}")
 
-def save_company_info_to_file(company_info_dict):
-    """Save company information to a text file with nice formatting."""
-    filename = "company_information.md"
-    filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
-    
+def report_metrics(args):
+    """Print the per-stage timing table and export the run's metrics where requested."""
+    if not metrics:
+        return
+    print("\n📊 Run metrics")
+    print(metrics.summary_table())
     try:
-        with open(filepath, "w", encoding="utf-8") as file:
-            file.write("=" * 80 + "\n")
-            file.write("COMPANY INFORMATION REPORT\n")
-            file.write("=" * 80 + "\n\n")
-            
-            for company_name, info in company_info_dict.items():
-                file.write("-" * 80 + "\n")
-                file.write(f"COMPANY: {company_name}\n")
-                file.write("-" * 80 + "\n\n")
-                file.write(f"{info}\n\n")
-            
-        print(f"✅ Company information saved to {filepath}")
-        return True
+        if args.metrics_log:
+            metrics.write_jsonl(args.metrics_log, command=args.command, companies=args.companies)
+            print(f"ℹ️ Run metrics appended to {args.metrics_log}")
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+            print(f"ℹ️ Prometheus metrics written to {args.prometheus}")
+    except OSError as e:
+        print(f"❌ Failed to export run metrics: {e}")
+
+def shutdown():
+    """Close the send journal, shared SMTP session and Gemini client, and print run statistics."""
+    report_suppressed()
+    if send_journal:
+        send_journal.close()
+    if contact_index:
+        contact_index.close()
+    if dead_letters:
+        dead_letters.close()
+    if research_context:
+        research_context.close()
+    if smtp_pool:
+        smtp_pool.close()
+    if client_stats["created"]:
+        print(f"ℹ️ Gemini client created {client_stats['created']} time(s), reused for {client_stats['reused']} call(s).")
+    close_client()
+    if gemini_cache:
+        if gemini_cache.stats["hits"] or gemini_cache.stats["misses"]:
+            print(f"ℹ️ {gemini_cache.summary()}")
+        gemini_cache.close()
+
+# Email templates, one file per language code in templates/ (loaded on first use, which is also when jinja2 is imported)
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+email_templates = None
+
+def get_email_templates():
+    """Return the template registry, creating it on first use."""
+    global email_templates
+    if email_templates is None:
+        from template_registry import TemplateRegistry
+
+        directory = os.getenv("TEMPLATES_DIR") or TEMPLATES_DIR
+        email_templates = TemplateRegistry(directory, cache_dir=os.path.join(directory, ".cache"))
+    return email_templates
+
+def sender_context():
+    """Template values shared by every email: the applicant's details."""
+    return {"sender_name": MY_NAME, "sender_phone": MY_PHONE, "sender_email": MY_EMAIL}
+
+def template_subject(company):
+    return f"Internship Application - {company.name}"
+
+def template_email(company):
+    """Render the standard template email for a company; returns (subject, body)."""
+    email_body = get_email_templates().render(
+        company.language, name=company.name, contact_person=company.contact_person, company=company, **sender_context()
+    )
+    return template_subject(company), email_body
+
+def report_send_result(result):
+    """Print and count the outcome of one send."""
+    if result:
+        metrics.increment("emails.sent")
+        print(f"✅ Email sent to {result.recipient}" + (f" (attempt {result.attempts})" if result.attempts > 1 else ""))
+    else:
+        metrics.increment("emails.failed")
+        kind = "permanently" if result.permanent else f"after {result.attempts} attempt(s)"
+        print(f"❌ Failed to send email to {result.recipient} {kind}: {result.error}")
+    return result
+
+def send_email(to_email, subject, body, attachment_path):
+    """Sends an email with an attachment over the shared SMTP session and returns its SendResult.
+
+    The result is truthy if the relay accepted the message. Temporary
+    failures are retried with backoff first. The message is built before
+    waiting for the scheduler's next slot, so building it costs no extra
+    time between sends.
+    """
+    try:
+        message = build_message(SENDER_EMAIL, to_email, subject, body, attachment_path)
     except Exception as e:
-        print(f"❌ Failed to save company information to file: {e}")
-        return False
+        return report_send_result(SendResult(to_email, False, 0, str(e) or type(e).__name__, permanent=True))
+    return report_send_result(deliver(smtp_pool, SENDER_EMAIL, to_email, message, send_scheduler, send_retry_policy))
+
+def write_previews(args, drafts):
+    """Write test-mode ``(company, subject, body)`` drafts to --test-output instead of sending each to TEST_EMAIL.
 
-def generate_ai_email(api_key, company_name, contact_person, city=None, language="English"):
-    """Generate personalized email content and subject using Google Gemini AI based on company details."""
-    client = genai.Client(api_key=api_key)
-    
+    Nothing is paced and nothing goes over the network, except the one
+    digest message with ``--test-output digest``.
+    """
+    if args.test_output == "digest":
+        previews = PreviewDigest()
+    else:
+        path = args.test_path or ("previews.mbox" if args.test_output == "mbox" else "previews")
+        try:
+            previews = PreviewMailbox(args.test_output, path, SENDER_EMAIL, MY_RESUME_PATH)
+        except ValueError as e:
+            print(f"❌ ERROR: {e}")
+            return
+    index = PreviewIndex(args.html_index, MY_RESUME_PATH) if args.html_index else None
     try:
-        location_info = f" in {city}" if city else ""
-        
-        if language == "French":
-            # Generate email body
-            body_prompt = f"""
-            Écris un email professionnel en français pour une candidature de stage en développement Web à {company_name}{location_info}.
-            L'email doit:
-            - Être adressé à {contact_person}
-            - Mentionner mon intérêt spécifique pour {company_name} et pourquoi je voudrais y travailler
-            - Mentionner que mon CV est joint
-            - Être concis (maximum 5-6 phrases)
-            - Avoir un ton formel mais chaleureux
-            - Se terminer par "Dans l'attente de votre réponse. Cordialement, {MY_NAME}"
-            - Ne pas inclure d'informations inventées sur l'entreprise
-            - S'assurer que je suis clairement identifié comme {MY_NAME} (pas de placeholder comme [Votre Nom])
-            
-            IMPORTANT: 
-            - N'inclus pas d'objet d'email ou de pièce jointe dans ton texte
-            - N'inclus pas de commentaires, notes, ou explications
-            - N'utilise pas de balises de formatage (markdown, html, etc.)
-            - Le texte doit être prêt à l'envoi exactement comme tu le fournis
-            - Ne commence pas par "Voici un email..." ou des phrases similaires
-            """
-            
-            # Generate email subject
-            subject_prompt = f"""
-            Crée un objet d'email concis et professionnel en français pour une candidature de stage en développement Web à {company_name}.
-            L'objet doit:
-            - Être court (maximum 60 caractères)
-            - Être direct et clair
-            - Mentionner qu'il s'agit d'une candidature de stage de {MY_NAME}
-            - Ne pas contenir de point à la fin
-            - Ne pas contenir de placeholders comme [Votre Nom]
-            - Ne pas contenir de guillemets, de préfixes ou d'autres symboles non nécessaires
-            
-            IMPORTANT:
-            - Réponds uniquement avec l'objet de l'email, rien d'autre
-            - Ne commence pas par "Objet:" ou "Sujet:"
-            - N'utilise pas de formatage spécial
-            """
-        else:
-            # Generate email body
-            body_prompt = f"""
-            Write a professional email in English for an internship application in Web Development to {company_name}{location_info}.
-            The email should:
-            - Be addressed to {contact_person}
-            - Mention my specific interest in {company_name} and why I would like to work there
-            - Mention that my CV is attached
-            - Be concise (maximum 5-6 sentences)
-            - Have a formal but warm tone
-            - End with "Looking forward to your response. Best regards, {MY_NAME}"
-            - Not include made-up information about the company
-            - Make sure I'm clearly identified as {MY_NAME} (no placeholders like [Your Name])
-            
-            IMPORTANT:
-            - Do not include email subject or attachment notes in your text
-            - Do not include any comments, notes, or explanations
-            - Do not use any formatting tags (markdown, html, etc.)
-            - The text should be ready to send exactly as you provide it
-            - Do not start with "Here's an email..." or similar phrases
-            """
-            
-            # Generate email subject
-            subject_prompt = f"""
-            Create a concise and professional email subject line in English for a Web Development internship application to {company_name}.
-            The subject should:
-            - Be short (maximum 60 characters)
-            - Be direct and clear
-            - Mention it's an internship application from {MY_NAME}
-            - Not end with a period
-            - Not contain placeholders like [Your Name]
-            - Not contain quotes, prefixes or other unnecessary symbols
-            
-            IMPORTANT:
-            - Only respond with the email subject line, nothing else
-            - Do not start with "Subject:" or similar prefixes
-            - Do not use any special formatting
-            """
-        
-        # Generate email body
-        body_response = client.models.generate_content(
-            model="gemini-2.0-flash", 
-            contents=body_prompt
-        )
-        
-        # Generate email subject
-        subject_response = client.models.generate_content(
-            model="gemini-2.0-flash", 
-            contents=subject_prompt
+        for company, email_subject, email_body in drafts:
+            previews.add(company.email, email_subject, email_body)
+            if index:
+                index.add(company, company.email, email_subject, email_body)
+            print(f"📝 Previewed email to {company.name}: '{email_subject}'")
+    finally:
+        if isinstance(previews, PreviewMailbox):
+            previews.close()
+        if index:
+            index.write()
+
+    if isinstance(previews, PreviewMailbox):
+        print(f"✅ Wrote {previews.count} test emails to the {args.test_output} at {previews.path}")
+    elif previews.count:
+        print(f"Sending a digest of {previews.count} test emails to {TEST_EMAIL}...")
+        if send_email(TEST_EMAIL, previews.subject(), previews.text(), MY_RESUME_PATH):
+            print(f"✅ Digest of {previews.count} test emails sent to {TEST_EMAIL}!")
+    else:
+        print("No test emails to preview.")
+    if index:
+        print(f"ℹ️ HTML index of the previews written to {index.path}")
+    print("ℹ️ Note: No companies were marked as 'sent' since this was a test.")
+
+def dead_letter(company, result):
+    """Remember a recipient the relay rejected permanently, so later runs skip it."""
+    if result.rejected:
+        dead_letters.record(company, result)
+        metrics.increment("emails.dead_lettered")
+        print(f"⚠️ {result.recipient} was rejected permanently; it is listed in {dead_letters.path} and will be skipped from now on.")
+
+def open_research_report(args):
+    """Open the research report named by --report, with its JSON Lines index unless --no-index."""
+    index_path = None if getattr(args, "no_index", False) else os.path.splitext(args.report)[0] + ".jsonl"
+    return ResearchReport(args.report, index_path)
+
+def company_research(company):
+    """Summary of the company's research for the email prompt, or None without --use-research.
+
+    Companies missing from the report are researched first and recorded, so
+    later runs (and the research command) reuse the answer.
+    """
+    if research_context is None:
+        return None
+    info = research_context.get(company)
+    if info is None:
+        metrics.increment("research.misses")
+        info = get_company_info_from_gemini(
+            gemini_api_key, company.name, company.city, rate_limiter=gemini_rate_limiter, cache=gemini_cache
         )
-        
-        # Clean up the responses
-        email_body = body_response.text.strip() if body_response.text else None
-        email_subject = subject_response.text.strip() if subject_response.text else None
-        
-        # Post-processing to remove any remaining artifacts
-        if email_body:
-            # Remove any markdown or formatting markers
-            email_body = email_body.replace('```', '').replace('markdown', '')
-            # Remove any lines that might be AI comments
-            lines = email_body.split('\n')
-            clean_lines = []
-            for line in lines:
-                if not line.startswith(('Here is', 'Voici', 'Note:', 'Here\'s', 'I hope', 'This email')):
-                    clean_lines.append(line)
-            email_body = '\n'.join(clean_lines).strip()
-        
-        if email_subject:
-            # Remove any quotes, "Subject:", etc.
-            email_subject = email_subject.replace('"', '').replace("'", '').strip()
-            if email_subject.lower().startswith('subject:'):
-                email_subject = email_subject[8:].strip()
-            if email_subject.lower().startswith('objet:'):
-                email_subject = email_subject[6:].strip()
-        
-        return email_subject, email_body
-        
-    except Exception as e:
-        print(f"❌ Failed to generate personalized email: {e}")
-        return None, None
+        if not info:
+            return None
+        research_context.record(company, info)
+    else:
+        metrics.increment("research.hits")
+    return summarize(info)
+
+def generate_company_email(company):
+    """Generate the AI subject and body for one company record."""
+    return generate_ai_email(
+        gemini_api_key,
+        MY_NAME,
+        company.name,
+        company.contact_person,
+        company.city,
+        company.language,
+        rate_limiter=gemini_rate_limiter,
+        cache=gemini_cache,
+        research=company_research(company)
+    )
+
+async def generate_company_email_async(company):
+    """Generate the AI subject and body for one company record on the running event loop."""
+    research = None
+    if research_context is not None:
+        import asyncio
+        # Research lookups (and the occasional research request) are blocking; keep them off the loop
+        research = await asyncio.to_thread(company_research, company)
+    return await generate_ai_email_async(
+        gemini_api_key,
+        MY_NAME,
+        company.name,
+        company.contact_person,
+        company.city,
+        company.language,
+        rate_limiter=gemini_rate_limiter,
+        cache=gemini_cache,
+        research=research
+    )
+
+def generate_company_email_batch(language, batch):
+    """Generate AI subjects and bodies for a batch of same-language company records."""
+    return generate_ai_emails_batch(
+        gemini_api_key,
+        MY_NAME,
+        batch,
+        language,
+        rate_limiter=gemini_rate_limiter,
+        cache=gemini_cache,
+        research=[company_research(company) for company in batch] if research_context is not None else None
+    )
+
+def generate_drafts(companies):
+    """Yield (company, (subject, body)) for each company, batching Gemini requests if configured."""
+    if GEMINI_BATCH_SIZE > 1:
+        return generate_email_batches(companies, generate_company_email_batch, GEMINI_BATCH_SIZE, GEMINI_CONCURRENCY)
+    return generate_emails(companies, generate_company_email, GEMINI_CONCURRENCY)
 
 def display_generated_email(company_name, contact_person, email_subject, email_body, language):
     """Display a generated email in the console with nice formatting."""
@@ -360,113 +498,212 @@ def display_generated_email(company_name, contact_person, email_subject, email_b
     print("\n" + email_body + "\n")
     print("-" * 80 + "\n")
 
-def update_companies_sent_status(companies_sent):
-    """Update the is_sent status in the companies.json file."""
+def update_companies_sent_status():
+    """Fold the send journal back into the companies file as is_sent flags."""
     try:
-        # Read the current JSON file
-        with open("companies.json", "r", encoding="utf-8") as file:
-            companies = json.load(file)
-        
-        # Update the is_sent status for companies that were sent emails
-        for company in companies:
-            if company["name"] in companies_sent:
-                company["is_sent"] = True
-        
-        # Write the updated data back to the file
-        with open("companies.json", "w", encoding="utf-8") as file:
-            json.dump(companies, file, indent=4)
-        
+        send_journal.compact(companies.path)
+
         print("✅ Companies JSON file updated successfully!")
         return True
     except Exception as e:
         print(f"❌ Failed to update companies JSON file: {e}")
         return False
 
-# Menu for user to choose action
-print("Please choose an option:")
-print("1. Send emails to companies")
-print("2. Fetch company information using Google Gemini AI")
-print("3. Test AI email generation (no emails sent)")
-option = input("Enter your choice (1, 2 or 3): ")
+def ask_test_mode(prompt="Do you want to test emails or send actual emails?\n"):
+    """Ask whether to send to the test inbox (True) or to the companies (False)."""
+    test_option = input(prompt + "1. Test mode (send to test inbox)\n2. Actual mode (send to companies)\nEnter your choice (1 or 2): ")
+    return test_option == "1"
 
-if option == "1":
-    # Ask if the user wants to use AI-generated emails or templates
+def ask_use_ai():
+    """Ask whether to personalize emails with AI (True) or use the standard templates (False)."""
     email_option = input("How would you like to generate emails?\n1. Use AI to personalize each email\n2. Use standard templates\nEnter your choice (1 or 2): ")
-    use_ai = email_option == "1"
-    
+    return email_option == "1"
+
+def draft_emails(use_ai, companies):
+    """Yield (company, subject, body) for each company, falling back to the template when AI generation fails."""
+    # AI emails are generated concurrently, ahead of whoever consumes them
+    if use_ai:
+        print("Generating AI personalized emails...")
+        drafts = generate_drafts(companies)
+    else:
+        # Template emails are rendered as the companies stream in, each language's template compiled once
+        drafts = (
+            (company, (template_subject(company), email_body))
+            for company, email_body in get_email_templates().render_many(companies, **sender_context())
+        )
+
+    for company, (email_subject, email_body) in drafts:
+        yield company, *with_template_fallback(use_ai, company, email_subject, email_body)
+
+async def draft_emails_async(use_ai, companies):
+    """Like draft_emails, but AI emails are generated on the running event loop."""
+    if use_ai:
+        print("Generating AI personalized emails...")
+        if GEMINI_BATCH_SIZE > 1:
+            print("ℹ️ Batched generation isn't used when sending concurrently; each company gets its own requests.")
+        drafts = generate_emails_async(companies, generate_company_email_async, GEMINI_CONCURRENCY)
+    else:
+        async def rendered():
+            for company, email_body in get_email_templates().render_many(companies, **sender_context()):
+                yield company, (template_subject(company), email_body)
+        drafts = rendered()
+
+    async for company, (email_subject, email_body) in drafts:
+        yield company, *with_template_fallback(use_ai, company, email_subject, email_body)
+
+def with_template_fallback(use_ai, company, email_subject, email_body):
+    """The (subject, body) to send: the generated ones, or the template if AI generation failed."""
+    if use_ai and not email_body:
+        # Fall back to templates if AI generation fails
+        print(f"⚠️ AI email generation failed for {company.name}, using template instead.")
+        metrics.increment("emails.template_fallback")
+    if not email_body:
+        email_subject, email_body = template_email(company)
+    elif not email_subject:
+        # A good body whose subject was rejected keeps the body
+        email_subject = template_subject(company)
+    return email_subject, email_body
+
+async def send_concurrently(use_ai, companies, recipient_for, concurrency, on_result):
+    """Generate and send emails on one event loop, with up to ``concurrency`` SMTP sends in flight.
+
+    AI generation and delivery overlap: drafts are pulled from Gemini only as
+    fast as sends complete. ``on_result(company, subject, result)`` is called
+    as each send finishes.
+    """
+    from async_mailer import AsyncSMTPPool, deliver_all
+
+    pool = AsyncSMTPPool(
+        smtp_pool.host, smtp_pool.port, smtp_pool.username, smtp_pool.password,
+        size=concurrency, max_messages_per_connection=smtp_pool.max_messages_per_connection,
+        starttls=smtp_pool.starttls,
+    )
+
+    async def outgoing():
+        async for company, email_subject, email_body in draft_emails_async(use_ai, companies):
+            yield company, recipient_for(company), email_subject, email_body
+
+    try:
+        results = deliver_all(pool, SENDER_EMAIL, outgoing(), MY_RESUME_PATH, send_scheduler, send_retry_policy,
+                              concurrency)
+        async for (company, _, email_subject, _), result in results:
+            on_result(company, email_subject, report_send_result(result))
+    finally:
+        await pool.close()
+        if use_ai:
+            await close_async_client()
+
+def save_to_outbox(outbox, company, email_subject, email_body):
+    """Build the email to ``company`` and store it in ``outbox`` (the resume is attached at delivery)."""
+    message = build_message(SENDER_EMAIL, company.email, email_subject, email_body)
+    return outbox.add(company, email_subject, message, MY_RESUME_PATH)
+
+def run_send(args):
+    """Send emails to companies (menu option 1)."""
+    # Ask if the user wants to use AI-generated emails or templates
+    use_ai = args.use_ai if args.use_ai is not None else ask_use_ai()
+
     # Ask if the user wants to send in test mode or actual mode
-    test_option = input("Do you want to test emails or send actual emails?\n1. Test mode (send to test inbox)\n2. Actual mode (send to companies)\nEnter your choice (1 or 2): ")
-    
-    template_en = Template(email_template_en)
-    template_fr = Template(email_template_fr)
-    attachment_path = MY_RESUME_PATH  # Update with the actual path to your PDF
-    
+    test_mode = args.test_mode if args.test_mode is not None else ask_test_mode()
+    # Test emails written to a local mailbox need no SMTP settings at all
+    local_previews = test_mode and args.test_output in ("mbox", "maildir")
+
+    setup_profile()
+    if local_previews:
+        setup_sender()
+    else:
+        setup_sending()
+    if use_ai:
+        setup_gemini(args)
+        setup_research(args)
+    setup_companies(args)
+    setup_recipients(args, test_mode)
+
     # Test mode will send all emails to the test inbox
-    test_mode = test_option == "1"
     test_email = TEST_EMAIL
-    
-    # Keep track of sent companies and skipped companies
-    companies_sent = []
-    companies_skipped = []
-    
-    for company in companies:
-        company_name = company["name"]
-        
-        # Skip companies that have already been sent emails (only in actual mode)
-        if not test_mode and company.get("is_sent", False):
-            print(f"⏭️ Skipping {company_name} - Email already sent previously")
-            companies_skipped.append(company_name)
-            continue
-            
-        contact_person = company["contact_person"]
-        city = company.get("city", None)
-        language = company.get("language", "English")
-        
-        if use_ai:
-            print(f"Generating AI personalized email for {company_name}...")
-            email_subject, email_body = generate_ai_email(
-                gemini_api_key, 
-                company_name, 
-                contact_person, 
-                city, 
-                language
-            )
-            
-            # Fall back to templates if AI generation fails
-            if not email_body:
-                print(f"⚠️ AI email generation failed for {company_name}, using template instead.")
-                if language == "French":
-                    email_body = template_fr.render(name=company_name, contact_person=contact_person)
-                else:
-                    email_body = template_en.render(name=company_name, contact_person=contact_person)
-                # Default subject if AI subject generation failed
-                email_subject = f"Internship Application - {company_name}"
-        else:
-            # Use template emails
-            if language == "French":
-                email_body = template_fr.render(name=company_name, contact_person=contact_person)
-            else:
-                email_body = template_en.render(name=company_name, contact_person=contact_person)
-            # Default subject for template emails
-            email_subject = f"Internship Application - {company_name}"
 
-        # If in test mode, send to test email, otherwise send to actual company email
-        recipient_email = test_email if test_mode else company["email"]
-        
-        # Create a log subject with prefix (for display only)
+    # Count sent and skipped companies
+    companies_sent = 0
+    companies_skipped = 0
+
+    def pending_companies():
+        """Stream the companies that still need an email."""
+        nonlocal companies_skipped
+        for company in companies:
+            # Skip companies that have already been sent emails (only in actual mode)
+            if not test_mode and already_sent(company):
+                print(f"⏭️ Skipping {company.name} - Email already sent previously")
+                companies_skipped += 1
+                continue
+            if not test_mode and company in dead_letters:
+                print(f"⏭️ Skipping {company.name} - Address was rejected permanently before")
+                companies_skipped += 1
+                continue
+            yield company
+
+    def outgoing():
+        """Stream (company, recipient, subject, body) for every email to send."""
+        # Duplicate and capped recipients are dropped before any email is generated for them
+        for company, email_subject, email_body in draft_emails(use_ai, screen_recipients(pending_companies())):
+            # If in test mode, send to test email, otherwise send to actual company email
+            yield company, test_email if test_mode else company.email, email_subject, email_body
+
+    def handle(company, email_subject, result):
+        nonlocal companies_sent
+        if not result:
+            if not test_mode:
+                dead_letter(company, result)
+            return
+        # Log with a prefixed subject (for display only; the email itself has the clean subject)
         log_subject = f"[{'AI' if use_ai else 'Template'} {'TEST' if test_mode else 'ACTUAL'}] {email_subject}"
-        
-        # Send email with the clean subject (no prefix)
-        send_email(recipient_email, email_subject, email_body, MY_RESUME_PATH)
-        
-        # Log with the prefixed subject
-        print(f"Email with subject '{log_subject}' sent to {recipient_email}")
-        
-        # Add to sent list if in actual mode
+        print(f"Email with subject '{log_subject}' sent to {result.recipient}")
+
+        # Journal the send right away if in actual mode
         if not test_mode:
-            companies_sent.append(company_name)
-            
-        time.sleep(5)  # Delay to avoid spam detection
+            record_sent(company)
+            companies_sent += 1
+
+    if test_mode and args.test_output != "smtp":
+        write_previews(args, draft_emails(use_ai, screen_recipients(pending_companies())))
+        return
+
+    workers = args.workers or int(os.getenv("SEND_WORKERS") or 1)
+    concurrency = args.concurrency or int(os.getenv("SEND_CONCURRENCY") or 1)
+    if workers > 1 and concurrency > 1:
+        print("❌ Choose either worker processes (--workers) or concurrent sends (--concurrency), not both.")
+        return
+    results = ()
+    if concurrency > 1:
+        # One event loop drives Gemini requests and up to `concurrency` SMTP sessions at once
+        import asyncio
+        print(f"ℹ️ Sending up to {concurrency} emails at a time...")
+        asyncio.run(send_concurrently(
+            use_ai, screen_recipients(pending_companies()), lambda company: test_email if test_mode else company.email,
+            concurrency, handle,
+        ))
+    elif workers > 1:
+        # Worker processes deliver in parallel, each over its own SMTP connection; this process journals the results
+        print(f"ℹ️ Sending with {workers} worker processes over {len(smtp_accounts)} SMTP account(s)...")
+        engine = SendEngine(
+            smtp_accounts,
+            workers,
+            MY_RESUME_PATH,
+            send_scheduler_settings,
+            global_per_minute=optional_float("SEND_GLOBAL_PER_MINUTE"),
+            retry_policy=send_retry_policy,
+        )
+        results = (
+            (company, email_subject, report_send_result(result))
+            for (company, _, email_subject, _), result in engine.run(outgoing())
+        )
+    else:
+        results = (
+            (company, email_subject, send_email(recipient_email, email_subject, email_body, MY_RESUME_PATH))
+            for company, recipient_email, email_subject, email_body in outgoing()
+        )
+
+    for company, email_subject, result in results:
+        handle(company, email_subject, result)
 
     # Display summary
     if test_mode:
@@ -475,188 +712,564 @@ if option == "1":
     else:
         # Update the companies.json file with sent status
         if companies_sent:
-            update_companies_sent_status(companies_sent)
-            print(f"✅ Sent emails to {len(companies_sent)} companies!")
-        
+            update_companies_sent_status()
+            print(f"✅ Sent emails to {companies_sent} companies!")
+
         if companies_skipped:
-            print(f"ℹ️ Skipped {len(companies_skipped)} companies that were already sent emails.")
+            print(f"ℹ️ Skipped {companies_skipped} companies that were already sent emails.")
 
-elif option == "2":
-    company_info_dict = {}
-    for company in companies:
-        city = company.get("city", None)  # Get the city if available
-        print(f"Fetching information for {company['name']}...")
-        info = get_company_info_from_gemini(gemini_api_key, company["name"], city)
-        if info:
-            print(f"Information retrieved for {company['name']}")
-            company_info_dict[company["name"]] = info
-        time.sleep(3)  # Delay between API calls
-    
-    # Ask user if they want to save the information to a file
-    if company_info_dict:
-        save_option = input("Do you want to save the company information to a file? (y/n): ")
-        if save_option.lower() == 'y':
-            save_company_info_to_file(company_info_dict)
-    else:
+def run_research(args):
+    """Fetch company information using Google Gemini AI (menu option 2)."""
+    # Ask user if they want to save the information to a file (each company is written as soon as it arrives)
+    save = args.save
+    if save is None:
+        save = input("Do you want to save the company information to a file? (y/n): ").lower() == 'y'
+
+    setup_gemini(args)
+    setup_companies(args)
+
+    report = open_research_report(args) if save else None
+    companies_fetched = 0
+    companies_skipped = 0
+    try:
+        for company in companies:
+            # Companies already in the report are only fetched again with --refresh
+            if report is not None and company in report and not args.refresh:
+                companies_skipped += 1
+                continue
+            city = company.city  # Get the city if available
+            print(f"Fetching information for {company.name}...")
+            info = get_company_info_from_gemini(
+                gemini_api_key, company.name, city, rate_limiter=gemini_rate_limiter, cache=gemini_cache
+            )
+            if not info:
+                continue
+            print(f"Information retrieved for {company.name}")
+            companies_fetched += 1
+            if report is not None:
+                report.record(company, info)
+            else:
+                print(f"\n{info}\n")
+    finally:
+        if report is not None:
+            report.close()
+
+    if companies_skipped:
+        print(f"⏭️ Skipped {companies_skipped} companies already in {args.report} (use --refresh to fetch them again)")
+    if companies_fetched and report is not None:
+        print(f"✅ Company information saved to {args.report}")
+    elif not companies_fetched and not companies_skipped:
         print("No company information was retrieved.")
 
-elif option == "3":
+def run_preview(args):
+    """Generate and preview AI emails, then optionally send them (menu option 3)."""
+    setup_profile()
+    setup_sender()
+    setup_gemini(args)
+    setup_research(args)
+    setup_companies(args)
+    # Every listed inbox is previewed once; the contact index is only checked when sending for real
+    setup_recipients(args, test_mode=True)
+
+    # Every previewed email is also saved to the outbox, so it can be delivered later exactly as shown
+    outbox = Outbox(args.outbox)
+
     print("\n📝 Testing AI email generation - previewing emails without sending them...")
-    
-    # Store generated emails to potentially send them later
+
+    # Index companies by their stable id, so companies sharing a display name don't collide
+    registry = CompanyRegistry(screen_recipients(companies))
+    if registry.duplicates:
+        print(f"⚠️ Ignoring {len(registry.duplicates)} duplicate entries for email addresses already listed.")
+
+    # Store generated emails (keyed by company id) to potentially send them later
     generated_emails = {}
-    
-    # Loop through each company
-    for company in companies:
-        company_name = company["name"]
-        contact_person = company["contact_person"]
-        city = company.get("city", None)
-        language = company.get("language", "English")
-        
-        print(f"Generating AI personalized email for {company_name}...")
-        email_subject, email_body = generate_ai_email(
-            gemini_api_key, 
-            company_name, 
-            contact_person, 
-            city, 
-            language
-        )
-        
+
+    # Generate emails for all companies concurrently, previewing them in order
+    print(f"Generating AI personalized emails (up to {GEMINI_CONCURRENCY} companies at a time)...")
+    for company, (email_subject, email_body) in generate_drafts(registry):
         # Store the generated email
         if email_body:
-            generated_emails[company_name] = {
-                "subject": email_subject or f"Internship Application - {company_name}",
+            generated_emails[company.id] = {
+                "subject": email_subject or f"Internship Application - {company.name}",
                 "body": email_body,
-                "language": language,
-                "contact_person": contact_person
+                "language": company.language,
+                "contact_person": company.contact_person
             }
             # Display the generated email
-            display_generated_email(company_name, contact_person, email_subject, email_body, language)
+            display_generated_email(company.name, company.contact_person, email_subject, email_body, company.language)
+            save_to_outbox(outbox, company, generated_emails[company.id]["subject"], email_body)
         else:
-            print(f"⚠️ AI email generation failed for {company_name}")
-            
-        time.sleep(2)  # Small delay between API calls
-    
+            print(f"⚠️ AI email generation failed for {company.name}")
+
     print("\n✅ All test emails generated and displayed.")
-    
-    # Ask if user wants to take action with the emails
     if generated_emails:
+        print(f"📝 Saved {len(generated_emails)} drafts to {outbox.path}/")
+
+    if not generated_emails:
+        print("No valid emails were generated. Exiting...")
+        return
+
+    # Ask if user wants to take action with the emails
+    then = args.then
+    if then is None:
         send_option = input("\nWhat would you like to do with these emails?\n"
-                           f"1. Send all test emails to my inbox ({TEST_EMAIL})\n"
+                           f"1. Send all test emails to my inbox ({os.getenv('TEST_EMAIL')})\n"
                            "2. Proceed with normal sending options\n"
                            "3. Exit without sending\n"
                            "Enter your choice (1, 2, or 3): ")
-        
-        if send_option == "1":
-            # Send all emails directly to test inbox
-            test_email = TEST_EMAIL
-            attachment_path = MY_RESUME_PATH
-            
-            print(f"\nSending all test emails to {test_email}...")
-            
-            for company_name, email_data in generated_emails.items():
-                email_body = email_data["body"]
-                email_subject = email_data["subject"]
-                
-                # For logging purposes only
-                print(f"Sending email about {company_name}...")
-                
-                # Send with clean subject (no prefix)
-                send_email(test_email, email_subject, email_body, attachment_path)
-                time.sleep(3)  # Shorter delay for test emails
-                
+        then = {"1": "test", "2": "send"}.get(send_option, "exit")
+
+    if then == "test" and args.test_output != "smtp":
+        if args.test_output == "digest":
+            setup_sending()
+        write_previews(args, (
+            (registry.get(company_id), email_data["subject"], email_data["body"])
+            for company_id, email_data in generated_emails.items()
+        ))
+
+    elif then == "test":
+        setup_sending()
+
+        # Send all emails directly to test inbox
+        test_email = TEST_EMAIL
+        attachment_path = MY_RESUME_PATH
+
+        print(f"\nSending all test emails to {test_email}...")
+
+        for company_id, email_data in generated_emails.items():
+            # For logging purposes only
+            print(f"Sending email about {registry.get(company_id).name}...")
+
+            # Send with clean subject (no prefix)
+            send_email(test_email, email_data["subject"], email_data["body"], attachment_path)
+
+        print(f"✅ All test emails sent to {test_email}!")
+        print("ℹ️ Note: No companies were marked as 'sent' since this was a test.")
+
+    elif then == "send":
+        # Continue with the normal sending process
+        # Ask if test mode or actual mode
+        test_mode = args.test_mode if args.test_mode is not None else ask_test_mode("")
+        setup_sending()
+
+        attachment_path = MY_RESUME_PATH
+
+        # Test mode will send all emails to the test inbox
+        test_email = TEST_EMAIL
+
+        # Count sent and skipped companies
+        companies_sent = 0
+        companies_skipped = 0
+
+        # In actual mode only companies not yet sent are considered
+        if not test_mode:
+            companies_skipped = len(registry) - len(registry.unsent())
+            if companies_skipped:
+                print(f"⏭️ Skipping {companies_skipped} companies - Email already sent previously")
+
+        for company in registry if test_mode else registry.unsent():
+            # Also skip companies journaled as sent but not yet compacted into the file
+            if not test_mode and already_sent(company):
+                print(f"⏭️ Skipping {company.name} - Email already sent previously")
+                companies_skipped += 1
+                continue
+            if not test_mode and company in dead_letters:
+                print(f"⏭️ Skipping {company.name} - Address was rejected permanently before")
+                companies_skipped += 1
+                continue
+            if not test_mode and company.email in contact_index:
+                print(f"⏭️ Skipping {company.name} - {RecipientFilter.REASONS['contacted']}")
+                companies_skipped += 1
+                continue
+
+            # Use the already generated email if available
+            if company.id in generated_emails:
+                email_body = generated_emails[company.id]["body"]
+                email_subject = generated_emails[company.id]["subject"]
+            else:
+                # This should not happen, but just in case
+                print(f"Re-generating email for {company.name}...")
+                email_subject, email_body = with_template_fallback(True, company, *generate_company_email(company))
+
+            # If in test mode, send to test email, otherwise send to actual company email
+            recipient_email = test_email if test_mode else company.email
+
+            # For logging purposes only
+            if test_mode:
+                print(f"Sending test email about {company.name}...")
+            else:
+                print(f"Sending actual email to {company.name}...")
+
+            # Send with clean subject (no prefix); journal it right away if in actual mode
+            result = send_email(recipient_email, email_subject, email_body, attachment_path)
+            if test_mode:
+                continue
+            if result:
+                record_sent(company)
+                registry.mark_sent(company.id)
+                companies_sent += 1
+            else:
+                dead_letter(company, result)
+
+        # Display summary
+        if test_mode:
             print(f"✅ All test emails sent to {test_email}!")
             print("ℹ️ Note: No companies were marked as 'sent' since this was a test.")
-            
-        elif send_option == "2":
-            # Continue with the normal sending process
-            # Ask if test mode or actual mode
-            test_option = input("1. Test mode (send to test inbox)\n2. Actual mode (send to companies)\nEnter your choice (1 or 2): ")
-            
-            template_en = Template(email_template_en)
-            template_fr = Template(email_template_fr)
-            attachment_path = MY_RESUME_PATH
-            
-            # Test mode will send all emails to the test inbox
-            test_mode = test_option == "1"
-            test_email = TEST_EMAIL
-            
-            # Keep track of sent companies and skipped companies
-            companies_sent = []
-            companies_skipped = []
-            
-            for company in companies:
-                company_name = company["name"]
-                
-                # Skip companies that have already been sent emails (only in actual mode)
-                if not test_mode and company.get("is_sent", False):
-                    print(f"⏭️ Skipping {company_name} - Email already sent previously")
-                    companies_skipped.append(company_name)
-                    continue
-                
-                # Use the already generated email if available
-                if company_name in generated_emails:
-                    email_body = generated_emails[company_name]["body"]
-                    email_subject = generated_emails[company_name]["subject"]
-                else:
-                    # This should not happen, but just in case
-                    contact_person = company["contact_person"]
-                    city = company.get("city", None)
-                    language = company.get("language", "English")
-                    
-                    print(f"Re-generating email for {company_name}...")
-                    email_subject, email_body = generate_ai_email(
-                        gemini_api_key, 
-                        company_name, 
-                        contact_person, 
-                        city, 
-                        language
-                    )
-                    
-                    # Fall back to templates if AI generation fails
-                    if not email_body:
-                        print(f"⚠️ AI email generation failed for {company_name}, using template instead.")
-                        if language == "French":
-                            email_body = template_fr.render(name=company_name, contact_person=contact_person)
-                        else:
-                            email_body = template_en.render(name=company_name, contact_person=contact_person)
-                        email_subject = f"Internship Application - {company_name}"
-                
-                # If in test mode, send to test email, otherwise send to actual company email
-                recipient_email = test_email if test_mode else company["email"]
-                
-                # For logging purposes only
-                if test_mode:
-                    print(f"Sending test email about {company_name}...")
-                else:
-                    print(f"Sending actual email to {company_name}...")
-                
-                # Send with clean subject (no prefix)
-                send_email(recipient_email, email_subject, email_body, attachment_path)
-                
-                # Add to sent list if in actual mode
-                if not test_mode:
-                    companies_sent.append(company_name)
-                    
-                time.sleep(5)  # Delay to avoid spam detection
-            
-            # Display summary
-            if test_mode:
-                print(f"✅ All test emails sent to {test_email}!")
-                print("ℹ️ Note: No companies were marked as 'sent' since this was a test.")
+        else:
+            # Update the companies.json file with sent status
+            if companies_sent:
+                update_companies_sent_status()
+                print(f"✅ Sent emails to {companies_sent} companies!")
+
+            if companies_skipped:
+                print(f"ℹ️ Skipped {companies_skipped} companies that were already sent emails.")
+
+    else:
+        print("📪 No emails sent. Exiting...")
+        print(f"ℹ️ The drafts are saved in {outbox.path}/; run 'python internship.py deliver' to send them later.")
+
+def run_prepare(args):
+    """Render every pending email and save it to the outbox, without sending anything."""
+    use_ai = args.use_ai if args.use_ai is not None else ask_use_ai()
+
+    setup_profile()
+    setup_sender()
+    if use_ai:
+        setup_gemini(args)
+        setup_research(args)
+    setup_companies(args)
+    setup_recipients(args)
+
+    outbox = Outbox(args.outbox)
+    if args.rebuild:
+        outbox.clear()
+    prepared = outbox.content_hashes()
+
+    companies_prepared = 0
+    companies_skipped = 0
+
+    def pending_companies():
+        """Stream the companies that still need an email."""
+        nonlocal companies_skipped
+        for company in companies:
+            if already_sent(company):
+                print(f"⏭️ Skipping {company.name} - Email already sent previously")
+            elif company in dead_letters:
+                print(f"⏭️ Skipping {company.name} - Address was rejected permanently before")
             else:
-                # Update the companies.json file with sent status
-                if companies_sent:
-                    update_companies_sent_status(companies_sent)
-                    print(f"✅ Sent emails to {len(companies_sent)} companies!")
-                
-                if companies_skipped:
-                    print(f"ℹ️ Skipped {len(companies_skipped)} companies that were already sent emails.")
-                
+                yield company
+                continue
+            companies_skipped += 1
+
+    def unprepared(companies):
+        """Stream the companies without an up-to-date email in the outbox."""
+        nonlocal companies_skipped
+        for company in companies:
+            if company.id in prepared:
+                if prepared[company.id] in (None, company.content_hash()):
+                    print(f"⏭️ Skipping {company.name} - Email already prepared")
+                    companies_skipped += 1
+                    continue
+                print(f"ℹ️ {company.name} changed since its email was prepared, preparing it again...")
+            yield company
+
+    # Prepared companies still pass the recipient filter, so their inboxes count as listed and toward domain caps
+    pending = unprepared(screen_recipients(pending_companies()))
+    for company, email_subject, email_body in draft_emails(use_ai, pending):
+        try:
+            entry = save_to_outbox(outbox, company, email_subject, email_body)
+        except Exception as e:
+            print(f"❌ Failed to prepare email for {company.name}: {e}")
+            continue
+        print(f"📝 Prepared {entry.file} for {company.name}: '{email_subject}'")
+        companies_prepared += 1
+
+    print(f"✅ Prepared {companies_prepared} emails in {outbox.path}/")
+    if companies_skipped:
+        print(f"ℹ️ Skipped {companies_skipped} companies.")
+    if companies_prepared:
+        print("ℹ️ Review them, then run 'python internship.py deliver' to send them.")
+
+def run_deliver(args):
+    """Send the emails prepared in the outbox, exactly as they were rendered."""
+    test_mode = args.test_mode if args.test_mode is not None else ask_test_mode()
+
+    setup_sending()
+    setup_companies(args)
+    setup_recipients(args, test_mode)
+
+    outbox = Outbox(args.outbox)
+    # Content hash of every listed company, to catch emails prepared from since-changed or removed records
+    current = {}
+    sent_ids = set()
+    for company in companies:
+        # The first record for an inbox wins, as in CompanyRegistry and prepare
+        current.setdefault(company.id, company.content_hash())
+        if company.is_sent and not test_mode:
+            sent_ids.add(company.id)
+
+    companies_sent = 0
+    companies_skipped = 0
+
+    def pending_entries():
+        """Stream the prepared emails whose company still needs one."""
+        nonlocal companies_skipped
+        for entry in outbox:
+            if entry.id not in current:
+                print(f"⏭️ Skipping {entry.name} - No longer listed in {companies.path}")
+                companies_skipped += 1
+                continue
+            if entry.content_hash not in (None, current[entry.id]):
+                print(f"⏭️ Skipping {entry.name} - Company details changed after the email was prepared; run prepare again")
+                companies_skipped += 1
+                continue
+            # Skip companies that have already been sent emails (only in actual mode)
+            if not test_mode and (entry.id in sent_ids or entry in send_journal):
+                print(f"⏭️ Skipping {entry.name} - Email already sent previously")
+                companies_skipped += 1
+                continue
+            if not test_mode and entry in dead_letters:
+                print(f"⏭️ Skipping {entry.name} - Address was rejected permanently before")
+                companies_skipped += 1
+                continue
+            yield entry
+
+    # Inboxes contacted by another campaign since the outbox was prepared are caught here
+    for entry in screen_recipients(pending_entries()):
+        try:
+            message = outbox.read(entry)
+            if entry.attachment:
+                message = add_attachment(message, entry.attachment)
+        except (OSError, ValueError) as e:
+            print(f"❌ Not sending {entry.file} for {entry.name}: {e}")
+            companies_skipped += 1
+            continue
+
+        # If in test mode, send to test email, otherwise send to actual company email
+        recipient_email = TEST_EMAIL if test_mode else entry.email
+        result = report_send_result(
+            deliver(smtp_pool, SENDER_EMAIL, recipient_email, message, send_scheduler, send_retry_policy)
+        )
+        if test_mode:
+            continue
+        if result:
+            record_sent(entry)
+            companies_sent += 1
         else:
-            print("📪 No emails sent. Exiting...")
+            dead_letter(entry, result)
+
+    # Display summary
+    if test_mode:
+        print(f"✅ All test emails sent to {TEST_EMAIL}!")
+        print("ℹ️ Note: No companies were marked as 'sent' since this was a test.")
     else:
-        print("No valid emails were generated. Exiting...")
+        if companies_sent:
+            update_companies_sent_status()
+            print(f"✅ Sent emails to {companies_sent} companies!")
+
+    if companies_skipped:
+        print(f"ℹ️ Skipped {companies_skipped} prepared emails.")
+
+def run_import(args):
+    """Merge a refreshed company list into the companies file, keeping send history for companies already listed.
+
+    Unchanged companies keep their prepared emails and research; only new and changed ones need new content.
+    """
+    if os.path.abspath(args.file) == os.path.abspath(args.companies):
+        print(f"❌ {args.file} is already the companies file; pass the refreshed list to import into it.")
+        return
+    incoming = check_companies_file(args.file)
+    current = ()
+    if os.path.exists(args.companies):
+        # Folds sends journaled by an interrupted run into is_sent first, so they carry over
+        setup_companies(args)
+        current = companies
+
+    counts = {"new": 0, "changed": 0, "unchanged": 0, "duplicate": 0, "removed": 0, "kept": 0, "stale": 0}
+
+    def merged():
+        for status, company, fields in diff_companies(current, incoming):
+            counts[status] += 1
+            metrics.increment(f"import.{status}")
+            if status in ("new", "changed"):
+                if status == "new":
+                    print(f"➕ New: {company.name}")
+                else:
+                    print(f"✏️ Changed: {company.name} ({', '.join(fields)})")
+                # Companies already emailed never get a new email
+                if not company.is_sent:
+                    counts["stale"] += 1
+            elif status == "duplicate":
+                print(f"⏭️ Skipping {company.name} - Same inbox listed more than once ({company.email})")
+                continue
+            elif status == "removed":
+                if not company.is_sent:
+                    print(f"➖ Removed: {company.name}")
+                    continue
+                # Kept so the company isn't emailed again if it comes back in a later list
+                counts["kept"] += 1
+            yield company.to_dict()
+
+    try:
+        if args.dry_run:
+            for _ in merged():
+                pass
+        else:
+            write_companies(args.companies, merged())
+    except ValueError as e:
+        print(f"❌ ERROR: '{args.file}' contains an invalid company record: {e}")
+        return
+
+    print(f"{'ℹ️ Dry run:' if args.dry_run else '✅'} {counts['new']} new, {counts['changed']} changed, "
+          f"{counts['unchanged']} unchanged and {counts['removed']} removed companies"
+          + (f" ({counts['kept']} kept because they were already emailed)" if counts["kept"] else "")
+          + ("" if args.dry_run else f"; {args.companies} updated"))
+    if counts["stale"]:
+        print(f"ℹ️ Only the {counts['stale']} new or changed companies not emailed yet need new emails: "
+              "'prepare', 'research' and 'preview' reuse what was generated for the others.")
+
+def run_bench(args):
+    """Run the offline benchmarks in bench.py."""
+    import bench
+    bench.main(args.bench_args)
+
+def add_test_mode_flags(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--test", dest="test_mode", action="store_true", default=None,
+                       help="Send every email to TEST_EMAIL instead of the companies")
+    group.add_argument("--actual", dest="test_mode", action="store_false",
+                       help="Send emails to the companies and mark them as sent")
+
+def add_test_output_flags(parser):
+    parser.add_argument("--test-output", choices=TEST_OUTPUTS, default=os.getenv("TEST_OUTPUT") or "smtp",
+                        help="Where test emails go: one SMTP send each to TEST_EMAIL (default), a local mbox file "
+                             "or Maildir, or a single digest email with the resume attached once")
+    parser.add_argument("--test-path", default=os.getenv("TEST_OUTPUT_PATH"),
+                        help="mbox file or Maildir directory for --test-output (default previews.mbox / previews)")
+    parser.add_argument("--html-index", default=None,
+                        help="Also write an HTML page of every test email to this file (not with --test-output smtp)")
+
+def add_content_flags(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--ai", dest="use_ai", action="store_true", default=None,
+                       help="Personalize each email with Gemini")
+    group.add_argument("--template", dest="use_ai", action="store_false",
+                       help="Use the standard templates")
+    add_research_flag(parser)
+
+def add_research_flag(parser):
+    parser.add_argument("--use-research", action="store_true",
+                        default=os.getenv("USE_RESEARCH", "").lower() in ("1", "true", "yes"),
+                        help="Ground AI emails in the research report, researching companies missing from it first")
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Send internship application emails to companies. Run without a command for the interactive menu."
+    )
+    parser.add_argument("--companies", default="companies.json",
+                        help="Companies file: a JSON array or a .jsonl file with one company per line")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write cached Gemini responses")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached Gemini responses and store fresh ones")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Generate AI emails for up to N same-language companies per Gemini request")
+    parser.add_argument("--metrics-log", default=os.getenv("METRICS_LOG"),
+                        help="Append this run's stage timings and counters to a JSON Lines file")
+    parser.add_argument("--prometheus", default=os.getenv("METRICS_PROMETHEUS_FILE"),
+                        help="Write this run's metrics to a file in the Prometheus text format")
+    parser.add_argument("--outbox", default=os.getenv("OUTBOX_DIR") or "outbox",
+                        help="Directory of prepared emails used by prepare, deliver and preview")
+    parser.add_argument("--report", default=os.getenv("RESEARCH_REPORT") or os.path.join(
+                            os.path.dirname(os.path.abspath(__file__)), "company_information.md"),
+                        help="Research report written by research and read by --use-research")
+    parser.add_argument("--contacts", default=os.getenv("CONTACTS_INDEX") or os.path.join(
+                            os.path.dirname(os.path.abspath(__file__)), "contacts.jsonl"),
+                        help="Hashed index of every inbox emailed, shared by all companies files")
+    parser.add_argument("--max-per-domain", type=int, default=None,
+                        help="Email at most N inboxes per domain, counting earlier campaigns (default MAX_PER_DOMAIN)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    send = subparsers.add_parser("send", help="Send emails to companies")
+    add_content_flags(send)
+    add_test_mode_flags(send)
+    send.add_argument("--workers", type=int, default=None,
+                      help="Deliver from N worker processes, sharded by recipient domain (default SEND_WORKERS or 1)")
+    send.add_argument("--concurrency", type=int, default=None,
+                      help="Keep up to N sends in flight over asyncio SMTP sessions (default SEND_CONCURRENCY or 1)")
+    add_test_output_flags(send)
+    send.set_defaults(func=run_send)
+
+    research = subparsers.add_parser("research", help="Fetch company information using Google Gemini AI")
+    save = research.add_mutually_exclusive_group()
+    save.add_argument("--save", dest="save", action="store_true", default=None,
+                      help="Save the information to the report as each company is fetched")
+    save.add_argument("--no-save", dest="save", action="store_false", help="Only print the information")
+    research.add_argument("--no-index", action="store_true",
+                          help="Don't keep the company-indexed JSON Lines copy of the report next to it")
+    research.set_defaults(func=run_research)
+
+    preview = subparsers.add_parser("preview", help="Preview AI-generated emails, then optionally send them")
+    preview.add_argument("--then", choices=["test", "send", "exit"],
+                         help="After previewing: send all to TEST_EMAIL, continue with normal sending, or exit")
+    add_test_mode_flags(preview)
+    add_research_flag(preview)
+    add_test_output_flags(preview)
+    preview.set_defaults(func=run_preview)
+
+    prepare = subparsers.add_parser("prepare", help="Render every pending email into the outbox without sending")
+    add_content_flags(prepare)
+    prepare.add_argument("--rebuild", action="store_true", help="Discard the emails already in the outbox first")
+    prepare.set_defaults(func=run_prepare)
+
+    deliver_parser = subparsers.add_parser("deliver", help="Send the emails prepared in the outbox")
+    add_test_mode_flags(deliver_parser)
+    deliver_parser.set_defaults(func=run_deliver)
+
+    import_parser = subparsers.add_parser(
+        "import", help="Merge a refreshed companies list, keeping send history and emails of unchanged companies"
+    )
+    import_parser.add_argument("file", help="The refreshed list (JSON array or .jsonl) to merge into --companies")
+    import_parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    import_parser.set_defaults(func=run_import)
+
+    bench = subparsers.add_parser("bench", help="Run offline benchmarks (see bench.py --help)", add_help=False)
+    bench.add_argument("bench_args", nargs=argparse.REMAINDER)
+    bench.set_defaults(func=run_bench)
+
+    return parser
+
+def main(argv=None):
+    # Load environment variables from .env file (some option defaults come from it)
+    load_dotenv()
+
+    parser = build_parser()
+    # Options after "bench" belong to bench.py, even ones argparse would take for its own (like --help)
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "bench":
+        args.bench_args = extra + args.bench_args
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if getattr(args, "html_index", None) and args.test_output == "smtp":
+        parser.error("--html-index needs --test-output mbox, maildir or digest")
+
+    if args.command is None:
+        # Menu for user to choose action
+        print("Please choose an option:")
+        print("1. Send emails to companies")
+        print("2. Fetch company information using Google Gemini AI")
+        print("3. Test AI email generation (no emails sent)")
+        option = input("Enter your choice (1, 2 or 3): ")
+        commands = {"1": "send", "2": "research", "3": "preview"}
+        if option not in commands:
+            print("❌ Invalid option. Please choose 1, 2, or 3.")
+            return
+        args = parser.parse_args((argv if argv is not None else sys.argv[1:]) + [commands[option]])
+
+    try:
+        args.func(args)
+    finally:
+        shutdown()
+        if args.command != "bench":
+            report_metrics(args)
 
-else:
-    print("❌ Invalid option. Please choose 1, 2, or 3.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import json
+import os
+import time
+
+from companies import company_key, rewrite_companies
+
+
+class SendJournal:
+    """Append-only record of successful sends, written as each email goes out.
+
+    Every entry is flushed to the OS immediately and fsynced in batches of
+    ``fsync_every`` entries or every ``fsync_interval`` seconds, so a crash or
+    Ctrl-C loses at most the last unsynced batch to a power failure and
+    nothing to a killed process. On startup the journal is replayed into a
+    set for O(1) "already sent?" checks; :meth:`compact` folds it back into
+    the companies file as ``is_sent`` flags and empties it.
+    """
+
+    def __init__(self, path, fsync_every=20, fsync_interval=2.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._sent = set()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        torn = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        self._sent.add(json.loads(line)["key"])
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line from a crash mid-write
+                        continue
+                    finally:
+                        torn = not line.endswith("\n")
+        self._file = open(path, "a", encoding="utf-8")
+        if torn:
+            # Start new entries on their own line
+            self._file.write("\n")
+
+    def __contains__(self, company):
+        return company.id in self._sent
+
+    def __len__(self):
+        return len(self._sent)
+
+    def record(self, company):
+        """Durably note that ``company`` has been emailed."""
+        self._sent.add(company.id)
+        self._file.write(json.dumps({"key": company.id, "name": company.name, "sent_at": time.time()}) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def compact(self, companies_path):
+        """Mark every journaled company as sent in ``companies_path``, then empty the journal."""
+        if not self._sent:
+            return 0
+        self.sync()
+        marked = 0
+
+        def mark_sent(company):
+            nonlocal marked
+            if not company.get("is_sent", False) and company_key(company) in self._sent:
+                company["is_sent"] = True
+                marked += 1
+            return company
+
+        rewrite_companies(companies_path, mark_sent)
+        # Only truncate once the companies file has been safely replaced
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return marked
+
+    def close(self):
+        self.sync()
+        self._file.close()
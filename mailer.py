@@ -0,0 +1,335 @@
+import io
+import os
+import threading
+import time
+from functools import lru_cache
+
+from metrics import metrics
+from retry import TRANSIENT, RetryPolicy, classify_smtp_error
+
+# smtplib and the email package are imported where they are first needed, so
+# importing this module costs nothing until a message is actually built or sent.
+
+
+def _breaks_session(error):
+    """True for errors after which an SMTP session can't be reused (SMTPException is an OSError).
+
+    Reply errors and refused recipients leave it usable: the session has
+    already been reset with RSET before they are raised.
+    """
+    import smtplib
+
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(
+        error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)
+    )
+
+
+def smtp_error_code(error):
+    """The SMTP reply code carried by a send error, or None if there isn't one."""
+    import smtplib
+
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return None
+
+
+class SendResult:
+    """Outcome of delivering one message. True when the relay accepted it.
+
+    ``permanent`` failures won't succeed on retry; ``rejected`` ones are
+    permanent failures of this recipient in particular (e.g. 550 no such
+    mailbox), as opposed to the relay refusing everything (e.g. bad login).
+    """
+
+    __slots__ = ("recipient", "ok", "attempts", "error", "code", "permanent", "rejected")
+
+    def __init__(self, recipient, ok, attempts=1, error=None, code=None, permanent=False, rejected=False):
+        self.recipient = recipient
+        self.ok = ok
+        self.attempts = attempts
+        self.error = error
+        self.code = code
+        self.permanent = permanent
+        self.rejected = rejected
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        if self.ok:
+            return f"SendResult({self.recipient!r}, ok, attempts={self.attempts})"
+        return f"SendResult({self.recipient!r}, failed, code={self.code}, error={self.error!r})"
+
+
+def _is_recipient_rejection(error, code):
+    """True for a permanent refusal at RCPT TO; a 5xx at DATA rejects the message, not the recipient."""
+    import smtplib
+
+    return isinstance(error, smtplib.SMTPRecipientsRefused) and code is not None and code >= 500
+
+
+class _PooledConnection:
+    """An open SMTP session plus the bookkeeping the pool needs to recycle it."""
+
+    def __init__(self, server):
+        self.server = server
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPPool:
+    """Keeps authenticated SMTP sessions open and reuses them across sends.
+
+    Every send used to pay for TCP connect + STARTTLS + AUTH. The pool opens
+    at most ``size`` sessions lazily, checks idle ones with NOOP before
+    reusing them, reconnects when the server drops the connection and
+    recycles a session after ``max_messages_per_connection`` messages.
+    """
+
+    def __init__(self, host, port, username=None, password=None, size=1,
+                 max_messages_per_connection=100, keepalive_interval=30,
+                 timeout=30, starttls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages_per_connection = max_messages_per_connection
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+        self.starttls = starttls
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+        self.stats = {"connections_opened": 0, "reconnects": 0, "messages_sent": 0}
+
+    def _connect(self):
+        import smtplib
+
+        with metrics.time("smtp.connect"):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            with metrics.time("smtp.auth"):
+                if self.starttls:
+                    server.starttls()
+                if self.username:
+                    server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        with self._lock:
+            self.stats["connections_opened"] += 1
+        return _PooledConnection(server)
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.server.quit()
+        except Exception:
+            conn.server.close()
+
+    def _is_alive(self, conn):
+        """NOOP a session that has been idle longer than the keepalive interval."""
+        if time.monotonic() - conn.last_used < self.keepalive_interval:
+            return True
+        try:
+            return conn.server.noop()[0] == 250
+        except OSError:
+            return False
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if self._closed:
+                        raise RuntimeError("SMTP pool is closed")
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if self._is_alive(conn):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn):
+        try:
+            conn.last_used = time.monotonic()
+            if conn.messages_sent >= self.max_messages_per_connection:
+                self._discard(conn)
+                return
+            with self._lock:
+                if not self._closed:
+                    self._idle.append(conn)
+                    return
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def send(self, from_addr, to_addrs, message):
+        """Send one message on a pooled session, reconnecting once if the server hung up."""
+        import smtplib
+
+        conn = self._acquire()
+        try:
+            try:
+                with metrics.time("smtp.send"):
+                    conn.server.sendmail(from_addr, to_addrs, message)
+            except smtplib.SMTPServerDisconnected:
+                conn.server.close()
+                conn = None
+                conn = self._connect()
+                with self._lock:
+                    self.stats["reconnects"] += 1
+                metrics.increment("smtp.reconnects")
+                with metrics.time("smtp.send"):
+                    conn.server.sendmail(from_addr, to_addrs, message)
+        except Exception as e:
+            if conn is None or _breaks_session(e):
+                # The session is unusable; don't hand it back to the pool.
+                if conn is not None:
+                    conn.server.close()
+                self._slots.release()
+            else:
+                # Refused recipients and the like leave the session usable.
+                self._release(conn)
+            raise
+
+        conn.messages_sent += 1
+        with self._lock:
+            self.stats["messages_sent"] += 1
+        self._release(conn)
+
+    def close(self):
+        """Close every idle session. Safe to call more than once."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@lru_cache(maxsize=None)
+def _smtp_policy():
+    """The compat32 policy the MIME classes use, but with SMTP's CRLF line endings."""
+    from email import policy
+
+    return policy.compat32.clone(linesep="\r\n")
+
+# Serialized attachment parts, keyed by path and validated against (mtime, size)
+_attachment_cache = {}
+_attachment_cache_lock = threading.Lock()
+
+
+def _to_bytes(part):
+    """Serialize a MIME object with CRLF line endings, ready for SMTP DATA."""
+    from email.generator import BytesGenerator
+
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=_smtp_policy()).flatten(part)
+    return buffer.getvalue()
+
+
+def get_attachment_part(path):
+    """Return the base64-encoded MIME part for ``path``, encoding it only when the file changed."""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _attachment_cache_lock:
+        cached = _attachment_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    from email import encoders
+    from email.mime.base import MIMEBase
+
+    with open(path, "rb") as attachment:
+        part = MIMEBase("application", "octet-stream")
+        part.set_payload(attachment.read())
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", "attachment", filename=os.path.basename(path))
+    part_bytes = _to_bytes(part)
+
+    with _attachment_cache_lock:
+        _attachment_cache[path] = (key, part_bytes)
+    return part_bytes
+
+
+def add_attachment(message_bytes, attachment_path):
+    """Add the cached attachment part for ``attachment_path`` as the last part of a built multipart message."""
+    # The generator ends a multipart with "--boundary--\r\n"; cut there,
+    # append the cached attachment as a new part and close it again.
+    head, _, closing = message_bytes.rstrip(b"\r\n").rpartition(b"\r\n")
+    delimiter = closing[:-2]
+    return b"".join((
+        head, b"\r\n",
+        delimiter, b"\r\n",
+        get_attachment_part(attachment_path),
+        b"\r\n", closing, b"\r\n",
+    ))
+
+
+def build_message(from_addr, to_addr, subject, body, attachment_path=None):
+    """Build a complete RFC 5322 message as bytes.
+
+    Only the headers and the text part are generated per recipient; the
+    attachment bytes come from :func:`get_attachment_part` and are spliced
+    in before the closing boundary.
+    """
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    with metrics.time("mime.build"):
+        msg = MIMEMultipart()
+        msg["From"] = from_addr
+        msg["To"] = to_addr
+        msg["Subject"] = subject
+        msg.attach(MIMEText(body, "plain"))
+        message_bytes = _to_bytes(msg)
+        if not attachment_path:
+            return message_bytes
+        return add_attachment(message_bytes, attachment_path)
+
+
+def deliver(pool, from_addr, to_addr, message, scheduler=None, retry_policy=None):
+    """Send a built message over ``pool``, retrying transient failures; returns a :class:`SendResult`.
+
+    Each attempt waits for the ``scheduler``'s next slot and reports the
+    outcome to it, so throttling replies also slow down later sends.
+    """
+    policy = retry_policy or RetryPolicy(attempts=1)
+    domain = to_addr.rpartition("@")[2].lower()
+    attempt = 1
+    while True:
+        if scheduler:
+            scheduler.wait(domain)
+        try:
+            pool.send(from_addr, to_addr, message)
+        except Exception as e:
+            code = smtp_error_code(e)
+            if scheduler:
+                scheduler.record_failure(code)
+            transient = classify_smtp_error(e) == TRANSIENT
+            if transient and attempt < policy.attempts:
+                metrics.increment("smtp.retries")
+                time.sleep(policy.delay(attempt))
+                attempt += 1
+                continue
+            return SendResult(to_addr, False, attempt, str(e) or type(e).__name__, code,
+                              permanent=not transient, rejected=_is_recipient_rejection(e, code))
+        if scheduler:
+            scheduler.record_success()
+        return SendResult(to_addr, True, attempt)
@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency buckets, from MIME builds (~ms) to throttled waits (minutes)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Stages recorded by the instrumented modules:
+#   gemini.body / gemini.subject / gemini.batch / gemini.research  one Gemini request
+#   gemini.rate_limit_wait  waiting for the shared Gemini rate limiter
+#   gemini.postprocess      cleaning a generated subject and body
+#   mime.build              building a MIME message
+#   smtp.connect / smtp.auth / smtp.send  TCP connect, STARTTLS + login, one message on an open session
+#   send.wait               waiting for the send scheduler (quotas, domain spacing, throttling backoff)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as Prometheus exposes it."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate the q-quantile by interpolating inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": self.counts, "count": self.count,
+                "sum": self.sum, "max": self.max}
+
+    def merge(self, data):
+        for index, count in enumerate(data["counts"]):
+            self.counts[index] += count
+        self.count += data["count"]
+        self.sum += data["sum"]
+        self.max = max(self.max, data["max"])
+
+
+class Metrics:
+    """Per-stage latency histograms and event counters for one run. Thread-safe."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """Time the ``with`` block as one observation of ``stage`` (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def __bool__(self):
+        return bool(self.histograms or self.counters)
+
+    def snapshot(self):
+        """Plain-data copy, e.g. to send from a worker process back to the coordinator."""
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "histograms": {stage: h.to_dict() for stage, h in self.histograms.items()}}
+
+    def merge(self, snapshot):
+        """Add another process's :meth:`snapshot` into this one."""
+        with self._lock:
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for stage, data in snapshot["histograms"].items():
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = Histogram(tuple(data["buckets"]))
+                histogram.merge(data)
+
+    def write_jsonl(self, path, **run_info):
+        """Append this run (timings, counters and ``run_info``) as one line of a JSON Lines log."""
+        record = {"started": self.started, "finished": time.time(), **run_info}
+        record.update(self.snapshot())
+        for stage, data in record["histograms"].items():
+            histogram = self.histograms[stage]
+            data["p50"] = histogram.quantile(0.5)
+            data["p99"] = histogram.quantile(0.99)
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+    def to_prometheus(self, prefix="internship"):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{prefix}_{name.replace('.', '_')}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            if self.histograms:
+                metric = f"{prefix}_stage_duration_seconds"
+                lines.append(f"# HELP {metric} Duration of each stage of a campaign run")
+                lines.append(f"# TYPE {metric} histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(self.to_prometheus())
+
+    def summary_table(self):
+        """Per-stage count, total and latency percentiles, followed by the counters."""
+        lines = [f"{'stage':<24} {'count':>7} {'total s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        with self._lock:
+            for stage, h in sorted(self.histograms.items(), key=lambda item: -item[1].sum):
+                lines.append(f"{stage:<24} {h.count:>7} {h.sum:>9.2f} {h.quantile(0.5) * 1000:>9.1f} "
+                             f"{h.quantile(0.99) * 1000:>9.1f} {h.max * 1000:>9.1f}")
+            if self.counters:
+                lines.append("")
+                lines.extend(f"{name:<24} {value:>7}" for name, value in sorted(self.counters.items()))
+        return "\n".join(lines)
+
+
+# Process-wide metrics, filled in by the instrumented modules
+metrics = Metrics()
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+INDEX_NAME = "index.jsonl"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OutboxEntry:
+    """One prepared message, as listed in the outbox index.
+
+    Has the ``id`` and ``name`` of its company, so it can be recorded in the
+    send journal and dead-letter file like a :class:`~companies.Company`.
+    """
+
+    __slots__ = ("id", "name", "email", "subject", "file", "sha256", "size", "attachment", "attachment_sha256",
+                 "prepared_at", "content_hash")
+
+    def __init__(self, id, name, email, subject, file, sha256, size, attachment=None, attachment_sha256=None,
+                 prepared_at=None, content_hash=None):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.subject = subject
+        self.file = file
+        self.sha256 = sha256
+        self.size = size
+        self.attachment = attachment
+        self.attachment_sha256 = attachment_sha256
+        self.prepared_at = prepared_at
+        # Company.content_hash() of the record the message was written from (None for older outboxes)
+        self.content_hash = content_hash
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"OutboxEntry({self.name!r}, {self.file!r})"
+
+
+class Outbox:
+    """A directory of prepared messages, ready for delivery.
+
+    Each message is an RFC 5322 ``.eml`` file with everything but the
+    attachment, which would make every file megabytes of base64. The
+    attachment is recorded by path and SHA-256 in ``index.jsonl``, one JSON
+    line per message, and spliced in at delivery. The index also holds each
+    message's SHA-256, so a file edited after preparation is detected. The
+    files are plain text and meant to be read and diffed before a real run.
+
+    Adding a company that is already in the outbox replaces its message.
+    Iterating yields the latest entry per company in index order, reading
+    the index line by line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, INDEX_NAME)
+        os.makedirs(path, exist_ok=True)
+        self._attachment_hashes = {}
+
+    @staticmethod
+    def file_name(company_id):
+        """Readable, collision-free file name for a company's message."""
+        safe = re.sub(r"[^A-Za-z0-9._@-]+", "_", company_id)[:80]
+        return f"{safe}-{hashlib.sha256(company_id.encode('utf-8')).hexdigest()[:8]}.eml"
+
+    def _attachment_sha256(self, path):
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._attachment_hashes.get(path)
+        if cached is None or cached[0] != key:
+            cached = self._attachment_hashes[path] = (key, file_sha256(path))
+        return cached[1]
+
+    def add(self, company, subject, message_bytes, attachment_path=None):
+        """Store a built message (without its attachment) for ``company`` and index it."""
+        file = self.file_name(company.id)
+        temp_path = os.path.join(self.path, file + ".tmp")
+        with open(temp_path, "wb") as handle:
+            handle.write(message_bytes)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, os.path.join(self.path, file))
+
+        entry = OutboxEntry(
+            company.id, company.name, company.email, subject, file,
+            hashlib.sha256(message_bytes).hexdigest(), len(message_bytes),
+            os.path.abspath(attachment_path) if attachment_path else None,
+            self._attachment_sha256(attachment_path) if attachment_path else None,
+            time.time(),
+            company.content_hash(),
+        )
+        with open(self.index_path, "a", encoding="utf-8") as index:
+            index.write(json.dumps(entry.to_dict()) + "\n")
+        return entry
+
+    def _lines(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as index:
+            for line in index:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A torn last line from an interrupted prepare
+                    continue
+
+    def __iter__(self):
+        # First pass: which line is the latest for each company; second pass: yield those lines
+        latest = {}
+        for number, data in enumerate(self._lines()):
+            latest[data["id"]] = number
+        for number, data in enumerate(self._lines()):
+            if latest.get(data["id"]) == number:
+                yield OutboxEntry(**data)
+
+    def content_hashes(self):
+        """Map company id -> content hash of the record its latest message was prepared from."""
+        return {data["id"]: data.get("content_hash") for data in self._lines()}
+
+    def read(self, entry):
+        """The prepared message bytes for ``entry``; raises ValueError if the file changed since it was prepared."""
+        with open(os.path.join(self.path, entry.file), "rb") as handle:
+            message_bytes = handle.read()
+        if hashlib.sha256(message_bytes).hexdigest() != entry.sha256:
+            raise ValueError(f"{entry.file} was modified after it was prepared")
+        if entry.attachment and self._attachment_sha256(entry.attachment) != entry.attachment_sha256:
+            raise ValueError(f"{entry.attachment} changed after {entry.file} was prepared")
+        return message_bytes
+
+    def clear(self):
+        """Remove every prepared message and the index."""
+        for name in os.listdir(self.path):
+            if name.endswith((".eml", ".eml.tmp")) or name == INDEX_NAME:
+                os.remove(os.path.join(self.path, name))
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts of up to ``capacity``."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute, capacity=1):
+        return cls(requests_per_minute / 60.0, capacity)
+
+    def _take(self):
+        """Take a token if one is available; otherwise return the seconds until one will be."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while wait := self._take():
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Like :meth:`acquire`, but waits without blocking the event loop."""
+        import asyncio
+
+        while wait := self._take():
+            await asyncio.sleep(wait)
+
+
+def generate_emails(companies, generate, concurrency=4):
+    """Run ``generate(company)`` for many companies at once and yield ``(company, result)``.
+
+    Results come back in input order as soon as the head of the queue is
+    ready, so a send loop can start on the first company while later ones
+    are still being generated. ``companies`` is consumed lazily; at most
+    ``2 * concurrency`` companies are in flight or buffered at a time.
+    """
+    companies = iter(companies)
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for company in companies:
+            in_flight.append((company, executor.submit(generate, company)))
+            if len(in_flight) >= 2 * concurrency:
+                break
+        while in_flight:
+            company, future = in_flight.popleft()
+            result = future.result()
+            next_company = next(companies, None)
+            if next_company is not None:
+                in_flight.append((next_company, executor.submit(generate, next_company)))
+            yield company, result
+
+
+async def generate_emails_async(companies, generate, concurrency=4):
+    """Async counterpart of :func:`generate_emails`: ``generate`` is a coroutine function.
+
+    Yields ``(company, result)`` in input order, with at most ``2 * concurrency``
+    companies in flight or buffered, all on the calling event loop.
+    """
+    import asyncio
+
+    companies = iter(companies)
+    in_flight = deque()
+    for company in companies:
+        in_flight.append((company, asyncio.ensure_future(generate(company))))
+        if len(in_flight) >= 2 * concurrency:
+            break
+    try:
+        while in_flight:
+            company, task = in_flight[0]
+            result = await task
+            in_flight.popleft()
+            next_company = next(companies, None)
+            if next_company is not None:
+                in_flight.append((next_company, asyncio.ensure_future(generate(next_company))))
+            yield company, result
+    finally:
+        # Stopped early: don't leave requests running behind the caller's back
+        for _, task in in_flight:
+            task.cancel()
+
+
+def batch_by_language(companies, batch_size):
+    """Group companies into lists of up to ``batch_size`` that share a ``language``."""
+    pending = {}
+    for company in companies:
+        language = company.language
+        batch = pending.setdefault(language, [])
+        batch.append(company)
+        if len(batch) >= batch_size:
+            yield language, pending.pop(language)
+    for language, batch in pending.items():
+        yield language, batch
+
+
+def generate_email_batches(companies, generate_batch, batch_size, concurrency=4):
+    """Like :func:`generate_emails`, but one ``generate_batch(language, batch)`` call covers a whole batch.
+
+    ``generate_batch`` returns results aligned with its batch. Companies are
+    yielded batch by batch, so the output is grouped by language rather than
+    in input order.
+    """
+    batches = batch_by_language(companies, batch_size)
+    for (language, batch), results in generate_emails(batches, lambda item: generate_batch(*item), concurrency):
+        yield from zip(batch, results)
@@ -0,0 +1,143 @@
+import html
+import mailbox
+import os
+import time
+
+from mailer import build_message
+
+# Where test-mode emails go: sent one by one to TEST_EMAIL, written locally, or sent as one digest
+TEST_OUTPUTS = ("smtp", "mbox", "maildir", "digest")
+
+# Marks the mailboxes written here: every mbox message carries the header, every Maildir the file
+PREVIEW_HEADER = "X-Internship-Preview"
+MAILDIR_MARKER = ".internship-previews"
+
+
+class PreviewMailbox:
+    """Test-mode emails written to a local mbox file or Maildir instead of being sent.
+
+    Each message is built exactly as it would be sent, minus the resume:
+    a header names the attachment instead of a base64 copy per message.
+    Any mail client can open the result. Each run replaces the previews of
+    the previous one, but never a mailbox this class didn't write: an
+    existing non-empty ``path`` without the preview marker raises ValueError.
+    """
+
+    def __init__(self, kind, path, from_addr, attachment_path=None):
+        self.kind = kind
+        self.path = path
+        self.from_addr = from_addr
+        self.attachment_path = attachment_path
+        self.count = 0
+        if not self._replaceable(kind, path):
+            raise ValueError(f"{path} already exists and wasn't written by a test run; "
+                             "choose another --test-path or remove it first")
+        if kind == "mbox":
+            if os.path.exists(path):
+                os.remove(path)
+            self._box = mailbox.mbox(path)
+            self._box.lock()
+        else:
+            # Maildir(create=True) only sets up a directory that doesn't exist yet, not an empty one
+            for subdir in ("tmp", "new", "cur"):
+                os.makedirs(os.path.join(path, subdir), exist_ok=True)
+            self._box = mailbox.Maildir(path, create=False)
+            self._box.clear()
+            open(os.path.join(path, MAILDIR_MARKER), "w").close()
+
+    @staticmethod
+    def _replaceable(kind, path):
+        """Whether ``path`` is missing, empty, or a mailbox of previews from an earlier run."""
+        if not os.path.exists(path):
+            return True
+        if kind == "maildir":
+            return os.path.isdir(path) and (not os.listdir(path) or os.path.exists(os.path.join(path, MAILDIR_MARKER)))
+        if not os.path.isfile(path):
+            return False
+        if os.path.getsize(path) == 0:
+            return True
+        box = mailbox.mbox(path, create=False)
+        try:
+            first = next(iter(box), None)
+        finally:
+            box.close()
+        return first is not None and first[PREVIEW_HEADER] is not None
+
+    def add(self, to_addr, subject, body):
+        message = build_message(self.from_addr, to_addr, subject, body)
+        headers = f"{PREVIEW_HEADER}: yes\r\n"
+        if self.attachment_path:
+            headers += f"X-Preview-Attachment: {os.path.basename(self.attachment_path)}\r\n"
+        self._box.add(headers.encode("utf-8") + message)
+        self.count += 1
+
+    def close(self):
+        self._box.flush()
+        if self.kind == "mbox":
+            self._box.unlock()
+        self._box.close()
+
+
+class PreviewDigest:
+    """Every test-mode email collected into the text of a single message, sent once with one copy of the resume."""
+
+    def __init__(self):
+        self._entries = []
+
+    @property
+    def count(self):
+        return len(self._entries)
+
+    def add(self, to_addr, subject, body):
+        self._entries.append((to_addr, subject, body))
+
+    def subject(self):
+        return f"[TEST] {self.count} email previews"
+
+    def text(self):
+        lines = [f"{self.count} emails, generated {time.strftime('%Y-%m-%d %H:%M')}.", ""]
+        lines += [f"{number:>4}. {to_addr} - {subject}" for number, (to_addr, subject, _) in enumerate(self._entries, 1)]
+        for number, (to_addr, subject, body) in enumerate(self._entries, 1):
+            lines += ["", "=" * 72, f"{number}. To: {to_addr}", f"Subject: {subject}", "-" * 72, body]
+        return "\n".join(lines) + "\n"
+
+
+class PreviewIndex:
+    """A standalone HTML page listing test-mode emails, with the resume linked once at the top."""
+
+    def __init__(self, path, attachment_path=None):
+        self.path = path
+        self.attachment_path = attachment_path
+        self._rows = []
+
+    def add(self, company, to_addr, subject, body):
+        self._rows.append((company.name, getattr(company, "language", None), to_addr, subject, body))
+
+    def write(self):
+        parts = [
+            "<!DOCTYPE html>",
+            '<html><head><meta charset="utf-8"><title>Email previews</title>',
+            "<style>body{font-family:sans-serif;max-width:60em;margin:auto}"
+            "pre{white-space:pre-wrap;background:#f6f6f6;padding:1em}"
+            "td,th{text-align:left;padding:0 1em 0 0}</style></head><body>",
+            f"<h1>{len(self._rows)} email previews</h1>",
+        ]
+        if self.attachment_path:
+            attachment = os.path.abspath(self.attachment_path)
+            parts.append(f'<p>Attached to every email: <a href="file://{html.escape(attachment)}">'
+                         f"{html.escape(os.path.basename(attachment))}</a></p>")
+        parts.append("<table><tr><th>#</th><th>Company</th><th>To</th><th>Subject</th></tr>")
+        for number, (name, _, to_addr, subject, _) in enumerate(self._rows, 1):
+            parts.append(f'<tr><td><a href="#email-{number}">{number}</a></td><td>{html.escape(name)}</td>'
+                         f"<td>{html.escape(to_addr)}</td><td>{html.escape(subject)}</td></tr>")
+        parts.append("</table>")
+        for number, (name, language, to_addr, subject, body) in enumerate(self._rows, 1):
+            parts.append(f'<h2 id="email-{number}">{number}. {html.escape(name)}</h2>'
+                         f"<p>To: {html.escape(to_addr)}<br>Subject: {html.escape(subject)}"
+                         + (f"<br>Language: {html.escape(language)}" if language else "")
+                         + f"</p><pre>{html.escape(body)}</pre>")
+        parts.append("</body></html>")
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(parts) + "\n")
+        os.replace(temp_path, self.path)
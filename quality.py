@@ -0,0 +1,142 @@
+import re
+
+# Limits from the generation prompts: subjects of at most 60 characters, bodies of 5-6 sentences
+MAX_SUBJECT_CHARS = 60
+MIN_BODY_WORDS = 30
+MAX_BODY_WORDS = 250
+
+# Everything the model adds around the email itself, removed in one substitution:
+# code fences (with their language tag), bold/italic markers, heading markers,
+# HTML tags, an echoed subject line and whole lines of commentary such as
+# "Here's the email:". Words like "Markdown" inside the text are left alone.
+_BODY_ARTIFACTS = re.compile(
+    r"```[\w-]*[ \t]*\n?"
+    r"|\*\*|__"
+    r"|</?(?:p|br|b|i|strong|em|div|span|html|body)\b[^>]*>"
+    r"|^[ \t]*(?:#{1,6}[ \t]+"
+    r"|(?:(?:Subject|Objet|Sujet)[ \t]*:|Here is|Here's|Voici|Note:|Remarque[ \t]?:|I hope this (?:helps|works|meets)"
+    r"|This email (?:is|was|has|should))[^\n]*(?:\n|$))",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+_SUBJECT_PREFIX = re.compile(r"^\s*(?:\*\*|#+\s*)?(?:Subject|Objet|Sujet)\s*:\s*", re.IGNORECASE)
+_SUBJECT_WRAPPING = " \t\"'`*“”«»‘’"
+
+# Template slots the model didn't fill in: "[Your Name]", "{{company}}", "<Votre nom>"
+_PLACEHOLDER = re.compile(
+    r"\[[^\]\n]{1,60}\]|\{\{[^}\n]*\}\}|<(?:your|votre|company|entreprise)[^>\n]*>", re.IGNORECASE
+)
+
+# The body is split into lowercase words once; length and language are counted from that list.
+# Function words are frequent and unambiguous enough to tell English from French.
+_WORD = re.compile(r"\w+")
+_FUNCTION_WORDS = {
+    "english": frozenset("the and to of in for with my your is am would have this that at as be look forward".split()),
+    "french": frozenset("le la les et des du une je vous votre mon ma mes pour avec dans est suis au aux sur".split()),
+}
+
+# Matched against the lowercased end of the body
+_SIGN_OFF = re.compile(r"\b(?:regards|sincerely|cordialement|salutations|bien à vous)\b")
+
+# Languages the function-word check can tell apart
+CHECKED_LANGUAGES = ("english", "french")
+
+
+def clean_body(body):
+    """Strip formatting markers and AI commentary from a generated body."""
+    return _BODY_ARTIFACTS.sub("", body).strip()
+
+
+def clean_subject(subject):
+    """First line of a generated subject, without a "Subject:" prefix, wrapping quotes or a final period."""
+    subject = next((line for line in subject.splitlines() if line.strip()), "")
+    subject = _SUBJECT_PREFIX.sub("", subject).strip(_SUBJECT_WRAPPING)
+    return subject.rstrip(".").strip()
+
+
+class Verdict:
+    """Outcome of checking a generated email: the cleaned texts and any problems left in them.
+
+    ``problems`` lists ``(part, code, detail)`` tuples, where ``part`` is
+    "subject" or "body" and ``code`` one of "empty", "placeholder",
+    "language", "sign_off", "too_short" or "too_long". Only the parts in
+    :attr:`failing` need to be generated again.
+    """
+
+    __slots__ = ("subject", "body", "problems")
+
+    def __init__(self, subject, body, problems):
+        self.subject = subject
+        self.body = body
+        self.problems = problems
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    @property
+    def failing(self):
+        return {part for part, _, _ in self.problems}
+
+    def describe(self, part):
+        """The problems of ``part``, as a sentence fragment for a regeneration prompt."""
+        return "; ".join(detail for problem_part, _, detail in self.problems if problem_part == part)
+
+    def __repr__(self):
+        return f"Verdict(ok={self.ok}, problems={[code for _, code, _ in self.problems]})"
+
+
+def check_subject(subject):
+    """Clean a generated subject; returns ``(subject, problems)``."""
+    problems = []
+    subject = clean_subject(subject or "")
+    if not subject:
+        problems.append(("subject", "empty", "the subject was empty"))
+    elif len(subject) > MAX_SUBJECT_CHARS:
+        problems.append(("subject", "too_long",
+                         f"the subject had {len(subject)} characters, more than {MAX_SUBJECT_CHARS}"))
+    placeholder = _PLACEHOLDER.search(subject)
+    if placeholder:
+        problems.append(("subject", "placeholder", f"the subject contained the placeholder {placeholder.group()}"))
+    return subject, problems
+
+
+def check_body(body, sender_name=None, language="English"):
+    """Clean a generated body and check it in one pass over its words; returns ``(body, problems)``."""
+    problems = []
+    body = clean_body(body or "")
+    if not body:
+        return body, [("body", "empty", "the body was empty")]
+
+    placeholder = _PLACEHOLDER.search(body)
+    if placeholder:
+        problems.append(("body", "placeholder", f"the body contained placeholders such as {placeholder.group()}"))
+
+    words = _WORD.findall(body.lower())
+    expected = (language or "English").strip().lower()
+    if expected in CHECKED_LANGUAGES:
+        other = "french" if expected == "english" else "english"
+        expected_count = sum(map(_FUNCTION_WORDS[expected].__contains__, words))
+        other_count = sum(map(_FUNCTION_WORDS[other].__contains__, words))
+        # Only judge bodies with enough function words to tell the languages apart
+        if other_count >= 8 and other_count > 2 * expected_count:
+            problems.append(("body", "language", f"the body was written in {other.capitalize()}, not {language}"))
+
+    if len(words) < MIN_BODY_WORDS:
+        problems.append(("body", "too_short", f"the body had only {len(words)} words"))
+    elif len(words) > MAX_BODY_WORDS:
+        problems.append(("body", "too_long", f"the body had {len(words)} words, more than {MAX_BODY_WORDS}"))
+
+    tail = body[-300:].lower()
+    if not _SIGN_OFF.search(tail) or (sender_name and sender_name.lower() not in tail):
+        problems.append(("body", "sign_off",
+                         f"the body did not end with the requested sign-off and the name {sender_name}"))
+
+    return body, problems
+
+
+def check_email(subject, body, sender_name=None, language="English"):
+    """Clean and check a generated subject and body; returns a :class:`Verdict`."""
+    subject, subject_problems = check_subject(subject)
+    body, body_problems = check_body(body, sender_name, language)
+    return Verdict(subject, body, subject_problems + body_problems)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+# Providers that ignore dots in the local part; googlemail.com is the same mailbox as gmail.com
+_DOTLESS_DOMAINS = {"gmail.com": "gmail.com", "googlemail.com": "gmail.com"}
+
+
+def normalize_address(address):
+    """Deliverable form of a listed address, or None if it isn't one.
+
+    Accepts what scraped lists tend to contain: surrounding whitespace,
+    "Name <hr@example.com>", "mailto:hr@example.com" and trailing
+    punctuation. The domain is lowercased (IDNA-encoded if it isn't ASCII);
+    the local part is kept as written.
+    """
+    if not isinstance(address, str):
+        return None
+    address = address.strip()
+    if "<" in address:
+        address = address[address.index("<") + 1:].partition(">")[0].strip()
+    if address[:7].lower() == "mailto:":
+        address = address[7:].partition("?")[0]
+    address = address.strip().rstrip(".,;")
+    local, at, domain = address.rpartition("@")
+    domain = domain.rstrip(".").lower()
+    if not at or not local or "." not in domain or any(c.isspace() for c in address):
+        return None
+    if not domain.isascii():
+        try:
+            domain = domain.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+    return f"{local}@{domain}"
+
+
+def inbox_key(address):
+    """The inbox an address delivers to: case-folded, without a "+tag", and without dots for Gmail."""
+    local, _, domain = address.lower().rpartition("@")
+    local = local.partition("+")[0]
+    domain = _DOTLESS_DOMAINS.get(domain, domain)
+    if domain == "gmail.com":
+        local = local.replace(".", "")
+    return f"{local}@{domain}"
+
+
+def domain_of(address):
+    return address.rpartition("@")[2].lower()
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ContactIndex:
+    """Every inbox emailed so far, across campaigns, as hashes in an append-only JSON Lines file.
+
+    Each line is ``{"inbox", "domain", "campaign", "at"}`` with the inbox
+    and domain stored as BLAKE2b digests, so the file can be kept and shared
+    between companies files without holding anyone's address. On open it is
+    replayed into a set of inbox digests and a count of emails per domain.
+    """
+
+    def __init__(self, path, fsync_every=20, fsync_interval=2.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._inboxes = set()
+        self.domains = Counter()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        data = json.loads(line)
+                        inbox, domain = data["inbox"], data["domain"]
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line from an interrupted run
+                        continue
+                    if inbox not in self._inboxes:
+                        self._inboxes.add(inbox)
+                        self.domains[domain] += 1
+        self._file = None
+
+    def __contains__(self, address):
+        return _digest(inbox_key(address)) in self._inboxes
+
+    def __len__(self):
+        return len(self._inboxes)
+
+    def domain_count(self, domain):
+        """Inboxes at ``domain`` emailed so far."""
+        return self.domains[_digest(domain)]
+
+    def record(self, address, campaign=None):
+        """Note that ``address`` has been emailed; an inbox already in the index is not added again."""
+        inbox = _digest(inbox_key(address))
+        if inbox in self._inboxes:
+            return
+        domain = _digest(domain_of(address))
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"inbox": inbox, "domain": domain, "campaign": campaign, "at": time.time()}) + "\n")
+        self._file.flush()
+        self._inboxes.add(inbox)
+        self.domains[domain] += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+class RecipientFilter:
+    """Decides, before anything is generated or sent, which companies get an email.
+
+    A company is suppressed if its address isn't valid, if its inbox was
+    already listed earlier in this run (whatever the case, "+tag" or company
+    name), if ``contacts`` shows the inbox was emailed in an earlier
+    campaign, or if its domain already has ``per_domain`` emails counting
+    earlier campaigns. Every suppression is kept in :attr:`suppressed` for
+    the report.
+    """
+
+    # Suppression reasons, by the code used in the report and run metrics
+    REASONS = {
+        "invalid": "not a valid email address",
+        "duplicate": "inbox already listed",
+        "contacted": "inbox emailed in an earlier campaign",
+        "domain_cap": "too many emails to this domain",
+    }
+
+    def __init__(self, contacts=None, per_domain=None):
+        self.contacts = contacts
+        self.per_domain = per_domain
+        self._listed = {}
+        # Addresses let through this run, by domain
+        self._domains = defaultdict(list)
+        self.suppressed = []
+
+    def check(self, company):
+        """None if ``company`` should be emailed, else the ``(reason, detail)`` it is suppressed for."""
+        address = normalize_address(company.email)
+        if address is None:
+            return self._suppress(company, "invalid", company.email)
+        inbox = inbox_key(address)
+        first = self._listed.get(inbox)
+        if first is not None:
+            return self._suppress(company, "duplicate", f"same inbox as {first}")
+        self._listed[inbox] = company.name
+        if self.contacts is not None and address in self.contacts:
+            return self._suppress(company, "contacted", address)
+        if self.per_domain:
+            domain = domain_of(address)
+            admitted = self._domains[domain]
+            if self.contacts is None:
+                count = len(admitted)
+            else:
+                # Inboxes admitted earlier in this run are already in the index once they have been sent
+                count = self.contacts.domain_count(domain) + sum(1 for earlier in admitted if earlier not in self.contacts)
+            if count >= self.per_domain:
+                return self._suppress(company, "domain_cap", f"{self.per_domain} for {domain}")
+            admitted.append(address)
+        return None
+
+    def _suppress(self, company, reason, detail):
+        self.suppressed.append((company, reason, detail))
+        return reason, detail
+
+    def counts(self):
+        """Number of suppressed companies per reason."""
+        return Counter(reason for _, reason, _ in self.suppressed)
+
+    def write_report(self, path):
+        """Write every suppressed company as a JSON Lines report, replacing the previous one."""
+        with open(path, "w", encoding="utf-8") as report:
+            for company, reason, detail in self.suppressed:
+                report.write(json.dumps({"name": company.name, "email": company.email, "reason": reason,
+                                         "detail": detail}) + "\n")
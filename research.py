@@ -0,0 +1,163 @@
+import json
+import os
+import re
+import threading
+import time
+
+REPORT_HEADER = "=" * 80 + "\nCOMPANY INFORMATION REPORT\n" + "=" * 80 + "\n\n"
+
+# The company fields the research prompt uses; an entry fetched for other values is stale
+RESEARCH_FIELDS = ("name", "city")
+
+_COMPANY_LINE = re.compile(r"^COMPANY: (.*)$", re.MULTILINE)
+_BULLET = re.compile(r"^(?:[*+-]|\d+\.)\s+")
+_EMPHASIS = re.compile(r"[*_`]+")
+
+
+def summarize(info, max_chars=600):
+    """Compress a Markdown research entry into a few plain sentences for a prompt.
+
+    Headings are dropped, bullets become sentences, and the summary stops at
+    the last whole point that fits in ``max_chars``.
+    """
+    summary = []
+    length = 0
+    for line in info.splitlines():
+        line = _EMPHASIS.sub("", _BULLET.sub("", line.strip())).strip().rstrip(".:")
+        if not line or line.startswith("#"):
+            continue
+        if length + len(line) + 2 > max_chars:
+            if not summary:
+                # A single long paragraph: keep its first max_chars, cut at a word
+                summary.append(line[:max_chars].rsplit(" ", 1)[0])
+            break
+        summary.append(line)
+        length += len(line) + 2
+    return ". ".join(summary) + "." if summary else ""
+
+
+class ResearchReport:
+    """The company research report, written one company at a time as results arrive.
+
+    Each result is appended to the Markdown report at ``path`` and, unless
+    ``index_path`` is None, to a JSON Lines index with one ``{"key", "name",
+    "city", "hash", "info", "fetched_at"}`` object per company. ``hash`` is
+    the company's content hash over :data:`RESEARCH_FIELDS`; an entry whose
+    company has since been renamed or moved counts as missing. Writes are flushed
+    immediately and fsynced in batches, like the send journal, so an
+    interrupted run keeps everything fetched before it stopped.
+
+    On open, only the byte offset of each company's latest index line is kept
+    in memory; :meth:`get` reads the line back on demand. Without an index,
+    companies already in the report are recognized by name.
+    """
+
+    def __init__(self, path, index_path=None, fsync_every=20, fsync_interval=2.0):
+        self.path = path
+        self.index_path = index_path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._offsets = {}
+        self._hashes = {}
+        self._names = set()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # Generation threads look up and record research concurrently
+        self._lock = threading.Lock()
+
+        if index_path and os.path.exists(index_path):
+            with open(index_path, "rb") as index:
+                offset = 0
+                for line in index:
+                    try:
+                        data = json.loads(line)
+                        self._offsets[data["key"]] = offset
+                        self._hashes[data["key"]] = data.get("hash")
+                        self._names.add(data["name"])
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line from an interrupted run
+                        pass
+                    offset += len(line)
+        elif os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as report:
+                self._names.update(name.strip() for name in _COMPANY_LINE.findall(report.read()))
+
+        new_report = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._report = open(path, "a", encoding="utf-8")
+        if new_report:
+            self._report.write(REPORT_HEADER)
+        self._index = None
+        if index_path:
+            self._index = open(index_path, "ab")
+            if self._index.tell() and not _ends_with_newline(index_path):
+                # Start new entries on their own line
+                self._index.write(b"\n")
+
+    def __contains__(self, company):
+        if self.index_path:
+            return company.id in self._offsets and self._current(company)
+        return company.name in self._names
+
+    def _current(self, company):
+        # Entries written before hashes were recorded are taken as current
+        return self._hashes.get(company.id) in (None, company.content_hash(RESEARCH_FIELDS))
+
+    def __len__(self):
+        return len(self._offsets) if self.index_path else len(self._names)
+
+    def get(self, company):
+        """The researched information for ``company``, or None (always None without an index, or if stale)."""
+        with self._lock:
+            offset = self._offsets.get(company.id)
+            if offset is None or not self._current(company):
+                return None
+            self._index.flush()
+        with open(self.index_path, "rb") as index:
+            index.seek(offset)
+            return json.loads(index.readline())["info"]
+
+    def record(self, company, info):
+        """Append ``info`` for ``company`` to the report (and the index)."""
+        with self._lock:
+            self._record(company, info)
+
+    def _record(self, company, info):
+        self._report.write("-" * 80 + "\n")
+        self._report.write(f"COMPANY: {company.name}\n")
+        self._report.write("-" * 80 + "\n\n")
+        self._report.write(f"{info}\n\n")
+        self._report.flush()
+        self._names.add(company.name)
+
+        if self._index:
+            content_hash = company.content_hash(RESEARCH_FIELDS)
+            line = json.dumps({"key": company.id, "name": company.name, "city": company.city, "hash": content_hash,
+                               "info": info, "fetched_at": time.time()}).encode("utf-8") + b"\n"
+            self._offsets[company.id] = self._index.tell()
+            self._hashes[company.id] = content_hash
+            self._index.write(line)
+            self._index.flush()
+
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._unsynced:
+            os.fsync(self._report.fileno())
+            if self._index:
+                os.fsync(self._index.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self._report.close()
+        if self._index:
+            self._index.close()
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
@@ -0,0 +1,145 @@
+import json
+import os
+import random
+import time
+
+from metrics import metrics
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# Gemini HTTP statuses worth retrying: request timeout, rate limited, server errors
+TRANSIENT_HTTP_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: attempt n waits a random time in [0, min(max_delay, base_delay * 2**(n-1))]."""
+
+    def __init__(self, attempts=3, base_delay=1.0, max_delay=60.0):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Seconds to wait after failed attempt number ``attempt`` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def _is_network_error(error):
+    # httpx (used by google-genai) raises its own ConnectError/ReadTimeout/... classes
+    name = type(error).__name__
+    return isinstance(error, (TimeoutError, ConnectionError)) or "Timeout" in name or name in (
+        "ConnectError", "ReadError", "WriteError", "RemoteProtocolError"
+    )
+
+
+def classify_gemini_error(error):
+    """TRANSIENT for rate limits, server errors and network trouble; PERMANENT otherwise (bad key, bad request)."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return TRANSIENT if code in TRANSIENT_HTTP_CODES else PERMANENT
+    return TRANSIENT if _is_network_error(error) else PERMANENT
+
+
+def classify_smtp_error(error):
+    """TRANSIENT for 4xx replies, dropped connections and timeouts; PERMANENT for 5xx replies (bad mailbox, auth)."""
+    import smtplib
+
+    from mailer import smtp_error_code
+
+    code = smtp_error_code(error)
+    if code is not None:
+        return TRANSIENT if 400 <= code < 500 else PERMANENT
+    if isinstance(error, smtplib.SMTPServerDisconnected) or _is_network_error(error):
+        return TRANSIENT
+    if isinstance(error, smtplib.SMTPException):
+        return PERMANENT
+    # Any other OSError while talking to the relay is a network problem
+    return TRANSIENT if isinstance(error, OSError) else PERMANENT
+
+
+def call_with_retry(func, classify, policy, stage=None):
+    """Call ``func()``, retrying transient failures per ``policy``; re-raises the last error.
+
+    Retries are counted in the metrics as ``<stage>.retries``.
+    """
+    attempt = 1
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= policy.attempts or classify(e) == PERMANENT:
+                raise
+            delay = policy.delay(attempt)
+            if stage:
+                metrics.increment(f"{stage}.retries")
+            print(f"⚠️ {type(e).__name__}: {e} - retrying in {delay:.1f}s (attempt {attempt + 1}/{policy.attempts})")
+            time.sleep(delay)
+            attempt += 1
+
+
+async def call_with_retry_async(func, classify, policy, stage=None):
+    """Like :func:`call_with_retry`, for a coroutine function ``func``; backs off with ``asyncio.sleep``."""
+    import asyncio
+
+    attempt = 1
+    while True:
+        try:
+            return await func()
+        except Exception as e:
+            if attempt >= policy.attempts or classify(e) == PERMANENT:
+                raise
+            delay = policy.delay(attempt)
+            if stage:
+                metrics.increment(f"{stage}.retries")
+            print(f"⚠️ {type(e).__name__}: {e} - retrying in {delay:.1f}s (attempt {attempt + 1}/{policy.attempts})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class DeadLetterQueue:
+    """Append-only JSON Lines file of recipients that failed permanently, so later runs don't retry them.
+
+    Delete the file (or a line of it) to try those companies again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._keys = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        self._keys.add(json.loads(line)["key"])
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line from an interrupted run
+                        continue
+        self._file = None
+
+    def __contains__(self, company):
+        return company.id in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def record(self, company, result):
+        """Record ``company`` as undeliverable, with the failed :class:`~mailer.SendResult`."""
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({
+            "key": company.id,
+            "name": company.name,
+            "email": result.recipient,
+            "code": result.code,
+            "error": result.error,
+            "attempts": result.attempts,
+            "failed_at": time.time(),
+        }) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._keys.add(company.id)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+
+# SMTP replies that mean "slow down and try again later"
+THROTTLE_CODES = {421, 450, 451, 452}
+
+
+class SendScheduler:
+    """Decides when the next email may go out.
+
+    Sends are spaced by an adaptive interval that grows by ``backoff_factor``
+    whenever the relay answers with a throttling reply (421/450/451/452) and
+    shrinks back towards ``min_interval`` after each accepted message. On top
+    of that, sliding-window quotas (per minute/hour/day) and a minimum gap
+    between two emails to the same recipient domain are always respected.
+
+    :meth:`wait` reserves a slot and sleeps until it, so work done between
+    two sends (rendering, MIME building) overlaps the waiting window instead
+    of adding to it. Reservations are made under a lock, so several sending
+    threads can share one scheduler.
+    """
+
+    def __init__(self, per_minute=None, per_hour=None, per_day=None, domain_spacing=0,
+                 min_interval=1.0, max_interval=300.0, backoff_factor=2.0, recovery_factor=0.8):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.domain_spacing = domain_spacing
+        self.interval = min_interval
+
+        self._windows = [
+            (limit, seconds, deque())
+            for limit, seconds in ((per_minute, 60), (per_hour, 3600), (per_day, 86400))
+            if limit
+        ]
+        self._last_send = 0.0
+        self._paused_until = 0.0
+        self._last_by_domain = {}
+        self._lock = threading.Lock()
+        self.stats = {"sent": 0, "throttled": 0, "waited": 0.0}
+
+    def _next_slot(self, domain, now):
+        ready_at = max(now, self._last_send + self.interval, self._paused_until)
+        if self.domain_spacing and domain in self._last_by_domain:
+            ready_at = max(ready_at, self._last_by_domain[domain] + self.domain_spacing)
+        # Pushing the slot later only empties the other windows further, so one pass is enough
+        for limit, seconds, sent_at in self._windows:
+            while sent_at and sent_at[0] <= ready_at - seconds:
+                sent_at.popleft()
+            if len(sent_at) >= limit:
+                # Wait until enough earlier sends have dropped out of the window
+                ready_at = max(ready_at, sent_at[len(sent_at) - limit] + seconds)
+        return ready_at
+
+    def wait(self, domain=None):
+        """Block until an email to ``domain`` may be sent, and reserve that slot."""
+        delay = self.reserve(domain)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, domain=None):
+        """Reserve the next slot for an email to ``domain`` and return the seconds until it (without sleeping).
+
+        For callers that wait their own way, e.g. ``await asyncio.sleep(...)``.
+        """
+        with self._lock:
+            now = time.monotonic()
+            ready_at = self._next_slot(domain, now)
+            self._last_send = ready_at
+            if domain:
+                self._last_by_domain[domain] = ready_at
+            for _, _, sent_at in self._windows:
+                sent_at.append(ready_at)
+            self.stats["waited"] += ready_at - now
+        metrics.observe("send.wait", max(ready_at - now, 0.0))
+        return ready_at - now
+
+    def record_success(self):
+        """An email was accepted: ease the interval back towards ``min_interval``."""
+        with self._lock:
+            self.stats["sent"] += 1
+            self.interval = max(self.min_interval, self.interval * self.recovery_factor)
+
+    def record_failure(self, code=None):
+        """A send failed with SMTP reply ``code`` (if any); back off if the relay is throttling us."""
+        if code not in THROTTLE_CODES:
+            return
+        metrics.increment("smtp.throttled")
+        with self._lock:
+            self.stats["throttled"] += 1
+            self.interval = min(self.max_interval, max(self.interval, 1.0) * self.backoff_factor)
+            self._paused_until = time.monotonic() + self.interval
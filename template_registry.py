@@ -0,0 +1,93 @@
+import os
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateNotFound
+
+# Language names used in companies files, mapped to the template file for that language
+LANGUAGE_CODES = {
+    "english": "en",
+    "french": "fr",
+    "spanish": "es",
+    "german": "de",
+    "italian": "it",
+    "portuguese": "pt",
+    "dutch": "nl",
+    "arabic": "ar",
+}
+
+TEMPLATE_SUFFIX = ".txt"
+
+
+def language_code(language):
+    """Template key for a company's language: "French" -> "fr", "fr-CA" -> "fr-ca", None -> the default."""
+    if not language:
+        return None
+    language = language.strip().lower()
+    return LANGUAGE_CODES.get(language, language)
+
+
+class TemplateRegistry:
+    """Email templates loaded from ``directory``, one file per language code (``en.txt``, ``fr.txt``, ...).
+
+    All templates share one Jinja2 environment and are compiled at most once
+    per process. With ``cache_dir``, the compiled bytecode is also kept on
+    disk, so later runs skip compilation too. A variant such as ``fr-ca.txt``
+    is used for "fr-CA" and falls back to ``fr.txt``, and languages without a
+    template use ``default``.
+    """
+
+    def __init__(self, directory, cache_dir=None, default="en"):
+        self.directory = directory
+        self.default = default
+        bytecode_cache = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        self.environment = Environment(
+            loader=FileSystemLoader(directory),
+            bytecode_cache=bytecode_cache,
+            # Templates don't change while a run is in progress; skip the mtime check on every lookup
+            auto_reload=False,
+        )
+        self._templates = {}
+
+    def languages(self):
+        """Language codes that have a template."""
+        return sorted(
+            name[:-len(TEMPLATE_SUFFIX)]
+            for name in self.environment.list_templates()
+            if name.endswith(TEMPLATE_SUFFIX)
+        )
+
+    def get(self, language):
+        """The compiled template for ``language`` (a language name or code)."""
+        code = language_code(language) or self.default
+        template = self._templates.get(code)
+        if template is None:
+            template = self._templates[code] = self._load(code)
+        return template
+
+    def _load(self, code):
+        candidates = [code, code.split("-")[0], self.default]
+        for candidate in dict.fromkeys(candidates):
+            try:
+                return self.environment.get_template(candidate + TEMPLATE_SUFFIX)
+            except TemplateNotFound:
+                continue
+        raise TemplateNotFound(f"{code}{TEMPLATE_SUFFIX} (no {self.default}{TEMPLATE_SUFFIX} fallback in {self.directory})")
+
+    def render(self, language, **context):
+        return self.get(language).render(context)
+
+    def render_many(self, companies, **context):
+        """Yield ``(company, body)`` for each company, lazily and in order.
+
+        ``context`` holds the values shared by every email (the sender's
+        details); each company adds its own ``name`` and ``contact_person``,
+        and the whole record as ``company`` for templates that need more.
+        """
+        context = dict(context)
+        for company in companies:
+            context["company"] = company
+            context["name"] = company.name
+            context["contact_person"] = company.contact_person
+            yield company, self.get(company.language).render(context)